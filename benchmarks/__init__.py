@@ -0,0 +1 @@
+"""Benchmarks of makeflow generation, run with airspeed velocity (asv)."""
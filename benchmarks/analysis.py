@@ -0,0 +1,82 @@
+# -*- mode: python; coding: utf-8 -*-
+# Copyright (c) 2018 The HERA Collaboration
+# Licensed under the 2-clause BSD License
+"""Benchmarks of building analysis makeflows."""
+
+import os
+import shutil
+import tempfile
+
+import toml
+
+from hera_opm import mf_tools as mt
+
+from .common import (
+    ANALYSIS_CONFIGS,
+    NOBSIDS,
+    count_files,
+    sample_config,
+    synthetic_obsids,
+)
+
+
+class AnalysisMakeflow:
+    """Build analysis makeflows from the sample configs."""
+
+    params = (ANALYSIS_CONFIGS, NOBSIDS)
+    param_names = ["config", "nobsids"]
+    number = 1
+    repeat = (1, 3, 60.0)
+    timeout = 3600
+
+    def setup(self, config, nobsids):
+        """Make the obsids and the work directory."""
+        self.obsids = synthetic_obsids(nobsids)
+        self.config_file = sample_config(config)
+        self.work_dir = tempfile.mkdtemp()
+
+    def teardown(self, config, nobsids):
+        """Remove the work directory."""
+        shutil.rmtree(self.work_dir)
+
+    def build(self):
+        """Build the makeflow."""
+        mt.build_analysis_makeflow_from_config(
+            self.obsids, self.config_file, work_dir=self.work_dir
+        )
+
+    def time_build(self, config, nobsids):
+        """Time building the makeflow."""
+        self.build()
+
+    def peakmem_build(self, config, nobsids):
+        """Measure the peak memory of building the makeflow."""
+        self.build()
+
+    def track_files_written(self, config, nobsids):
+        """Count the files written by building the makeflow."""
+        self.build()
+        return count_files(self.work_dir)
+
+    track_files_written.unit = "files"
+
+
+class SharedWrappersMakeflow(AnalysisMakeflow):
+    """Build analysis makeflows with one wrapper script per action."""
+
+    params = (["nrao_rtp", "nrao_rtp_chunk_size"], NOBSIDS)
+
+    def setup(self, config, nobsids):
+        """Make the obsids, the work directory, and the config."""
+        super().setup(config, nobsids)
+        config = toml.load(self.config_file)
+        config["Options"]["shared_wrappers"] = True
+        self.config_dir = tempfile.mkdtemp()
+        self.config_file = os.path.join(self.config_dir, "shared_wrappers.toml")
+        with open(self.config_file, "w") as f:
+            toml.dump(config, f)
+
+    def teardown(self, config, nobsids):
+        """Remove the work directory and the config."""
+        super().teardown(config, nobsids)
+        shutil.rmtree(self.config_dir)
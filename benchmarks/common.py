@@ -0,0 +1,91 @@
+# -*- mode: python; coding: utf-8 -*-
+# Copyright (c) 2018 The HERA Collaboration
+# Licensed under the 2-clause BSD License
+"""Helpers shared by the benchmarks."""
+
+import os
+import math
+
+from hera_opm.data import DATA_PATH
+
+SAMPLE_CONFIG_PATH = os.path.join(DATA_PATH, "sample_config")
+
+# sample configs covering chunking, striding, "all" and SETUP/TEARDOWN
+ANALYSIS_CONFIGS = [
+    "nrao_rtp",
+    "nrao_rtp_chunk_size",
+    "nrao_rtp_chunk_size_all",
+    "nrao_rtp_stride_length",
+    "nrao_rtp_setup_teardown",
+]
+
+# total number of obsids in a workflow
+NOBSIDS = [1000, 10000, 100000]
+
+
+def sample_config(name):
+    """Get the full path to a sample config file.
+
+    Parameters
+    ----------
+    name : str
+        The name of the config file, without extension.
+
+    Returns
+    -------
+    str
+        The full path to the config file.
+
+    """
+    return os.path.join(SAMPLE_CONFIG_PATH, name + ".toml")
+
+
+def synthetic_obsids(nobsids, njds=3, start_jd=2459000, data_dir="/data"):
+    """Make a list of obsid paths spread evenly over consecutive JDs.
+
+    The files do not exist; only their names are used to build makeflows.
+
+    Parameters
+    ----------
+    nobsids : int
+        The total number of obsids.
+    njds : int, optional
+        The number of JDs to spread the obsids over.
+    start_jd : int, optional
+        The first JD.
+    data_dir : str, optional
+        The top-level directory, which has a subdirectory per JD.
+
+    Returns
+    -------
+    list of str
+        The paths of the obsids.
+
+    """
+    per_jd = int(math.ceil(nobsids / njds))
+    # keep the fractional JDs within 5 digits
+    spacing = max(1, 89999 // per_jd)
+    obsids = []
+    for i in range(nobsids):
+        jd = start_jd + i // per_jd
+        frac = 10000 + (i % per_jd) * spacing
+        obsids.append(os.path.join(data_dir, str(jd), f"zen.{jd}.{frac:05d}.sum.uvh5"))
+    return obsids
+
+
+def count_files(directory):
+    """Count the files in a directory.
+
+    Parameters
+    ----------
+    directory : str
+        The directory.
+
+    Returns
+    -------
+    int
+        The number of files in the directory.
+
+    """
+    with os.scandir(directory) as entries:
+        return sum(1 for entry in entries if entry.is_file())
@@ -0,0 +1,104 @@
+# -*- mode: python; coding: utf-8 -*-
+# Copyright (c) 2018 The HERA Collaboration
+# Licensed under the 2-clause BSD License
+"""Benchmarks of building LST-binning makeflows."""
+
+import shutil
+import tempfile
+from pathlib import Path
+
+import toml
+
+from hera_opm import mf_tools as mt
+from hera_opm.data import DATA_PATH
+
+from .common import count_files
+
+try:
+    import hera_cal  # noqa: F401
+
+    HAVE_HERA_CAL = True
+except ImportError:
+    HAVE_HERA_CAL = False
+
+
+class LstbinMakeflow:
+    """Build an LST-binning makeflow from the sample data files.
+
+    These benchmarks require hera_cal, and are skipped if it is not installed.
+
+    """
+
+    params = [None, 1]
+    param_names = ["bl_chunk_size"]
+    number = 1
+    repeat = (1, 3, 60.0)
+    timeout = 600
+
+    def setup(self, bl_chunk_size):
+        """Write the config file and make the work directory."""
+        if not HAVE_HERA_CAL:
+            raise NotImplementedError("hera_cal is required for lstbin benchmarks")
+
+        self.work_dir = Path(tempfile.mkdtemp())
+        self.outdir = Path(tempfile.mkdtemp())
+        lstbin_opts = {
+            "parallelize": True,
+            "outdir": str(self.outdir),
+            "parent_dir": str(self.outdir),
+        }
+        if bl_chunk_size is not None:
+            lstbin_opts["bl_chunk_size"] = bl_chunk_size
+        config = {
+            "Options": {
+                "makeflow_type": "lstbin",
+                "path_to_do_scripts": "/an/unused/path/for/benchmarks",
+                "base_mem": 10000,
+                "base_cpu": 1,
+            },
+            "LSTBIN_OPTS": lstbin_opts,
+            "FILE_CFG": {
+                "nlsts_per_file": 60,
+                "lst_start": 0.0,
+                "datadir": str(DATA_PATH),
+                "datafiles": [
+                    "zen.2458043.*.HH.uvh5",
+                    "zen.2458044.*.HH.uvh5",
+                    "zen.2458045.*.HH.uvh5",
+                ],
+            },
+            "LSTAVG_OPTS": {
+                "outdir": str(self.outdir),
+                "fname_format": "zen.{kind}.{lst:7.5f}.sum.uvh5",
+            },
+            "WorkFlow": {"actions": ["LSTBIN"]},
+            "LSTBIN": {"args": ["lstconf", "lstavg_toml_file", "output_file_select"]},
+        }
+        self.config_file = self.outdir / "lstbin.toml"
+        with open(self.config_file, "w") as f:
+            toml.dump(config, f)
+
+    def teardown(self, bl_chunk_size):
+        """Remove the work and output directories."""
+        if HAVE_HERA_CAL:
+            shutil.rmtree(self.work_dir)
+            shutil.rmtree(self.outdir)
+
+    def build(self):
+        """Build the makeflow."""
+        mt.build_lstbin_makeflow_from_config(self.config_file, work_dir=self.work_dir)
+
+    def time_build(self, bl_chunk_size):
+        """Time building the makeflow."""
+        self.build()
+
+    def peakmem_build(self, bl_chunk_size):
+        """Measure the peak memory of building the makeflow."""
+        self.build()
+
+    def track_files_written(self, bl_chunk_size):
+        """Count the files written by building the makeflow."""
+        self.build()
+        return count_files(self.work_dir)
+
+    track_files_written.unit = "files"
@@ -0,0 +1,65 @@
+# -*- mode: python; coding: utf-8 -*-
+# Copyright (c) 2018 The HERA Collaboration
+# Licensed under the 2-clause BSD License
+"""Benchmarks of sorting and partitioning obsids."""
+
+import os
+
+from hera_opm import mf_tools as mt
+
+from .common import NOBSIDS, synthetic_obsids
+
+
+class StridePartitioning:
+    """Partition obsids into strided chunks."""
+
+    params = (NOBSIDS, ["1", "3", "10", "all"], ["1", "10"])
+    param_names = ["nobsids", "chunk_size", "stride_length"]
+
+    def setup(self, nobsids, chunk_size, stride_length):
+        """Make the obsids."""
+        self.obsids = synthetic_obsids(nobsids)
+        if chunk_size == "all":
+            self.chunk_size = str(nobsids)
+        else:
+            self.chunk_size = chunk_size
+
+    def time_determine_stride_partitioning(self, nobsids, chunk_size, stride_length):
+        """Time getting the primary obsids of every obsid."""
+        mt._determine_stride_partitioning(
+            self.obsids,
+            stride_length=stride_length,
+            chunk_size=self.chunk_size,
+            time_centered=True,
+            collect_stragglers=False,
+        )
+
+    def peakmem_determine_stride_partitioning(self, nobsids, chunk_size, stride_length):
+        """Measure the peak memory of getting the primary obsids."""
+        mt._determine_stride_partitioning(
+            self.obsids,
+            stride_length=stride_length,
+            chunk_size=self.chunk_size,
+            time_centered=True,
+            collect_stragglers=False,
+        )
+
+
+class SortObsids:
+    """Sort obsids spread over several JDs."""
+
+    params = NOBSIDS
+    param_names = ["nobsids"]
+
+    def setup(self, nobsids):
+        """Make the obsids, in reverse order."""
+        self.obsids = synthetic_obsids(nobsids)[::-1]
+        self.jd = mt.get_jd(os.path.basename(self.obsids[0]))
+
+    def time_sort_obsids(self, nobsids):
+        """Time sorting the obsids."""
+        mt.sort_obsids(self.obsids)
+
+    def time_sort_obsids_jd(self, nobsids):
+        """Time sorting the obsids of a single JD."""
+        mt.sort_obsids(self.obsids, jd=self.jd)
@@ -6,7 +6,17 @@ from __future__ import annotations
 
 import os
 import re
+import array
+import bisect
+import contextlib
+import copy
+import functools
+import heapq
+import hashlib
+import json
+import statistics
 import time
+import glob
 import gzip
 import shutil
 import subprocess
@@ -15,6 +25,11 @@ import toml
 from pathlib import Path
 import math
 from itertools import product
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+# the fields of a standard data file name, "zen.<jd>.<frac_jd>.<pol>.<suffix>"
+_OBSID_REGEX = re.compile(r"zen\.([0-9]{7})\.([0-9]{5})\.(?:([^.]{2})\.)?(.*)")
 
 
 def get_jd(filename):
@@ -34,22 +49,83 @@ def get_jd(filename):
         filename does not match assumed format.
 
     """
-    try:
-        m = re.match(r"zen\.([0-9]{7})\.[0-9]{5}\.", filename)
-        return m.groups()[0]
-    except AttributeError:
-        if not get_jd._warned:
-            wmsg = f"Unable to figure out the JD associated with {filename}. "
-            wmsg += "This may affect chunking and prerequisites. "
-            wmsg += "This may also be true for other files (warning suppressed)."
-            warnings.warn(wmsg)
-            get_jd._warned = True
+    m = _OBSID_REGEX.match(filename)
+    if m is None:
+        _warn_unknown_jd(filename)
         return None
+    return m.group(1)
 
 
 get_jd._warned = False
 
 
+def _warn_unknown_jd(filename):
+    """Warn that the JD of a file is not known, for the first such file only."""
+    if not get_jd._warned:
+        wmsg = f"Unable to figure out the JD associated with {filename}. "
+        wmsg += "This may affect chunking and prerequisites. "
+        wmsg += "This may also be true for other files (warning suppressed)."
+        warnings.warn(wmsg)
+        get_jd._warned = True
+
+
+class Obsid:
+    """The fields of the name of a data file, parsed once.
+
+    An `ObsidIndex` keeps the parsed obsids of a build, so that their names
+    are not parsed again.
+
+    Parameters
+    ----------
+    path : str
+        The path to the data file. Its name is assumed to follow the standard
+        convention, "zen.<jd>.<frac_jd>.<pol>.<suffix>", e.g.,
+        `zen.2458000.12345.xx.uv`. If it does not, the fields are None.
+
+    Attributes
+    ----------
+    path : str
+        The path to the data file, as given.
+    basename : str
+        The name of the data file.
+    jd : str or None
+        The integer JD.
+    frac_jd : str or None
+        The five digits of the fractional part of the JD.
+    pol : str or None
+        The two characters after the fractional JD, if there is a field after
+        them, as found by `get_pol` in the task scripts (e.g., "xx").
+    suffix : str or None
+        The rest of the name (e.g., "uv").
+
+    """
+
+    __slots__ = ("path", "basename", "jd", "frac_jd", "pol", "suffix")
+
+    def __init__(self, path):
+        self.path = path
+        self.basename = os.path.basename(os.path.abspath(path))
+        m = _OBSID_REGEX.match(self.basename)
+        if m is None:
+            self.jd = self.frac_jd = self.pol = self.suffix = None
+        else:
+            self.jd, self.frac_jd, self.pol, self.suffix = m.groups()
+
+    def __repr__(self):
+        """Get the representation of the obsid."""
+        return f"Obsid({self.path!r})"
+
+    def __eq__(self, other):
+        """Check whether two obsids have the same path."""
+        if not isinstance(other, Obsid):
+            return NotImplemented
+        return self.path == other.path
+
+    def __hash__(self):
+        """Get the hash of the path of the obsid."""
+        return hash(self.path)
+
+
 def _interpolate_config(config, entry):
     """Interpolate entries in the configuration file.
 
@@ -173,17 +249,216 @@ def make_outfile_name(obsid, action):
     return [f"{obsid}.{action}.out"]
 
 
+class ObsidIndex:
+    """A sorted view of a list of obsids, precomputed once per build.
+
+    Building a makeflow requires finding the time neighbors of every obsid for
+    every action. Rather than re-sorting and re-filtering the full list of
+    obsids for each lookup, this object sorts the list once and keeps the
+    lookup tables needed to find an obsid's position and the range of obsids
+    sharing its JD in constant time.
+
+    Parameters
+    ----------
+    obsids : list or tuple of str
+        The obsids to index. They are sorted by filename; the entries
+        themselves (e.g., full paths) are retained as given.
+
+    Attributes
+    ----------
+    obsids : list of str
+        The input obsids, sorted by filename.
+    parsed : list of Obsid
+        The parsed names of the sorted obsids. Each path is parsed once, and
+        repeated paths share the same object.
+    basenames : list of str
+        The filenames of the sorted obsids.
+    positions : dict
+        Mapping of filename to its position in the sorted list.
+
+    """
+
+    __slots__ = (
+        "obsids",
+        "parsed",
+        "basenames",
+        "positions",
+        "_jd_ranges",
+        "_partitions",
+    )
+
+    def __init__(self, obsids):
+        interned = {}
+        parsed = []
+        for path in obsids:
+            obsid = interned.get(path)
+            if obsid is None:
+                obsid = interned[path] = Obsid(path)
+            parsed.append(obsid)
+        order = sorted(range(len(parsed)), key=lambda i: parsed[i].basename)
+        self.obsids = [obsids[i] for i in order]
+        self.parsed = [parsed[i] for i in order]
+        self.basenames = [obsid.basename for obsid in self.parsed]
+        self.positions = {}
+        for i, basename in enumerate(self.basenames):
+            self.positions.setdefault(basename, i)
+        # the JD lookup table is only built if needed, since parsing the JD of
+        # a non-standard filename raises a warning
+        self._jd_ranges = None
+        self._partitions = {}
+
+    def __len__(self):
+        """Get the number of obsids."""
+        return len(self.basenames)
+
+    @property
+    def jd_ranges(self):
+        """dict: Mapping of JD to the (start, stop) range of its obsids.
+
+        The obsids of a JD are contiguous once sorted by filename, which is
+        checked. Obsids whose JD is not known are skipped by the check, and
+        included in the range of a JD if they sort among its obsids. If the JD
+        of some obsids is not known, the None entry is the range of all
+        obsids, as for `jd_range`.
+        """
+        if self._jd_ranges is None:
+            jd_ranges = {}
+            unknown = False
+            last_jd = None
+            for i, obsid in enumerate(self.parsed):
+                jd = obsid.jd
+                if jd is None:
+                    _warn_unknown_jd(obsid.basename)
+                    unknown = True
+                    continue
+                rng = jd_ranges.get(jd)
+                if rng is None:
+                    jd_ranges[jd] = [i, i + 1]
+                elif jd == last_jd:
+                    rng[1] = i + 1
+                else:
+                    raise ValueError(
+                        f"the obsids of JD {jd} are not contiguous when sorted "
+                        "by filename"
+                    )
+                last_jd = jd
+            if unknown:
+                jd_ranges[None] = [0, len(self.parsed)]
+            self._jd_ranges = {jd: tuple(rng) for jd, rng in jd_ranges.items()}
+        return self._jd_ranges
+
+    def position(self, obsid):
+        """Get the position of an obsid in the sorted list.
+
+        Parameters
+        ----------
+        obsid : str
+            The filename of the obsid.
+
+        Returns
+        -------
+        int
+            The index of `obsid` in the sorted list of obsids.
+
+        Raises
+        ------
+        ValueError
+            Raised if the obsid is not in the index.
+
+        """
+        try:
+            return self.positions[obsid]
+        except KeyError:
+            raise ValueError("obsid {} not found in list of obsids".format(obsid))
+
+    def jd_range(self, jd):
+        """Get the range of obsids that belong to a given JD.
+
+        Parameters
+        ----------
+        jd : str or None
+            The integer JD. If None, the range of all obsids is returned.
+
+        Returns
+        -------
+        tuple of int
+            The (start, stop) indices of the obsids on `jd`.
+
+        """
+        if jd is None:
+            return 0, len(self.basenames)
+        return self.jd_ranges.get(jd, (0, 0))
+
+    def day_range(self, obsid):
+        """Get the range of obsids that share the JD of a given obsid.
+
+        Parameters
+        ----------
+        obsid : str
+            The filename of the obsid.
+
+        Returns
+        -------
+        tuple of int
+            The (start, stop) indices of the obsids on the same JD as `obsid`.
+            If the JD of `obsid` cannot be determined, this is the range of all
+            obsids.
+
+        """
+        position = self.positions.get(obsid)
+        if position is None:
+            return self.jd_range(get_jd(obsid))
+        return self.jd_range(self.parsed[position].jd)
+
+    def partition(
+        self,
+        stride_length=None,
+        chunk_size=None,
+        time_centered=None,
+        collect_stragglers=None,
+    ):
+        """Get the stride partitioning of the obsids, computing it only once.
+
+        Parameters
+        ----------
+        stride_length, chunk_size, time_centered, collect_stragglers
+            See `_determine_stride_partitioning`.
+
+        Returns
+        -------
+        StridePartition
+            The partitioning of the indexed obsids.
+
+        """
+        key = (stride_length, chunk_size, time_centered, collect_stragglers)
+        try:
+            return self._partitions[key]
+        except KeyError:
+            partition = _stride_partition(self, *key)
+            self._partitions[key] = partition
+            return partition
+
+
+def _get_obsid_index(obsids):
+    """Return `obsids` as an ObsidIndex, building one if necessary."""
+    if isinstance(obsids, ObsidIndex):
+        return obsids
+    return ObsidIndex(obsids)
+
+
 def sort_obsids(obsids, jd=None, return_basenames=False):
     """
     Sort obsids in a given day.
 
     Parameters
     ----------
-    obsids : list or tuple of str
-        A list of all obsids to be sorted.
+    obsids : list or tuple of str, or ObsidIndex
+        A list of all obsids to be sorted. If an ObsidIndex is passed, its
+        precomputed ordering is used.
     jd : str, optional
-        The Julian date to include in sorted obsids. If not provided, includes
-        all obsids regardless of day.
+        The Julian date to include in sorted obsids, which must be the integer
+        JD of the obsids (see `get_jd`). If not provided, includes all obsids
+        regardless of day.
     return_basenames : bool, optional
         Whether to return only basenames of paths of obsids. Default is False.
         If False, return full path as given in input.
@@ -193,23 +468,73 @@ def sort_obsids(obsids, jd=None, return_basenames=False):
     sortd_obsids : list of str
         Obsids (basename or absolute path), sorted by filename for given Julian day.
     """
-    if jd is None:
-        jd = ""
-    # need to get just the filename, and just ones on the same day
-    keys = [
-        os.path.basename(os.path.abspath(o))
-        for o in obsids
-        if jd in os.path.basename(os.path.abspath(o))
-    ]
-    to_sort = list(zip(keys, range(len(obsids))))
-    temp = sorted(to_sort, key=lambda obs: obs[0])
-    argsort = [obs[1] for obs in temp]
-
-    sorted_obsids = [obsids[i] for i in argsort]
+    index = _get_obsid_index(obsids)
+    i0, i1 = index.jd_range(jd)
     if return_basenames:
-        sorted_obsids = [os.path.basename(obsid) for obsid in sorted_obsids]
+        return index.basenames[i0:i1]
+    return index.obsids[i0:i1]
+
+
+def _chunk_bounds(
+    obs_idx,
+    day_start,
+    day_stop,
+    chunk_size,
+    time_centered,
+    stride_length,
+    collect_stragglers,
+):
+    """Find the range of obsids in a chunk around a given obsid.
+
+    Parameters
+    ----------
+    obs_idx : int
+        The position of the obsid in the sorted list of obsids.
+    day_start, day_stop : int
+        The range of positions of obsids on the same JD as the obsid.
+    chunk_size : str or int
+        Number of obsids in the chunk, or "all".
+    time_centered : bool
+        Whether the obsid should be in the center of the chunk.
+    stride_length : str or int
+        Length of the stride.
+    collect_stragglers : bool
+        Whether to include the straggler files into the last group.
+
+    Returns
+    -------
+    tuple of int
+        The (start, stop) positions of the chunk in the sorted list of obsids.
 
-    return sorted_obsids
+    """
+    if chunk_size == "all":
+        return day_start, day_stop
+
+    # assume we got an integer as a string; try to make sense of it
+    try:
+        chunk_size = int(chunk_size)
+    except ValueError:
+        raise ValueError("chunk_size must be parsable as an int")
+    if chunk_size < 1:
+        raise ValueError("chunk_size must be an integer >= 1.")
+    # get obsids before and after; make sure we don't have an IndexError
+    if time_centered:
+        i0 = max(obs_idx - chunk_size // 2, day_start)
+        i1 = min(obs_idx + (chunk_size + 1) // 2, day_stop)
+    else:
+        i0 = obs_idx
+        i1 = min(obs_idx + chunk_size, day_stop)
+    if (i1 + int(stride_length) > day_stop) and collect_stragglers:
+        # Calculate number of obsids that are skipped between strides
+        gap = int(stride_length) - chunk_size
+        if gap > 0:
+            warnings.warn(
+                "Collecting stragglers is incompatible with gaps between "
+                "consecutive strides. Not collecting stragglers..."
+            )
+        else:
+            i1 = day_stop
+    return i0, i1
 
 
 def make_chunk_list(
@@ -231,9 +556,9 @@ def make_chunk_list(
         The obsid of the current file.
     action : str
         The action corresponding to the prereqs.
-    obsids : list of str
+    obsids : list of str or ObsidIndex
         A list of all obsids for the given day; uses this list (sorted) to
-        define neighbors
+        define neighbors. Passing an ObsidIndex avoids re-sorting the list.
     chunk_size : str
         Number of obsids to include in the list. If set to the
         string "all", then all neighbors from that JD are added. Default is "1"
@@ -275,51 +600,23 @@ def make_chunk_list(
         stride_length = "1"
     if collect_stragglers is None:
         collect_stragglers = False
-    chunk_list = []
-
-    # extract the integer JD of the current file
-    jd = get_jd(obsid)
-
-    # find the neighbors of current obsid in list of obsids
-    obsids = sort_obsids(obsids, jd=jd, return_basenames=True)
-
-    try:
-        obs_idx = obsids.index(obsid)
-    except ValueError:
-        raise ValueError("obsid {} not found in list of obsids".format(obsid))
 
-    if chunk_size == "all":
-        i0 = 0
-        i1 = len(obsids)
-    else:
-        # assume we got an integer as a string; try to make sense of it
-        try:
-            chunk_size = int(chunk_size)
-        except ValueError:
-            raise ValueError("chunk_size must be parsable as an int")
-        if chunk_size < 1:
-            raise ValueError("chunk_size must be an integer >= 1.")
-        # get obsids before and after; make sure we don't have an IndexError
-        if time_centered:
-            i0 = max(obs_idx - chunk_size // 2, 0)
-            i1 = min(obs_idx + (chunk_size + 1) // 2, len(obsids))
-        else:
-            i0 = obs_idx
-            i1 = min(obs_idx + chunk_size, len(obsids))
-        if (i1 + int(stride_length) > len(obsids)) and collect_stragglers:
-            # Calculate number of obsids that are skipped between strides
-            gap = int(stride_length) - chunk_size
-            if gap > 0:
-                warnings.warn(
-                    "Collecting stragglers is incompatible with gaps between "
-                    "consecutive strides. Not collecting stragglers..."
-                )
-            else:
-                i1 = len(obsids)
+    # find the neighbors of current obsid in list of obsids on the same JD
+    index = _get_obsid_index(obsids)
+    obs_idx = index.position(obsid)
+    day_start, day_stop = index.day_range(obsid)
+    i0, i1 = _chunk_bounds(
+        obs_idx,
+        day_start,
+        day_stop,
+        chunk_size,
+        time_centered,
+        stride_length,
+        collect_stragglers,
+    )
 
     # build list of obsids
-    for i in range(i0, i1):
-        chunk_list.append(obsids[i])
+    chunk_list = index.basenames[i0:i1]
 
     # finalize the names of files
     if return_outfiles:
@@ -328,6 +625,65 @@ def make_chunk_list(
     return chunk_list
 
 
+def _prereq_window(
+    obsid_index,
+    obs_idx,
+    chunk_size=None,
+    prereq_chunk_size=None,
+    time_centered=None,
+    stride_length=None,
+    collect_stragglers=None,
+):
+    """Find the range of obsids whose prereqs must finish before an obsid runs.
+
+    An obsid depends on the prereqs of its time neighbors, both within its own
+    chunk (`chunk_size`) and within the chunk given by `prereq_chunk_size`.
+    Both chunks contain the obsid itself, so their union is a single range.
+
+    Parameters
+    ----------
+    obsid_index : ObsidIndex
+        The index of the obsids in the workflow.
+    obs_idx : int
+        The position of the obsid in the index.
+    chunk_size : str, optional
+        The chunk size of the action. Default is "1".
+    prereq_chunk_size : str, optional
+        The chunk size of the prereq. Default is "1".
+    time_centered, stride_length, collect_stragglers : optional
+        See `make_chunk_list`.
+
+    Returns
+    -------
+    tuple of int
+        The (start, stop) positions of the neighboring obsids.
+
+    """
+    if time_centered is None:
+        time_centered = True
+    if stride_length is None:
+        stride_length = "1"
+    if collect_stragglers is None:
+        collect_stragglers = False
+    day_start, day_stop = obsid_index.day_range(obsid_index.basenames[obs_idx])
+    i0, i1 = obs_idx, obs_idx + 1
+    for size in (prereq_chunk_size, chunk_size):
+        if size is None:
+            size = "1"
+        j0, j1 = _chunk_bounds(
+            obs_idx,
+            day_start,
+            day_stop,
+            size,
+            time_centered,
+            stride_length,
+            collect_stragglers,
+        )
+        i0 = min(i0, j0)
+        i1 = max(i1, j1)
+    return i0, i1
+
+
 def process_batch_options(
     mem,
     ncpu=None,
@@ -406,17 +762,112 @@ def process_batch_options(
     return batch_options
 
 
-def _determine_stride_partitioning(
+class StridePartition:
+    """The grouping of a sorted list of obsids into strided chunks.
+
+    Each "primary" obsid of an action does work on a contiguous chunk of
+    obsids. Rather than storing the list of primary obsids for every obsid,
+    this object stores the (start, stop) interval of each primary obsid's
+    chunk. Because the starts and stops are both non-decreasing, the primary
+    obsids that cover any obsid (or any contiguous range of obsids) are
+    themselves a contiguous range, which is found by bisection.
+
+    Parameters
+    ----------
+    obsids : list of str
+        The sorted list of obsids being partitioned.
+    primary : array of int
+        The positions of the primary obsids in `obsids`.
+    starts, stops : array of int
+        The (start, stop) positions of the chunk of each primary obsid.
+
+    """
+
+    __slots__ = ("obsids", "primary", "starts", "stops", "_ranks")
+
+    def __init__(self, obsids, primary, starts, stops):
+        self.obsids = obsids
+        self.primary = primary
+        self.starts = starts
+        self.stops = stops
+        self._ranks = None
+
+    def __len__(self):
+        """Get the number of primary obsids."""
+        return len(self.primary)
+
+    @property
+    def primary_obsids(self):
+        """The primary obsids, in sorted order."""
+        return [self.obsids[i] for i in self.primary]
+
+    @property
+    def per_obsid_primary_obsids(self):
+        """The primary obsids covering each obsid, for each obsid."""
+        per_obsid_primary_obsids = [[] for _ in self.obsids]
+        for i, i0, i1 in zip(self.primary, self.starts, self.stops):
+            for j in range(i0, i1):
+                per_obsid_primary_obsids[j].append(self.obsids[i])
+        return per_obsid_primary_obsids
+
+    def rank(self, obs_idx):
+        """Get the rank of an obsid among the primary obsids.
+
+        Parameters
+        ----------
+        obs_idx : int
+            The position of the obsid in the sorted list of obsids.
+
+        Returns
+        -------
+        int or None
+            The index of the obsid in the list of primary obsids, or None if
+            the obsid is not a primary obsid.
+
+        """
+        if self._ranks is None:
+            self._ranks = {i: k for k, i in enumerate(self.primary)}
+        return self._ranks.get(obs_idx)
+
+    def chunk(self, rank):
+        """Get the (start, stop) positions of the chunk of a primary obsid."""
+        return self.starts[rank], self.stops[rank]
+
+    def covering(self, i0, i1=None):
+        """Find the primary obsids whose chunks overlap a range of obsids.
+
+        Parameters
+        ----------
+        i0 : int
+            The position of the first obsid in the range.
+        i1 : int, optional
+            The position one past the last obsid in the range. Defaults to
+            ``i0 + 1``, i.e., only the obsid at `i0` is considered.
+
+        Returns
+        -------
+        tuple of int
+            The (start, stop) range of ranks of the primary obsids whose chunks
+            overlap the range. If there are none, start >= stop.
+
+        """
+        if i1 is None:
+            i1 = i0 + 1
+        return bisect.bisect_right(self.stops, i0), bisect.bisect_left(self.starts, i1)
+
+
+def _stride_partition(
     obsids,
     stride_length=None,
     chunk_size=None,
     time_centered=None,
     collect_stragglers=None,
 ):
-    """
+    """Partition a list of obsids into strided chunks.
+
     Parameters
     ----------
-    obsids : list of str
+    obsids : list of str or ObsidIndex
         The list of obsids.
     stride_length : int, optional
         Length of the stride. Default is 1.
@@ -425,30 +876,16 @@ def _determine_stride_partitioning(
     time_centered : bool, optional
         Whether to center the obsid and select chunk_size // 2 on either side
         (True, default), or a group starting with the selected obsid (False).
-        If `time_centered` is True and `chunk_size` is even, there will be
-        one more obsid to the left.
     collect_stragglers : bool, optional
-        When the list of files to work on is not divided evenly by the
-        combination of stride_length and chunk_size, this option specifies
-        whether to include the straggler files into the last group (True) or
+        Whether to include the straggler files into the last group (True) or
         treat them as their own small group (False, default).
 
     Returns
     -------
-    primary_obsids : list of str
-        A list of obsids that consist of the "primary" obsids for the current
-        action, given the quantities specified. This list contains all obsids
-        that will "do work" this action, in the sense that they will run a "do"
-        script.
-    per_obsid_primary_obsids : list of list of str
-        A list of length `len(obsids)` that contains a list of "primary obsids"
-        for each entry. It is assumed that these primary obsids must be
-        completed for the current action before running the next action in the
-        workflow. An obsid may have itself as a primary obsid (e.g., if
-        stride_length == 1, then each obsid will have itself, as well as its
-        time neighbors, as primary obsids). If `stride_length` and
-        `chunk_size` are such that there are obsids that do not belong to
-        any group, then the value is an empty list.
+    StridePartition
+        The interval representation of the partition. See
+        `_determine_stride_partitioning` for the meaning of the groups.
+
     """
     if stride_length is None:
         stride_length = 1
@@ -479,10 +916,12 @@ def _determine_stride_partitioning(
             "the config file, do *not* use quotation marks."
         )
 
-    primary_obsids = []
-    per_obsid_primary_obsids = [[] for i in range(len(obsids))]
+    nobs = len(obsids)
+    primary = array.array("l")
+    starts = array.array("l")
+    stops = array.array("l")
 
-    for idx in range(time_centered * (chunk_size // 2), len(obsids), stride_length):
+    for idx in range(time_centered * (chunk_size // 2), nobs, stride_length):
         # Compute the number of remaining obsids to process.
         # We account for the location of the next stride to determine if we
         # should grab straggling obsids.
@@ -497,9 +936,9 @@ def _determine_stride_partitioning(
         # loop on the iteration previous to the current one. Otherwise we drop
         # the remaining obsids because there are insufficient time neighbors to
         # make a full set.
-        if i1 > len(obsids):
+        if i1 > nobs:
             break
-        if (i1 + int(stride_length) > len(obsids)) and collect_stragglers:
+        if (i1 + stride_length > nobs) and collect_stragglers:
             # Figure out if any observations that would normally have been skipped
             # will be lumped in by getting all remaining observations.
             gap = stride_length - chunk_size
@@ -509,20 +948,330 @@ def _determine_stride_partitioning(
                     "consecutive strides. Not collecting stragglers..."
                 )
             else:
-                i1 = len(obsids)
-            primary_obsids.append(obsids[idx])
-            for i in range(i0, i1):
-                per_obsid_primary_obsids[i].append(obsids[idx])
+                i1 = nobs
+            primary.append(idx)
+            starts.append(i0)
+            stops.append(i1)
 
             # skip what would have been the last iteration, because we've
             # collected the remaining obsids
             break
         # assign indices
-        primary_obsids.append(obsids[idx])
-        for i in range(i0, i1):
-            per_obsid_primary_obsids[i].append(obsids[idx])
+        primary.append(idx)
+        starts.append(i0)
+        stops.append(i1)
+
+    return StridePartition(obsids, primary, starts, stops)
+
+
+def _determine_stride_partitioning(
+    obsids,
+    stride_length=None,
+    chunk_size=None,
+    time_centered=None,
+    collect_stragglers=None,
+):
+    """
+    Parameters
+    ----------
+    obsids : list of str or ObsidIndex
+        The list of obsids.
+    stride_length : int, optional
+        Length of the stride. Default is 1.
+    chunk_size : int, optional
+        Number of obsids in a chunk. Optional, default is 1.
+    time_centered : bool, optional
+        Whether to center the obsid and select chunk_size // 2 on either side
+        (True, default), or a group starting with the selected obsid (False).
+        If `time_centered` is True and `chunk_size` is even, there will be
+        one more obsid to the left.
+    collect_stragglers : bool, optional
+        When the list of files to work on is not divided evenly by the
+        combination of stride_length and chunk_size, this option specifies
+        whether to include the straggler files into the last group (True) or
+        treat them as their own small group (False, default).
+
+    Returns
+    -------
+    primary_obsids : list of str
+        A list of obsids that consist of the "primary" obsids for the current
+        action, given the quantities specified. This list contains all obsids
+        that will "do work" this action, in the sense that they will run a "do"
+        script.
+    per_obsid_primary_obsids : list of list of str
+        A list of length `len(obsids)` that contains a list of "primary obsids"
+        for each entry. It is assumed that these primary obsids must be
+        completed for the current action before running the next action in the
+        workflow. An obsid may have itself as a primary obsid (e.g., if
+        stride_length == 1, then each obsid will have itself, as well as its
+        time neighbors, as primary obsids). If `stride_length` and
+        `chunk_size` are such that there are obsids that do not belong to
+        any group, then the value is an empty list.
+
+    Notes
+    -----
+    The lists returned here grow as O(N * chunk_size). Internally, the
+    builders use the compact interval representation from `_stride_partition`
+    (see `StridePartition`), from which these lists are derived.
+    """
+    partition = _stride_partition(
+        obsids,
+        stride_length=stride_length,
+        chunk_size=chunk_size,
+        time_centered=time_centered,
+        collect_stragglers=collect_stragglers,
+    )
+    return partition.primary_obsids, partition.per_obsid_primary_obsids
+
+
+# match "{token}" or "{token[offset]}" in an args string, but not a shell
+# variable such as "${jd}"
+_ARGS_TOKEN_REGEX = re.compile(r"(?<!\$)\{(\w+)(?:\[([+-]?\d+)\])?\}")
 
-    return primary_obsids, per_obsid_primary_obsids
+# registry of mini-language tokens; maps name -> (function, indexable)
+_ARGS_TOKENS = {}
+
+
+@functools.lru_cache(maxsize=None)
+def _compile_args_template(args):
+    """Return the ArgsTemplate of an args string, compiling it only once."""
+    return ArgsTemplate(args)
+
+
+def register_args_token(name, indexable=False):
+    """Register a token of the args mini-language.
+
+    The decorated function is called with an `ArgsContext` describing the
+    obsid being processed and returns the string substituted for "{name}".
+    If `indexable` is True, the token also accepts an integer offset, as in
+    "{name[-2]}", which is passed as a second argument (0 when omitted).
+
+    Parameters
+    ----------
+    name : str
+        The name of the token, without braces.
+    indexable : bool, optional
+        Whether the token accepts an offset.
+
+    Returns
+    -------
+    function
+        The decorator registering the function.
+
+    """
+
+    def decorator(func):
+        _ARGS_TOKENS[name] = (func, indexable)
+        # templates compiled before now may contain the token as plain text
+        _compile_args_template.cache_clear()
+        return func
+
+    return decorator
+
+
+class ArgsContext:
+    """The obsid an args template is rendered for.
+
+    Parameters
+    ----------
+    basename : str
+        The filename of the obsid.
+    index : ObsidIndex, optional
+        The index of all obsids in the workflow. Required by tokens referring
+        to other obsids.
+    position : int, optional
+        The position of the obsid in `index`, or None if it is not listed.
+    partition : StridePartition, optional
+        The stride partitioning of the action. Required for "{obsid_list}".
+
+    """
+
+    __slots__ = ("basename", "index", "position", "partition")
+
+    def __init__(self, basename, index=None, position=None, partition=None):
+        self.basename = basename
+        self.index = index
+        self.position = position
+        self.partition = partition
+
+    def obsid(self):
+        """Get the parsed name of the obsid.
+
+        Returns
+        -------
+        Obsid
+            The fields of the name of the obsid, from the index if it is there.
+
+        """
+        if self.index is not None and self.position is not None:
+            return self.index.parsed[self.position]
+        return Obsid(self.basename)
+
+    def neighbor(self, offset):
+        """Get the filename of an obsid on the same JD at an offset.
+
+        Parameters
+        ----------
+        offset : int
+            The offset from the obsid in the sorted list of obsids.
+
+        Returns
+        -------
+        str
+            The filename of the neighbor, or "None" if it is on another JD or
+            past the end of the list.
+
+        Raises
+        ------
+        ValueError
+            This is raised if the context has no index, or if the obsid is not
+            in the index.
+
+        """
+        if self.index is None:
+            raise ValueError(
+                "when requesting time-adjacent obsids, obsids must be provided"
+            )
+        if self.position is None:
+            raise ValueError("{} not found in list of obsids".format(self.basename))
+        day_start, day_stop = self.index.day_range(self.basename)
+        i = self.position + offset
+        if i < day_start or i >= day_stop:
+            return "None"
+        return self.index.basenames[i]
+
+    def obsid_list(self):
+        """Get the obsids in the chunk of the obsid.
+
+        Returns
+        -------
+        list of str
+            The obsids in the chunk, which is empty if the obsid is not a
+            primary obsid of the partition.
+
+        Raises
+        ------
+        ValueError
+            This is raised if the context has no index.
+
+        """
+        if self.index is None:
+            raise ValueError("when requesting obsid_list, obsids must be provided")
+        rank = self.partition.rank(self.position)
+        if rank is None:
+            return []
+        i0, i1 = self.partition.chunk(rank)
+        return self.index.obsids[i0:i1]
+
+
+@register_args_token("basename", indexable=True)
+def _basename_token(context, offset):
+    if offset == 0:
+        return context.basename
+    return context.neighbor(offset)
+
+
+@register_args_token("prev_basename")
+def _prev_basename_token(context):
+    return context.neighbor(-1)
+
+
+@register_args_token("next_basename")
+def _next_basename_token(context):
+    return context.neighbor(1)
+
+
+@register_args_token("obsid_list")
+def _obsid_list_token(context):
+    return " ".join(context.obsid_list())
+
+
+@register_args_token("jd")
+def _jd_token(context):
+    jd = context.obsid().jd
+    if jd is None:
+        _warn_unknown_jd(context.basename)
+    return str(jd)
+
+
+@register_args_token("pol")
+def _pol_token(context):
+    return str(context.obsid().pol)
+
+
+class ArgsTemplate:
+    """An args string of the mini-language, parsed once.
+
+    The string is split into literal text and registered tokens, so that
+    rendering it for an obsid is a single pass over the pieces. Text in braces
+    that is not a registered token is kept as-is.
+
+    Parameters
+    ----------
+    template : str
+        The args string, e.g., "{basename} {prev_basename}".
+
+    Attributes
+    ----------
+    tokens : frozenset of str
+        The names of the tokens used in the template.
+
+    """
+
+    __slots__ = ("template", "tokens", "_pieces")
+
+    def __init__(self, template):
+        self.template = template
+        pieces = []
+        tokens = set()
+        last = 0
+        for match in _ARGS_TOKEN_REGEX.finditer(template):
+            name, offset = match.groups()
+            try:
+                func, indexable = _ARGS_TOKENS[name]
+            except KeyError:
+                continue
+            if offset is not None and not indexable:
+                continue
+            if match.start() > last:
+                pieces.append(template[last : match.start()])
+            if indexable:
+                pieces.append((func, (int(offset or 0),)))
+            else:
+                pieces.append((func, ()))
+            tokens.add(name)
+            last = match.end()
+        if last < len(template):
+            pieces.append(template[last:])
+        self.tokens = frozenset(tokens)
+        self._pieces = tuple(pieces)
+
+    def __reduce__(self):
+        """Support pickling."""
+        return (ArgsTemplate, (self.template,))
+
+    def __repr__(self):
+        """Get a short description of the object."""
+        return "ArgsTemplate({!r})".format(self.template)
+
+    def render(self, context):
+        """Substitute the tokens of the template for an obsid.
+
+        Parameters
+        ----------
+        context : ArgsContext
+            The obsid to render the template for.
+
+        Returns
+        -------
+        str
+            The args string with mini-language substitutions.
+
+        """
+        return "".join(
+            piece if isinstance(piece, str) else piece[0](context, *piece[1])
+            for piece in self._pieces
+        )
 
 
 def prep_args(
@@ -545,8 +1294,9 @@ def prep_args(
         to be substituted.
     obsid : str
         Filename/obsid to be substituted.
-    obsids : list of str, optional
+    obsids : list of str or ObsidIndex, optional
         Full list of obsids. Required when time-adjacent neighbors are desired.
+        Passing an ObsidIndex avoids re-sorting the list for every call.
     chunk_size : str
         Number of obs files to append to list. If set to the
         string "all", then all neighbors from that JD are added.
@@ -574,73 +1324,22 @@ def prep_args(
         return_obsid_list is True and.
 
     """
+    template = _compile_args_template(args)
+    context = ArgsContext(obsid)
     if obsids is not None:
-        obsids = sort_obsids(obsids)
-    basename = obsid
-    args = re.sub(r"\{basename\}", basename, args)
-
-    # also replace time-adjacent basenames if requested
-    if re.search(r"\{prev_basename\}", args):
-        # check that there is an adjacent obsid to substitute
-        if obsids is None:
-            raise ValueError(
-                "when requesting time-adjacent obsids, obsids must be provided"
+        context.index = _get_obsid_index(obsids)
+        context.position = context.index.positions.get(obsid)
+        if "obsid_list" in template.tokens:
+            context.partition = context.index.partition(
+                stride_length=stride_length,
+                chunk_size=chunk_size,
+                time_centered=time_centered,
+                collect_stragglers=collect_stragglers,
             )
-        jd = get_jd(obsid)
-        oids = sorted(
-            [
-                os.path.basename(os.path.abspath(o))
-                for o in obsids
-                if jd in os.path.basename(os.path.abspath(o))
-            ]
-        )
-        try:
-            obs_idx = oids.index(obsid)
-        except ValueError:
-            raise ValueError("{} not found in list of obsids".format(obsid))
-        if obs_idx == 0:
-            args = re.sub(r"\{prev_basename\}", "None", args)
-        else:
-            args = re.sub(r"\{prev_basename\}", oids[obs_idx - 1], args)
+    args = template.render(context)
 
-    if re.search(r"\{next_basename\}", args):
-        # check that there is an adjacent obsid to substitute
-        if obsids is None:
-            raise ValueError(
-                "when requesting time-adjacent obsids, obsids must be provided"
-            )
-        jd = get_jd(obsid)
-        oids = sorted(
-            [
-                os.path.basename(os.path.abspath(o))
-                for o in obsids
-                if jd in os.path.basename(os.path.abspath(o))
-            ]
-        )
-        try:
-            obs_idx = oids.index(obsid)
-        except ValueError:
-            raise ValueError("{} not found in list of obsids".format(obsid))
-        if obs_idx == len(oids) - 1:
-            args = re.sub(r"\{next_basename\}", "None", args)
-        else:
-            args = re.sub(r"\{next_basename\}", oids[obs_idx + 1], args)
-
-    if re.search(r"\{obsid_list\}", args):
-        _, per_obsid_primary_obsids = _determine_stride_partitioning(
-            obsids,
-            stride_length=stride_length,
-            chunk_size=chunk_size,
-            time_centered=time_centered,
-            collect_stragglers=collect_stragglers,
-        )
-        obsid_list = []
-        for obs, primary_obsids in zip(obsids, per_obsid_primary_obsids):
-            primary_obsids = [os.path.basename(pobs) for pobs in primary_obsids]
-            if obsid in primary_obsids:
-                obsid_list.append(obs)
-        file_list = " ".join(obsid_list)
-        args = re.sub(r"\{obsid_list\}", file_list, args)
+    if "obsid_list" in template.tokens:
+        obsid_list = context.obsid_list()
     else:
         obsid_list = []
 
@@ -650,8 +1349,211 @@ def prep_args(
         return args
 
 
+def _action_partition(spec, obsid_index):
+    """Get the stride partitioning of the obsids for an action in the workflow.
+
+    Parameters
+    ----------
+    spec : ActionSpec
+        The compiled options of the action to partition the obsids for.
+    obsid_index : ObsidIndex
+        The index of the obsids in the workflow.
+
+    Returns
+    -------
+    StridePartition
+        The partitioning of the obsids for the action.
+
+    """
+    chunk_size, stride_length = spec.lengths(len(obsid_index))
+    return obsid_index.partition(
+        stride_length=stride_length,
+        chunk_size=chunk_size,
+        time_centered=spec.time_centered,
+        collect_stragglers=spec.collect_stragglers,
+    )
+
+
+class _Phase:
+    """A context manager that adds its wall time to a phase of a profiler.
+
+    The time spent in the phases nested inside it is not counted, so that a
+    phase which drives the others (e.g., writing the makeflow file as its
+    rules are generated) only gets its own time.
+    """
+
+    __slots__ = ("profiler", "name", "start")
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        """Start timing the phase."""
+        self.profiler._nested.append(0.0)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        """Stop timing the phase, and add its time to the profiler."""
+        elapsed = time.perf_counter() - self.start
+        nested = self.profiler._nested
+        own = elapsed - nested.pop()
+        if nested:
+            nested[-1] += elapsed
+        times = self.profiler.times
+        calls = self.profiler.calls
+        times[self.name] = times.get(self.name, 0.0) + own
+        calls[self.name] = calls.get(self.name, 0) + 1
+        return False
+
+
+# the phases of a build, in the order they are reported
+_PHASES = ("config", "partition", "prereqs", "args", "wrappers", "makeflow")
+
+
+class PhaseProfiler:
+    """The wall time and number of calls of each phase of makeflow builds.
+
+    While the profiler is active, i.e., inside a ``with`` block, the analysis
+    builders of this module record the time they spend in each of their
+    phases: "config" (loading and compiling the config file), "partition"
+    (the stride partitioning of the obsids), "prereqs" (resolving the prereqs
+    of each task), "args" (rendering the args of each task), "wrappers"
+    (writing the wrapper scripts) and "makeflow" (writing the makeflow file).
+    The phases add up over all of the builds in the block, including those of
+    `extend_makeflow`, but not those run in other processes. The time of a
+    phase does not include that of the phases nested in it, such as the
+    rules generated while the makeflow file is written.
+
+    Parameters
+    ----------
+    pstats_file : str, optional
+        If given, the block is also profiled with `cProfile`, and the
+        statistics are dumped to this file at its end, to be read with
+        `pstats`.
+
+    Attributes
+    ----------
+    times : dict
+        Mapping of each phase to its total wall time, in seconds.
+    calls : dict
+        Mapping of each phase to its number of calls.
+    total : float
+        The total wall time spent inside the block, in seconds.
+
+    """
+
+    __slots__ = (
+        "pstats_file",
+        "times",
+        "calls",
+        "total",
+        "_start",
+        "_previous",
+        "_cprofile",
+        "_nested",
+    )
+
+    def __init__(self, pstats_file=None):
+        self.pstats_file = pstats_file
+        self.times = {}
+        self.calls = {}
+        self.total = 0.0
+        self._start = None
+        self._previous = None
+        self._cprofile = None
+        self._nested = []
+
+    def __enter__(self):
+        """Start recording the phases of the builds."""
+        global _profiler
+        self._previous = _profiler
+        _profiler = self
+        if self.pstats_file is not None:
+            import cProfile
+
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        """Stop recording, and dump the `cProfile` statistics if requested."""
+        global _profiler
+        self.total += time.perf_counter() - self._start
+        if self._cprofile is not None:
+            self._cprofile.disable()
+            self._cprofile.dump_stats(self.pstats_file)
+            self._cprofile = None
+        _profiler = self._previous
+        return False
+
+    def phase(self, name):
+        """Get a context manager that times a phase.
+
+        Parameters
+        ----------
+        name : str
+            The name of the phase.
+
+        Returns
+        -------
+        context manager
+            Adds its wall time and one call to the phase.
+
+        """
+        return _Phase(self, name)
+
+    def report(self):
+        """Format the times of the phases as a table.
+
+        Returns
+        -------
+        str
+            One line per phase with its number of calls, its wall time and its
+            fraction of the total time, followed by the total time.
+
+        """
+        names = [name for name in _PHASES if name in self.times]
+        names.extend(name for name in self.times if name not in _PHASES)
+        lines = [f"{'phase':<10} {'calls':>9} {'seconds':>10} {'fraction':>9}"]
+        for name in names:
+            fraction = self.times[name] / self.total if self.total > 0 else 0.0
+            lines.append(
+                f"{name:<10} {self.calls[name]:>9} {self.times[name]:>10.3f} "
+                f"{fraction:>9.1%}"
+            )
+        lines.append(f"{'total':<10} {'':>9} {self.total:>10.3f}")
+        return "\n".join(lines)
+
+
+# the active profiler, if any
+_profiler = None
+_NO_PHASE = contextlib.nullcontext()
+
+
+def _phase(name):
+    """Get a context manager that times a phase of a build, if profiling.
+
+    Parameters
+    ----------
+    name : str
+        The name of the phase.
+
+    Returns
+    -------
+    context manager
+        The phase of the active `PhaseProfiler`, or a no-op if there is none.
+
+    """
+    if _profiler is None:
+        return _NO_PHASE
+    return _profiler.phase(name)
+
+
 def build_makeflow_from_config(
-    obsids, config_file, mf_name=None, work_dir=None, **kwargs
+    obsids, config_file, mf_name=None, work_dir=None, profile=None, **kwargs
 ):
     """Construct a makeflow from a config file.
 
@@ -667,11 +1569,17 @@ def build_makeflow_from_config(
     work_dir : str
         The full path to the "work directory" where all of the wrapper scripts
         and log files will be made. Defaults to the current directory.
+    profile : PhaseProfiler, optional
+        If given, the time spent in each phase of the build is added to this
+        profiler.
+    **kwargs
+        Passed to the builder of the makeflow type, e.g., `output_format`.
 
     Returns
     -------
-    None
-
+    report : dict or None
+        For an incremental analysis build, the added, changed and removed
+        targets (see `build_analysis_makeflow_from_config`); otherwise None.
 
     Raises
     ------
@@ -686,15 +1594,22 @@ def build_makeflow_from_config(
     "lstbin" type, and call the appropriate funciton below.
 
     """
+    if profile is not None:
+        with profile:
+            return build_makeflow_from_config(
+                obsids, config_file, mf_name=mf_name, work_dir=work_dir, **kwargs
+            )
+
     if isinstance(config_file, (str, Path)):
         # read in config file
-        config = toml.load(config_file)
+        with _phase("config"):
+            config = _read_config(config_file)
     else:
         raise ValueError("config must be a path to a TOML config file")
 
     makeflow_type = get_config_entry(config, "Options", "makeflow_type", required=True)
     if makeflow_type == "analysis":
-        build_analysis_makeflow_from_config(
+        return build_analysis_makeflow_from_config(
             obsids, config_file, mf_name=mf_name, work_dir=work_dir, **kwargs
         )
     elif makeflow_type == "lstbin":
@@ -711,645 +1626,3628 @@ def build_makeflow_from_config(
             "must be 'analysis' or 'lstbin'"
         )
 
-    return
+    return
+
+
+def build_dag_from_config(obsids, config_file, work_dir=None, **kwargs):
+    """Build the graph of the tasks of a workflow, without a makeflow.
+
+    Like `build_makeflow_from_config`, this reads the "makeflow_type" entry
+    under the "[Options]" header of the config file, and calls
+    `build_analysis_dag` or `build_lstbin_dag`.
+
+    Parameters
+    ----------
+    obsids : list of str
+        List of paths to obsids/filenames for processing. They are not used
+        by LST-binning workflows.
+    config_file : str
+        Full path to configuration file.
+    work_dir : str
+        The full path to the "work directory" where all of the wrapper scripts
+        will be made. Defaults to the current directory.
+    kwargs
+        Passed to the graph builder of the makeflow type.
+
+    Returns
+    -------
+    MakeflowDAG
+        The graph of the tasks.
+
+    Raises
+    ------
+    ValueError
+        Raised if the config file cannot be read, or if "makeflow_type" in the
+        config file does not have a graph builder ("analysis" or "lstbin").
+
+    """
+    if isinstance(config_file, (str, Path)):
+        with _phase("config"):
+            config = _read_config(config_file)
+    else:
+        raise ValueError("config must be a path to a TOML config file")
+
+    makeflow_type = get_config_entry(config, "Options", "makeflow_type", required=True)
+    if makeflow_type == "analysis":
+        return build_analysis_dag(obsids, config_file, work_dir=work_dir, **kwargs)
+    elif makeflow_type == "lstbin":
+        return build_lstbin_dag(config_file, work_dir=work_dir, **kwargs)
+    else:
+        raise ValueError(
+            f"cannot build the graph of makeflow_type '{makeflow_type}'; "
+            "must be 'analysis' or 'lstbin'"
+        )
+
+
+def _get_timeout(config):
+    timeout = get_config_entry(config, "Options", "timeout", required=False)
+    if timeout is not None:
+        # check that the `timeout' command exists on the system
+        try:
+            subprocess.check_output(["timeout", "--help"])
+        except OSError:  # pragma: no cover
+            warnings.warn(
+                'A value for the "timeout" option was specified,'
+                " but the `timeout' command does not appear to be"
+                " installed. Please install or remove the option"
+                " from the config file"
+            )
+    return timeout
+
+
+class ActionSpec:
+    """The compiled options of a single action in a workflow.
+
+    The entries of an action's table in the config file are interpolated,
+    parsed, and validated once by `compile_config`, so that building the
+    makeflow only has to read attributes. Instances are immutable.
+
+    Parameters
+    ----------
+    name : str
+        The name of the action, e.g., "OMNICAL".
+    prereqs : tuple of str
+        The actions that must finish before this one.
+    args : str
+        The argument string of the action, before mini-language substitution.
+    raw_args : str or list
+        The args entry as it appears in the config file, after interpolation.
+    stride_length : int or "all"
+        The length of the stride.
+    chunk_size : int or "all"
+        The number of obsids in each chunk.
+    prereq_chunk_size : int or "all"
+        The number of neighboring obsids whose prereqs must finish.
+    time_centered : bool
+        Whether the primary obsid is in the center of its chunk.
+    collect_stragglers : bool
+        Whether to include the straggler files into the last group.
+    bundle_size : int
+        The number of consecutive tasks of the action run in a single job.
+    runtime : float or None
+        The expected runtime of each task of the action, in hours.
+    mem, ncpu, queue, extra_batch_options
+        The resources requested from the batch system.
+    batch_options : str
+        The batch options string for the action.
+    command : str
+        The full path to the task script of the action.
+
+    """
+
+    __slots__ = (
+        "name",
+        "prereqs",
+        "args",
+        "raw_args",
+        "stride_length",
+        "chunk_size",
+        "prereq_chunk_size",
+        "time_centered",
+        "collect_stragglers",
+        "bundle_size",
+        "runtime",
+        "mem",
+        "ncpu",
+        "queue",
+        "extra_batch_options",
+        "batch_options",
+        "command",
+    )
+
+    def __init__(
+        self,
+        name,
+        prereqs=(),
+        args="",
+        raw_args=None,
+        stride_length=1,
+        chunk_size=1,
+        prereq_chunk_size=1,
+        time_centered=True,
+        collect_stragglers=False,
+        bundle_size=1,
+        runtime=None,
+        mem=None,
+        ncpu=None,
+        queue=None,
+        extra_batch_options=None,
+        batch_options="",
+        command=None,
+    ):
+        values = locals()
+        for slot in self.__slots__:
+            object.__setattr__(self, slot, values[slot])
+
+    def __setattr__(self, name, value):
+        """Disallow setting attributes."""
+        raise AttributeError("ActionSpec objects are immutable")
+
+    def __delattr__(self, name):
+        """Disallow deleting attributes."""
+        raise AttributeError("ActionSpec objects are immutable")
+
+    def __reduce__(self):
+        """Support pickling."""
+        return (ActionSpec, tuple(getattr(self, slot) for slot in self.__slots__))
+
+    def __repr__(self):
+        """Get a short description of the object."""
+        return "ActionSpec({!r})".format(self.name)
+
+    @property
+    def template(self):
+        """ArgsTemplate: The compiled args of the action."""
+        return _compile_args_template(self.args)
+
+    def lengths(self, nobsids):
+        """Resolve the chunk size and stride length for a list of obsids.
+
+        Parameters
+        ----------
+        nobsids : int
+            The total number of obsids in the workflow, which is substituted
+            for chunk sizes and stride lengths of "all".
+
+        Returns
+        -------
+        chunk_size : int
+            The number of obsids in each chunk.
+        stride_length : int
+            The length of the stride.
+
+        """
+        chunk_size = nobsids if self.chunk_size == "all" else self.chunk_size
+        stride_length = nobsids if self.stride_length == "all" else self.stride_length
+        return chunk_size, stride_length
+
+
+class CompiledConfig:
+    """The options of an analysis config file, compiled once.
+
+    Parameters
+    ----------
+    workflow : tuple of str
+        The actions of the workflow, in order and in upper case.
+    actions : dict
+        Mapping of action name to its `ActionSpec`.
+    options : dict
+        The general options of the workflow. Each entry is also available as an
+        attribute.
+
+    """
+
+    _options = (
+        "path_to_do_scripts",
+        "conda_env",
+        "source_script",
+        "mail_user",
+        "batch_system",
+        "timeout",
+        "mandc_report",
+        "base_mem",
+        "base_cpu",
+        "default_queue",
+        "shared_wrappers",
+    )
+    __slots__ = ("workflow", "actions") + _options
+
+    def __init__(self, workflow, actions, options):
+        self.workflow = tuple(workflow)
+        self.actions = actions
+        for option in self._options:
+            setattr(self, option, options.get(option))
+
+    def __reduce__(self):
+        """Support pickling."""
+        options = {option: getattr(self, option) for option in self._options}
+        return (CompiledConfig, (self.workflow, self.actions, options))
+
+
+def _parse_length(value, item, default=1):
+    """Parse a chunk size or stride length from a config file.
+
+    Parameters
+    ----------
+    value : str or int or None
+        The entry in the config file.
+    item : str
+        The name of the entry, used in error messages.
+    default : int, optional
+        The value to use if the entry is not present.
+
+    Returns
+    -------
+    int or "all"
+        The parsed entry.
+
+    """
+    if value is None:
+        return default
+    if value == "all":
+        return value
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f"{item} must be able to be interpreted as an int.")
+
+
+def _parse_flag(value, item, default):
+    """Parse a boolean entry from a config file.
+
+    Parameters
+    ----------
+    value : bool or None
+        The entry in the config file.
+    item : str
+        The name of the entry, used in error messages.
+    default : bool
+        The value to use if the entry is not present.
+
+    Returns
+    -------
+    bool
+        The parsed entry.
+
+    """
+    if value is None:
+        return default
+    if type(value) is not bool:
+        raise ValueError(
+            f"{item} must be a boolean variable. When written into the "
+            "config file, do *not* use quotation marks."
+        )
+    return value
+
+
+def _compile_action(config, action, options):
+    """Compile the table of a single action of the workflow.
+
+    Parameters
+    ----------
+    config : dict
+        The entries of the processed config file.
+    action : str
+        The name of the action.
+    options : dict
+        The general options of the workflow.
+
+    Returns
+    -------
+    ActionSpec
+        The compiled options of the action.
+
+    """
+    # keep "all" as-is; it is resolved against the obsids of each build
+    raw_chunk_size = get_config_entry(
+        config, action, "chunk_size", required=False, total_length="all"
+    )
+    if raw_chunk_size is not None:
+        # make sure obsid_list is the last argument
+        this_args = get_config_entry(config, action, "args", required=True)
+        if "{obsid_list}" in this_args:
+            bn_idx = this_args.index("{obsid_list}")
+            if bn_idx != len(this_args) - 1:
+                raise ValueError(
+                    "{obsid_list} must be the last argument for action"
+                    f" {action} because chunk_size is specified."
+                )
+
+    raw_args = get_config_entry(config, action, "args", required=False)
+    if raw_args is None and action in ("SETUP", "TEARDOWN"):
+        args = ""
+    else:
+        args = raw_args
+        if not isinstance(args, list):
+            args = [args]
+        args = " ".join(list(map(str, args)))
+
+    prereqs = get_config_entry(config, action, "prereqs", required=False)
+    if prereqs is None:
+        prereqs = ()
+    elif not isinstance(prereqs, list):
+        prereqs = (prereqs,)
+
+    mem = get_config_entry(config, action, "mem", required=False)
+    ncpu = get_config_entry(config, action, "ncpu", required=False)
+    queue = get_config_entry(config, action, "queue", required=False)
+    extra_options = get_config_entry(
+        config, action, "extra_batch_options", required=False
+    )
+    if mem is None:
+        mem = options["base_mem"]
+    if ncpu is None:
+        ncpu = options["base_cpu"]
+    if queue is None:
+        queue = options["default_queue"]
+    batch_options = process_batch_options(
+        mem,
+        ncpu,
+        options["mail_user"],
+        queue,
+        options["batch_system"],
+        extra_options,
+    )
+
+    bundle_size = _parse_length(
+        get_config_entry(config, action, "bundle_size", required=False),
+        "bundle_size",
+    )
+    if bundle_size == "all" or bundle_size < 1:
+        raise ValueError("bundle_size must be an integer >= 1.")
+
+    return ActionSpec(
+        action,
+        prereqs=tuple(prereqs),
+        args=args,
+        raw_args=raw_args,
+        stride_length=_parse_length(
+            get_config_entry(
+                config, action, "stride_length", required=False, total_length="all"
+            ),
+            "stride_length",
+        ),
+        chunk_size=_parse_length(raw_chunk_size, "chunk_size"),
+        prereq_chunk_size=_parse_length(
+            get_config_entry(config, action, "prereq_chunk_size", required=False),
+            "prereq_chunk_size",
+        ),
+        time_centered=_parse_flag(
+            get_config_entry(config, action, "time_centered", required=False),
+            "time_centered",
+            True,
+        ),
+        collect_stragglers=_parse_flag(
+            get_config_entry(config, action, "collect_stragglers", required=False),
+            "collect_stragglers",
+            False,
+        ),
+        bundle_size=bundle_size,
+        runtime=_duration_hours(
+            get_config_entry(config, action, "runtime", required=False)
+        ),
+        mem=mem,
+        ncpu=ncpu,
+        queue=queue,
+        extra_batch_options=extra_options,
+        batch_options=batch_options,
+        command=os.path.join(options["path_to_do_scripts"], f"do_{action}.sh"),
+    )
+
+
+def compile_config(config):
+    """Compile the entries of an analysis config file.
+
+    Every action of the workflow is resolved once into an `ActionSpec`, and
+    the structure of the workflow is validated.
+
+    Parameters
+    ----------
+    config : dict
+        The entries of the processed config file.
+
+    Returns
+    -------
+    CompiledConfig
+        The compiled workflow.
+
+    Raises
+    ------
+    ValueError
+        This is raised if the SETUP entry in the workflow is specified, but is
+        not the first entry. Similarly, it is raised if the TEARDOWN is in the
+        workflow, but not the last entry. It is also raised if a prereq for a
+        step is specified that is not in the workflow, or if an entry of an
+        action cannot be parsed.
+
+    """
+    workflow = get_config_entry(config, "WorkFlow", "actions")
+    # make workflow options uppercase
+    workflow = [w.upper() for w in workflow]
+
+    # make sure that SETUP and TEARDOWN are in the right spots, if they are in the workflow
+    if "SETUP" in workflow and workflow.index("SETUP") != 0:
+        raise ValueError("SETUP must be first entry of workflow")
+    if "TEARDOWN" in workflow and workflow.index("TEARDOWN") != len(workflow) - 1:
+        raise ValueError("TEARDOWN must be last entry of workflow")
+
+    options = {
+        "mandc_report": get_config_entry(
+            config, "Options", "mandc_report", required=False
+        ),
+        "path_to_do_scripts": get_config_entry(config, "Options", "path_to_do_scripts"),
+        "conda_env": get_config_entry(config, "Options", "conda_env", required=False),
+        "source_script": get_config_entry(
+            config, "Options", "source_script", required=False
+        ),
+        "mail_user": get_config_entry(config, "Options", "mail_user", required=False),
+        "batch_system": get_config_entry(
+            config, "Options", "batch_system", required=False
+        ),
+        "timeout": _get_timeout(config),
+        "base_mem": get_config_entry(config, "Options", "base_mem", required=True),
+        "base_cpu": get_config_entry(config, "Options", "base_cpu", required=False),
+        "default_queue": get_config_entry(
+            config, "Options", "default_queue", default="hera"
+        ),
+        "shared_wrappers": get_config_entry(
+            config, "Options", "shared_wrappers", default=False
+        ),
+    }
+
+    actions = {}
+    for action in workflow:
+        actions[action] = _compile_action(config, action, options)
+
+    # make sure all prereqs are part of the workflow
+    for action in workflow:
+        if action in ("SETUP", "TEARDOWN"):
+            continue
+        for prereq in actions[action].prereqs:
+            if prereq not in actions:
+                raise ValueError(
+                    "Prereq {0} for action {1} not found in main "
+                    "workflow".format(prereq, action)
+                )
+
+    return CompiledConfig(workflow, actions, options)
+
+
+# the config files read in this process, keyed by their full path, with the
+# (mtime, size) they were read at, their entries and their compiled config
+_config_cache = {}
+
+
+def _config_cache_entry(config_file):
+    """Get the cache entry of a config file, reading it if it changed.
+
+    Parameters
+    ----------
+    config_file : str or Path
+        The path to the config file.
+
+    Returns
+    -------
+    list
+        The (mtime, size) of the file, its entries and its compiled config
+        (None until it is compiled).
+
+    """
+    path = os.path.abspath(config_file)
+    stat = os.stat(path)
+    stamp = (stat.st_mtime_ns, stat.st_size)
+    entry = _config_cache.get(path)
+    if entry is None or entry[0] != stamp:
+        entry = [stamp, toml.load(path), None]
+        _config_cache[path] = entry
+    return entry
+
+
+def _read_config(config_file):
+    """Read the entries of a config file, reusing them if it did not change.
+
+    Parameters
+    ----------
+    config_file : str or Path
+        The path to the config file.
+
+    Returns
+    -------
+    dict
+        A copy of the entries of the config file, which the caller may modify.
+
+    """
+    return copy.deepcopy(_config_cache_entry(config_file)[1])
+
+
+def load_config(config_file):
+    """Load and compile an analysis config file, reusing it if it did not change.
+
+    The compiled config is cached for the process, keyed by the full path to
+    the file, and is reused for as long as the modification time and size of
+    the file are the same. Use `clear_config_cache` to force the file to be
+    read again, e.g., if it may have been rewritten within the resolution of
+    the modification time.
+
+    Parameters
+    ----------
+    config_file : str or Path
+        The path to the config file.
+
+    Returns
+    -------
+    CompiledConfig
+        The compiled config.
+
+    Raises
+    ------
+    ValueError
+        This is raised if the config file is not valid; see `compile_config`.
+
+    """
+    entry = _config_cache_entry(config_file)
+    if entry[2] is None:
+        # compiling interpolates the entries in place, so compile a copy
+        entry[2] = compile_config(copy.deepcopy(entry[1]))
+    return entry[2]
+
+
+def clear_config_cache(config_file=None):
+    """Forget the config files read by `load_config`.
+
+    Parameters
+    ----------
+    config_file : str or Path, optional
+        The path to the config file to forget. If None, all of the config
+        files are forgotten.
+
+    Returns
+    -------
+    None
+
+    """
+    if config_file is None:
+        _config_cache.clear()
+    else:
+        _config_cache.pop(os.path.abspath(config_file), None)
+
+    return
+
+
+def _write_shared_wrapper(wrapper_script, action, compiled, work_dir, manifest=None):
+    """Write the wrapper script shared by all of the tasks of an action.
+
+    Rather than writing one wrapper script per task, the rules of the makeflow
+    call the same script for every obsid of an action, passing the per-task
+    values as parameters. The script is called as::
+
+        wrapper_ACTION.sh parent_dir outfile basename [file_list] args...
+
+    where `file_list` is only passed if M&C reporting is enabled.
+
+    Parameters
+    ----------
+    wrapper_script : str
+        The full path to the wrapper script to write.
+    action : str
+        The name of the action.
+    compiled : CompiledConfig
+        The compiled config of the workflow.
+    work_dir : str
+        The full path to the work directory.
+    manifest : Manifest, optional
+        The manifest of the build, if the build is incremental.
+
+    Returns
+    -------
+    None
+
+    """
+    spec = compiled.actions[action]
+    mandc_report = compiled.mandc_report
+    lines = [
+        "#!/bin/bash",
+        "parent_dir=$1",
+        "outfile=$2",
+        "basename=$3",
+        "shift 3",
+    ]
+    if mandc_report:
+        lines += ["file_list=$1", "shift"]
+    lines.append('logfile="{}/${{outfile%.out}}.log"'.format(work_dir))
+    if compiled.source_script is not None:
+        lines.append("source {}".format(compiled.source_script))
+    if compiled.conda_env is not None:
+        lines.append("conda activate {}".format(compiled.conda_env))
+    lines += ["date", 'cd "${parent_dir}"']
+
+    def mandc_lines(commands, indent=""):
+        # report to M&C, with the list of files if there is more than one
+        inner = indent + "  "
+        return (
+            [f'{indent}if [ -n "${{file_list}}" ]; then']
+            + [f"{inner}{cmd} --file_list ${{file_list}}" for cmd in commands]
+            + [f"{indent}else"]
+            + [f"{inner}{cmd}" for cmd in commands]
+            + [f"{indent}fi"]
+        )
+
+    event = f"add_rtp_process_event.py ${{basename}} {action}"
+    if mandc_report:
+        lines += mandc_lines(
+            [
+                f"{event} started",
+                f"add_rtp_task_jobid.py ${{basename}} {action} $SLURM_JOB_ID",
+            ]
+        )
+    if compiled.timeout is not None:
+        lines.append('timeout {0} {1} "$@"'.format(compiled.timeout, spec.command))
+    else:
+        lines.append('{0} "$@"'.format(spec.command))
+    lines.append("if [ $? -eq 0 ]; then")
+    if mandc_report:
+        lines += mandc_lines([f"{event} finished"], indent="  ")
+    lines += [
+        "  cd {}".format(work_dir),
+        '  touch "${outfile}"',
+        "else",
+    ]
+    if mandc_report:
+        lines += mandc_lines([f"{event} error"], indent="  ")
+    lines += [
+        '  mv "${logfile}" "${logfile}.error"',
+        "fi",
+        "date",
+    ]
+    _write_wrapper(wrapper_script, "\n".join(lines) + "\n", manifest=manifest)
+
+    return
+
+
+# size of the chunks collected by a MakeflowWriter before writing them, in
+# bytes; the file itself keeps the default buffering, so that the text is
+# only buffered once
+_WRITE_BUFFER_SIZE = 1 << 20
+
+
+class Rule:
+    """A single rule of a makeflow.
+
+    Parameters
+    ----------
+    target : str
+        The file made by the rule.
+    sources : list of str
+        The files the rule depends on.
+    command : str
+        The command line run by the rule.
+    batch_options : str, optional
+        The batch options of the rule. If None, the options of the previous
+        rule of the same category are used.
+    category : str, optional
+        The category of the rule, usually the name of its action. Rules of the
+        same category share their batch options.
+    extra_targets : tuple of str, optional
+        Other files made by the rule, e.g., by the other tasks of a bundle.
+    local : bool, optional
+        Whether the rule is run by makeflow on its own machine, rather than
+        submitted as a batch job.
+
+    """
+
+    __slots__ = (
+        "target",
+        "sources",
+        "command",
+        "batch_options",
+        "category",
+        "extra_targets",
+        "local",
+    )
+
+    def __init__(
+        self,
+        target,
+        sources,
+        command,
+        batch_options=None,
+        category=None,
+        extra_targets=(),
+        local=False,
+    ):
+        self.target = target
+        self.sources = sources
+        self.command = command
+        self.batch_options = batch_options
+        self.category = category
+        self.extra_targets = extra_targets
+        self.local = local
+
+    @property
+    def targets(self):
+        """Return all of the files made by the rule."""
+        return [self.target, *self.extra_targets]
+
+    def __repr__(self):
+        """Get a short description of the object."""
+        return "Rule({!r})".format(self.target)
+
+
+class MakeflowWriter:
+    """Write rules to a makeflow file through a large buffer.
+
+    Rules are formatted as they are received and written in chunks of about
+    `buffer_size` bytes, so that writing a makeflow takes few system calls and
+    memory use does not grow with the number of rules.
+
+    Each rule is placed in the makeflow category of its action. Makeflow keeps
+    the variables of each category apart, so the resources of a category
+    (".MAKEFLOW CORES", ".MAKEFLOW MEMORY") and its batch options ("export
+    BATCH_OPTIONS") are written right after the first ".MAKEFLOW CATEGORY"
+    line of the category, and the batch options again only if they change
+    within it, rather than before every rule.
+
+    Parameters
+    ----------
+    f : file object
+        The makeflow file, opened for writing text.
+    buffer_size : int, optional
+        The number of bytes to collect before writing to `f`.
+    resources : dict, optional
+        Mapping of category name to its resources, as a dict of makeflow
+        resource name (e.g., "CORES" or "MEMORY", in MB) to value.
+    state : dict, optional
+        The `state` of a previous writer of the same makeflow file, when
+        appending to it. The categories it declared, and the batch options
+        it exported, are not written again.
+
+    Attributes
+    ----------
+    nrules : int
+        The number of rules written so far.
+
+    """
+
+    def __init__(self, f, buffer_size=_WRITE_BUFFER_SIZE, resources=None, state=None):
+        self.f = f
+        self.buffer_size = buffer_size
+        self.resources = dict(resources or {})
+        self.nrules = 0
+        self._chunks = []
+        self._size = 0
+        self._category = None
+        self._declared = set()
+        # the batch options exported in each category
+        self._batch_options = {}
+        if state is not None:
+            self._category = state["category"]
+            self._declared.update(state["declared"])
+            self._batch_options.update(state["batch_options"])
+
+    @property
+    def state(self):
+        """dict: The category in effect, and the declared categories and their options.
+
+        This can be stored with the makeflow file, and passed to the writer that
+        appends to it next. The batch options are a list of (category, options)
+        pairs, since a category can be None.
+        """
+        return {
+            "category": self._category,
+            "declared": list(self._declared),
+            "batch_options": list(self._batch_options.items()),
+        }
+
+    def write(self, text):
+        """Write text to the makeflow file.
+
+        Parameters
+        ----------
+        text : str
+            The text to write.
+
+        Returns
+        -------
+        None
+
+        """
+        self._chunks.append(text)
+        self._size += len(text)
+        if self._size >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        """Write out all buffered text.
+
+        Returns
+        -------
+        None
+
+        """
+        if self._chunks:
+            self.f.write("".join(self._chunks))
+            self._chunks = []
+            self._size = 0
+
+    def write_header(self, config_name):
+        """Write the comment at the top of the makeflow file.
+
+        Parameters
+        ----------
+        config_name : str
+            The name of the config file the makeflow was generated from.
+
+        Returns
+        -------
+        None
+
+        """
+        # add comment at top of file listing date of creation and config file name
+        dt = time.strftime("%H:%M:%S on %d %B %Y")
+        self.write(
+            "# makeflow file generated from config file {}\n"
+            "# created at {}\n".format(config_name, dt)
+        )
+
+    def write_rule(self, rule):
+        """Write a rule to the makeflow file.
+
+        Parameters
+        ----------
+        rule : Rule
+            The rule to write.
+
+        Returns
+        -------
+        None
+
+        """
+        if rule.category != self._category:
+            self.write(".MAKEFLOW CATEGORY {}\n".format(rule.category or "default"))
+            if rule.category not in self._declared:
+                for name, value in self.resources.get(rule.category, {}).items():
+                    self.write(".MAKEFLOW {} {}\n".format(name, value))
+                self._declared.add(rule.category)
+            self._category = rule.category
+        batch_options = rule.batch_options
+        if batch_options is not None and batch_options != self._batch_options.get(
+            rule.category
+        ):
+            self.write("export BATCH_OPTIONS = {}\n".format(batch_options))
+            self._batch_options[rule.category] = batch_options
+        # first line lists target file to make (dummy output file), and requirements
+        # second line is "build rule", which runs the shell script and makes the output file
+        command = "LOCAL " + rule.command if rule.local else rule.command
+        self.write(
+            "{0}: {1}\n\t{2}\n\n".format(
+                " ".join(rule.targets), " ".join(rule.sources), command
+            )
+        )
+        self.nrules += 1
+
+    def write_rules(self, rules):
+        """Write rules to the makeflow file as they are generated.
+
+        Parameters
+        ----------
+        rules : iterable of Rule
+            The rules to write.
+
+        Returns
+        -------
+        None
+
+        """
+        for rule in rules:
+            self.write_rule(rule)
+        self.flush()
+
+    def write_footer(self):
+        """Finish the makeflow file.
+
+        The classic format has no footer, so this only writes out the buffer.
+
+        Returns
+        -------
+        None
+
+        """
+        self.flush()
+
+
+class JXWriter(MakeflowWriter):
+    """Write rules to a JX makeflow file through a large buffer.
+
+    The rules are written as a JX workflow, which is run with ``makeflow
+    --jx``. Values shared by many rules are only written once: the strings in
+    `define` become variables, and the batch options of the rules become
+    categories, rather than being repeated in every rule.
+
+    Parameters
+    ----------
+    f : file object
+        The makeflow file, opened for writing text.
+    buffer_size : int, optional
+        The number of bytes to collect before writing to `f`.
+    define : dict, optional
+        Mapping of variable name to a string, such as the work directory.
+        Wherever the string appears in a rule, the variable is used instead.
+    resources : dict, optional
+        Mapping of category name to its resources; see `MakeflowWriter`.
+
+    Attributes
+    ----------
+    nrules : int
+        The number of rules written so far.
+    categories : dict
+        Mapping of category name to the batch options of its rules.
+
+    """
+
+    def __init__(self, f, buffer_size=_WRITE_BUFFER_SIZE, define=None, resources=None):
+        super().__init__(f, buffer_size, resources)
+        self.define = {name: value for name, value in (define or {}).items() if value}
+        self.categories = {}
+        self._category_names = {}
+        self._category_resources = {}
+        self._variables = {value: name for name, value in self.define.items()}
+        if self._variables:
+            # match the longest string first, in case one contains another
+            values = sorted(self._variables, key=len, reverse=True)
+            self._define_regex = re.compile("|".join(map(re.escape, values)))
+        else:
+            self._define_regex = None
+
+    def _expression(self, text):
+        """Get the JX expression of a string, using the defined variables."""
+        if self._define_regex is None:
+            return json.dumps(text)
+        pieces = []
+        last = 0
+        for match in self._define_regex.finditer(text):
+            if match.start() > last:
+                pieces.append(json.dumps(text[last : match.start()]))
+            pieces.append(self._variables[match.group()])
+            last = match.end()
+        if last < len(text) or not pieces:
+            pieces.append(json.dumps(text[last:]))
+        return "+".join(pieces)
+
+    def _category_name(self, name, batch_options):
+        """Get the name of the category of a rule with the given batch options."""
+        key = (name, batch_options)
+        try:
+            return self._category_names[key]
+        except KeyError:
+            pass
+        # categories with the same name but different options are numbered
+        base = name or "default"
+        category = base
+        n = 1
+        while category in self.categories:
+            n += 1
+            category = "{}_{:d}".format(base, n)
+        self.categories[category] = batch_options
+        self._category_names[key] = category
+        if name in self.resources:
+            self._category_resources[category] = {
+                resource.lower(): value
+                for resource, value in self.resources[name].items()
+            }
+        return category
+
+    def write_header(self, config_name):
+        """Start the JX workflow, with its variables.
+
+        The name of the config file and the date of creation are recorded as
+        the variables CONFIG_FILE and CREATED.
+
+        Parameters
+        ----------
+        config_name : str
+            The name of the config file the makeflow was generated from.
+
+        Returns
+        -------
+        None
+
+        """
+        dt = time.strftime("%H:%M:%S on %d %B %Y")
+        define = dict(CONFIG_FILE=config_name, CREATED=dt, **self.define)
+        self.write('{{\n"define": {},\n"rules": [\n'.format(json.dumps(define)))
+
+    def write_rule(self, rule):
+        """Write a rule to the JX workflow.
+
+        Parameters
+        ----------
+        rule : Rule
+            The rule to write.
+
+        Returns
+        -------
+        None
+
+        """
+        if rule.batch_options is not None:
+            self._batch_options[rule.category] = rule.batch_options
+        batch_options = self._batch_options.get(rule.category)
+        entry = [
+            '"command": ' + self._expression(rule.command),
+            '"inputs": [{}]'.format(", ".join(map(self._expression, rule.sources))),
+            '"outputs": [{}]'.format(", ".join(map(self._expression, rule.targets))),
+        ]
+        if batch_options is not None:
+            category = self._category_name(rule.category, batch_options)
+            entry.append('"category": ' + json.dumps(category))
+        if rule.local:
+            entry.append('"local_job": true')
+        if self.nrules > 0:
+            self.write(",\n")
+        self.write("{{{}}}".format(", ".join(entry)))
+        self.nrules += 1
+
+    def write_footer(self):
+        """Finish the JX workflow, with the categories of its rules.
+
+        Returns
+        -------
+        None
+
+        """
+        categories = {}
+        for name, batch_options in self.categories.items():
+            categories[name] = {"environment": {"BATCH_OPTIONS": batch_options}}
+            if name in self._category_resources:
+                categories[name]["resources"] = self._category_resources[name]
+        self.write('\n],\n"categories": {}\n}}\n'.format(json.dumps(categories)))
+        self.flush()
+
+
+# the extension of the makeflow file in each output format
+_OUTPUT_FORMATS = {"make": ".mf", "jx": ".jx"}
+
+
+def _check_output_format(output_format):
+    """Check that an output format is supported, and get its file extension."""
+    try:
+        return _OUTPUT_FORMATS[output_format]
+    except KeyError:
+        raise ValueError(
+            "output_format must be one of {}; got '{}'".format(
+                ", ".join(map(repr, _OUTPUT_FORMATS)), output_format
+            )
+        )
+
+
+def _makeflow_writer(f, output_format, define=None, resources=None):
+    """Get the writer of a makeflow file in the given output format.
+
+    Parameters
+    ----------
+    f : file object
+        The makeflow file, opened for writing text.
+    output_format : str
+        The output format, "make" or "jx".
+    define : dict, optional
+        The variables of a JX workflow; see `JXWriter`.
+    resources : dict, optional
+        The resources of each category; see `MakeflowWriter`.
+
+    Returns
+    -------
+    MakeflowWriter
+        The writer.
+
+    """
+    if output_format == "jx":
+        return JXWriter(f, define=define, resources=resources)
+    return MakeflowWriter(f, resources=resources)
+
+
+def _category_resources(compiled):
+    """Get the resources of the actions of a workflow, as makeflow categories.
+
+    Parameters
+    ----------
+    compiled : CompiledConfig
+        The compiled config of the workflow.
+
+    Returns
+    -------
+    dict
+        Mapping of action name to its "CORES" and "MEMORY" (in MB).
+
+    """
+    resources = {}
+    for name, spec in compiled.actions.items():
+        resources[name] = {"CORES": spec.ncpu, "MEMORY": spec.mem}
+        if spec.ncpu is None:
+            del resources[name]["CORES"]
+    return resources
+
+
+def _duration_hours(duration):
+    """Convert a duration of the `timeout` command to hours.
+
+    Parameters
+    ----------
+    duration : str or int or None
+        The duration, as a number of seconds or a number followed by one of
+        "s", "m", "h" or "d".
+
+    Returns
+    -------
+    float or None
+        The duration in hours, or None if `duration` is None.
+
+    """
+    if duration is None:
+        return None
+    match = re.fullmatch(r"\s*([0-9.]+)\s*([smhd]?)\s*", str(duration))
+    if match is None:
+        raise ValueError(f"could not interpret the duration '{duration}'")
+    seconds = {"": 1, "s": 1, "m": 60, "h": 3600, "d": 86400}[match.group(2)]
+    return float(match.group(1)) * seconds / 3600
+
+
+class MakeflowDAG:
+    """The rules of a makeflow, as a directed acyclic graph of tasks.
+
+    Each rule of the makeflow is a task, i.e., a batch job. A task depends on
+    another one if one of its sources is a target of the other; the other
+    sources, such as task scripts, are not tasks. The parents of the tasks
+    are kept in compressed sparse row form: the parents of task `i` are
+    ``parents[offsets[i]:offsets[i + 1]]``.
+
+    Parameters
+    ----------
+    rules : iterable of Rule
+        The rules of the makeflow.
+    resources : dict, optional
+        The resources of each category; see `MakeflowWriter`.
+    walltime : float, optional
+        The time requested for each task, in hours.
+    shared_wrappers : iterable of str, optional
+        The categories whose tasks run a wrapper script shared by the whole
+        category (see the "shared_wrappers" option), rather than one of
+        their own.
+
+    Attributes
+    ----------
+    rules : list of Rule
+        The rules of the makeflow, in the order they are written.
+    offsets : array of int
+        The start of the parents of each task in `parents`.
+    parents : array of int
+        The indices of the parents of all of the tasks.
+
+    """
+
+    __slots__ = (
+        "rules",
+        "resources",
+        "walltime",
+        "shared_wrappers",
+        "offsets",
+        "parents",
+        "_children",
+        "_levels",
+        "_order",
+    )
+
+    def __init__(self, rules, resources=None, walltime=None, shared_wrappers=()):
+        self.rules = list(rules)
+        self.resources = {} if resources is None else resources
+        self.walltime = walltime
+        self.shared_wrappers = frozenset(shared_wrappers)
+        self._children = None
+        self._levels = None
+        self._order = None
+
+        index = {}
+        for i, rule in enumerate(self.rules):
+            for target in rule.targets:
+                index[target] = i
+        self.offsets = array.array("l", [0])
+        self.parents = array.array("l")
+        for rule in self.rules:
+            # a task depends on another one once, however many of its targets
+            # are sources
+            parents = dict.fromkeys(index.get(source) for source in rule.sources)
+            parents.pop(None, None)
+            self.parents.extend(parents)
+            self.offsets.append(len(self.parents))
+
+    def __len__(self):
+        """Get the number of tasks."""
+        return len(self.rules)
+
+    @property
+    def nedges(self):
+        """Return the number of dependencies between tasks."""
+        return len(self.parents)
+
+    @property
+    def levels(self):
+        """Return the level of each task, as an array of int.
+
+        Tasks without parents are at level 0, and every other task is one
+        level below its lowest parent.
+        """
+        if self._levels is None:
+            self._topology()
+        return self._levels
+
+    @property
+    def order(self):
+        """Return the tasks in a topological order, as an array of int.
+
+        Every task comes after all of its parents.
+        """
+        if self._order is None:
+            self._topology()
+        return self._order
+
+    def children(self, task):
+        """Get the tasks that depend on a task.
+
+        Parameters
+        ----------
+        task : int
+            The index of the task.
+
+        Returns
+        -------
+        array of int
+            The indices of the children of the task.
+
+        """
+        if self._children is None:
+            # invert the parents into the children of each task
+            ntasks = len(self.rules)
+            offsets = self.offsets
+            counts = array.array("l", [0]) * (ntasks + 1)
+            for parent in self.parents:
+                counts[parent + 1] += 1
+            for i in range(ntasks):
+                counts[i + 1] += counts[i]
+            child_offsets = array.array("l", counts)
+            children = array.array("l", [0]) * len(self.parents)
+            for i in range(ntasks):
+                for parent in self.parents[offsets[i] : offsets[i + 1]]:
+                    children[counts[parent]] = i
+                    counts[parent] += 1
+            self._children = (child_offsets, children)
+        child_offsets, children = self._children
+        return children[child_offsets[task] : child_offsets[task + 1]]
+
+    def _topology(self):
+        """Find the topological order and the level of each task.
+
+        Raises
+        ------
+        ValueError
+            This is raised if the dependencies of the tasks have a cycle.
+
+        """
+        ntasks = len(self.rules)
+        offsets = self.offsets
+        levels = array.array("l", [0]) * ntasks
+        waiting = array.array("l", (offsets[i + 1] - offsets[i] for i in range(ntasks)))
+        ready = array.array("l", (i for i in range(ntasks) if waiting[i] == 0))
+        for task in ready:
+            level = levels[task] + 1
+            for child in self.children(task):
+                if levels[child] < level:
+                    levels[child] = level
+                waiting[child] -= 1
+                if waiting[child] == 0:
+                    ready.append(child)
+        if len(ready) < ntasks:
+            raise ValueError("the dependencies of the makeflow have a cycle")
+        self._levels = levels
+        self._order = ready
+
+    @property
+    def depth(self):
+        """Return the number of levels of the graph."""
+        return max(self.levels) + 1 if self.rules else 0
+
+    def widths(self):
+        """Get the number of tasks at each level.
+
+        Returns
+        -------
+        list of int
+            The number of tasks at each level, from level 0.
+
+        """
+        widths = [0] * self.depth
+        for level in self.levels:
+            widths[level] += 1
+        return widths
+
+    def task_counts(self):
+        """Get the number of tasks of each category.
+
+        Returns
+        -------
+        dict
+            Mapping of each category (usually the action) to its number of
+            tasks, in the order the categories first appear.
+
+        """
+        counts = {}
+        for rule in self.rules:
+            counts[rule.category] = counts.get(rule.category, 0) + 1
+        return counts
+
+    def edge_counts(self):
+        """Get the number of dependencies of the tasks of each category.
+
+        Returns
+        -------
+        dict
+            Mapping of each category to the number of dependencies of its
+            tasks on other tasks, in the order the categories first appear.
+
+        """
+        counts = {}
+        for i, rule in enumerate(self.rules):
+            nparents = self.offsets[i + 1] - self.offsets[i]
+            counts[rule.category] = counts.get(rule.category, 0) + nparents
+        return counts
+
+    def max_fan_in(self):
+        """Get the task that depends on the most other tasks.
+
+        Returns
+        -------
+        target : str or None
+            The target of the task, or None if there are no tasks.
+        nparents : int
+            The number of tasks it depends on.
+
+        """
+        target, nparents = None, 0
+        for i, rule in enumerate(self.rules):
+            if target is None or self.offsets[i + 1] - self.offsets[i] > nparents:
+                target = rule.target
+                nparents = self.offsets[i + 1] - self.offsets[i]
+        return target, nparents
+
+    @property
+    def nfiles(self):
+        """Return the number of files made by writing and running the makeflow.
+
+        Each task has a wrapper script, a log file and an output file, and a
+        bundled or fused task also has a wrapper script and a log file of its
+        own. The tasks of a category with a shared wrapper script only have
+        their log and output files, and the shared script is counted once. A
+        local task only makes its output file. The makeflow file itself is not
+        counted.
+        """
+        nfiles = len(self.shared_wrappers)
+        for rule in self.rules:
+            ntargets = 1 + len(rule.extra_targets)
+            if rule.local:
+                nfiles += ntargets
+            else:
+                per_task = 2 if rule.category in self.shared_wrappers else 3
+                nfiles += per_task * ntargets + (2 if ntargets > 1 else 0)
+        return nfiles
+
+    def _resource_hours(self, resource, default, walltime):
+        """Get the total of a resource times the walltime of the tasks."""
+        if walltime is None:
+            walltime = self.walltime
+        counts = {}
+        for rule in self.rules:
+            if not rule.local:
+                counts[rule.category] = counts.get(rule.category, 0) + 1
+        total = 0.0
+        for category, ntasks in counts.items():
+            if isinstance(walltime, dict):
+                hours = walltime.get(category)
+            else:
+                hours = walltime
+            if hours is None:
+                raise ValueError(f"the walltime of category {category} is not known")
+            amount = self.resources.get(category, {}).get(resource) or default
+            total += ntasks * amount * hours
+        return total
+
+    def core_hours(self, walltime=None):
+        """Get the total core-hours requested by the tasks.
+
+        Parameters
+        ----------
+        walltime : float or dict, optional
+            The time requested for each task in hours, or a mapping of category
+            to the time requested for its tasks. Defaults to `walltime`.
+
+        Returns
+        -------
+        float
+            The sum over the tasks of their cores times their walltime. Tasks
+            of categories without a number of cores use one core, and local
+            tasks are not counted.
+
+        Raises
+        ------
+        ValueError
+            This is raised if the walltime of a task is not known.
+
+        """
+        return self._resource_hours("CORES", 1, walltime)
+
+    def memory_hours(self, walltime=None):
+        """Get the total memory-hours requested by the tasks.
+
+        Parameters
+        ----------
+        walltime : float or dict, optional
+            The time requested for each task in hours, or a mapping of category
+            to the time requested for its tasks. Defaults to `walltime`.
+
+        Returns
+        -------
+        float
+            The sum over the tasks of their memory in MB times their walltime.
+            Tasks of categories without an amount of memory, and local tasks,
+            are not counted.
+
+        Raises
+        ------
+        ValueError
+            This is raised if the walltime of a task is not known.
+
+        """
+        return self._resource_hours("MEMORY", 0, walltime)
+
+    def summary(self, walltime=None):
+        """Get the statistics of the graph.
+
+        Parameters
+        ----------
+        walltime : float or dict, optional
+            The time of each task used for the core-hours and memory-hours;
+            see `core_hours`. Defaults to `walltime`.
+
+        Returns
+        -------
+        dict
+            The number of "tasks", the "tasks_per_category", the number of
+            "edges", the "edges_per_category", the "max_fan_in" (see
+            `max_fan_in`), the "depth", the "widths" of the levels, the number
+            of "files" made (see `nfiles`), and the total "core_hours" and
+            "memory_hours" (None if the walltime is not known).
+
+        """
+        try:
+            core_hours = self.core_hours(walltime)
+            memory_hours = self.memory_hours(walltime)
+        except ValueError:
+            core_hours = None
+            memory_hours = None
+        return {
+            "tasks": len(self),
+            "tasks_per_category": self.task_counts(),
+            "edges": self.nedges,
+            "edges_per_category": self.edge_counts(),
+            "max_fan_in": self.max_fan_in(),
+            "depth": self.depth,
+            "widths": self.widths(),
+            "files": self.nfiles,
+            "core_hours": core_hours,
+            "memory_hours": memory_hours,
+        }
+
+    def task_durations(self, runtimes, default=None):
+        """Get the expected duration of each task.
+
+        A task runs the command of each of its targets, which is more than one
+        for bundled or fused tasks. The action of each target is read from its
+        name, "<obsid>.<ACTION>.out". Local tasks take no time.
+
+        Parameters
+        ----------
+        runtimes : dict
+            Mapping of action name to the runtime of each of its tasks, in
+            hours; see `runtimes_from_config` and `runtimes_from_logs`.
+        default : float, optional
+            The runtime of the actions not in `runtimes`, in hours.
+
+        Returns
+        -------
+        array of float
+            The duration of each task, in hours.
+
+        Raises
+        ------
+        ValueError
+            This is raised if the runtime of an action is not known.
+
+        """
+        durations = array.array("d")
+        for rule in self.rules:
+            duration = 0.0
+            if rule.local:
+                durations.append(duration)
+                continue
+            for target in rule.targets:
+                action = _target_action(target)
+                hours = runtimes.get(action, default)
+                if hours is None:
+                    raise ValueError(f"the runtime of action {action} is not known")
+                duration += hours
+            durations.append(duration)
+        return durations
+
+    def critical_path(self, durations):
+        """Find the longest chain of dependent tasks.
+
+        No matter how many jobs run at once, the workflow cannot finish sooner
+        than the length of its critical path.
+
+        Parameters
+        ----------
+        durations : sequence of float
+            The duration of each task; see `task_durations`.
+
+        Returns
+        -------
+        length : float
+            The total duration of the tasks on the critical path.
+        path : list of int
+            The indices of the tasks on the critical path, in order.
+
+        """
+        ntasks = len(self.rules)
+        offsets = self.offsets
+        parents = self.parents
+        finish = array.array("d", [0.0]) * ntasks
+        previous = array.array("l", [-1]) * ntasks
+        for task in self.order:
+            start = 0.0
+            for parent in parents[offsets[task] : offsets[task + 1]]:
+                if finish[parent] > start:
+                    start = finish[parent]
+                    previous[task] = parent
+            finish[task] = start + durations[task]
+        if ntasks == 0:
+            return 0.0, []
+
+        task = max(range(ntasks), key=finish.__getitem__)
+        length = finish[task]
+        path = []
+        while task >= 0:
+            path.append(task)
+            task = previous[task]
+        return length, path[::-1]
+
+    def makespan(self, durations, slots=None):
+        """Predict the wall time of the workflow for a number of concurrent jobs.
+
+        The run of makeflow is simulated: as long as fewer than `slots` jobs
+        are running, the ready task that comes first in the makeflow file is
+        started. The time spent waiting in the queue of the batch system is
+        not included.
+
+        Parameters
+        ----------
+        durations : sequence of float
+            The duration of each task; see `task_durations`.
+        slots : int, optional
+            The number of jobs that can run at once, i.e., the ``-J`` option
+            of makeflow. Defaults to no limit.
+
+        Returns
+        -------
+        float
+            The predicted wall time, in the units of `durations`.
+
+        """
+        if slots is None:
+            return self.critical_path(durations)[0]
+        if slots < 1:
+            raise ValueError("slots must be at least 1")
+
+        offsets = self.offsets
+        ready = [task for task, level in enumerate(self.levels) if level == 0]
+        waiting = array.array(
+            "l", (offsets[i + 1] - offsets[i] for i in range(len(self.rules)))
+        )
+        running = []
+        now = 0.0
+        while ready or running:
+            while ready and len(running) < slots:
+                task = heapq.heappop(ready)
+                heapq.heappush(running, (now + durations[task], task))
+            now, task = heapq.heappop(running)
+            for child in self.children(task):
+                waiting[child] -= 1
+                if waiting[child] == 0:
+                    heapq.heappush(ready, child)
+        return now
+
+    def bottom_levels(self, durations):
+        """Get the length of the longest path from each task to the end.
+
+        Parameters
+        ----------
+        durations : sequence of float
+            The duration of each task; see `task_durations`.
+
+        Returns
+        -------
+        array of float
+            The total duration of the longest chain of dependent tasks starting
+            with each task, including the task itself.
+
+        """
+        levels = array.array("d", [0.0]) * len(self.rules)
+        for task in reversed(self.order):
+            longest = 0.0
+            for child in self.children(task):
+                if levels[child] > longest:
+                    longest = levels[child]
+            levels[task] = durations[task] + longest
+        return levels
+
+    def sorted_by_priority(self, durations):
+        """Sort the rules so that the tasks on the longest paths come first.
+
+        Makeflow starts the ready tasks roughly in the order of the makeflow
+        file. Writing the rules with the longest remaining path to the end of
+        the workflow (their bottom level) first starts long chains of tasks
+        early, instead of leaving them for the end. The dependencies of the
+        tasks are not changed.
+
+        Parameters
+        ----------
+        durations : sequence of float
+            The duration of each task; see `task_durations`.
+
+        Returns
+        -------
+        MakeflowDAG
+            The graph of the same tasks, with the rules sorted by decreasing
+            bottom level. Ties keep the order of the rules.
+
+        """
+        levels = self.bottom_levels(durations)
+        order = sorted(range(len(self.rules)), key=lambda task: -levels[task])
+        return MakeflowDAG(
+            [self.rules[task] for task in order],
+            self.resources,
+            self.walltime,
+            self.shared_wrappers,
+        )
+
+    def transitive_reduction(self):
+        """Remove the dependencies that are implied by other dependencies.
+
+        If a task depends on two tasks, one of which depends on the other, the
+        dependency on the other is implied, and its sources are dropped from
+        the rule. A task that depends on several targets of the same task
+        keeps only the first of them. The sources that are not made by a task,
+        such as task scripts, are kept.
+
+        A parent of a task is implied if it is an ancestor of another parent.
+        This is found by searching up from the other parents, no further than
+        the lowest level of the parents, so that only the part of the graph
+        between the parents of a task is visited, and memory stays linear in
+        the number of tasks.
+
+        Returns
+        -------
+        MakeflowDAG
+            The graph of the same tasks, with the fewest dependencies that
+            keep the same order of the tasks.
+
+        """
+        offsets = self.offsets
+        parents = self.parents
+        index = {}
+        for i, rule in enumerate(self.rules):
+            for target in rule.targets:
+                index[target] = i
+
+        levels = self.levels
+        rules = list(self.rules)
+        for task, rule in enumerate(self.rules):
+            task_parents = parents[offsets[task] : offsets[task + 1]]
+            implied = set()
+            if len(task_parents) > 1:
+                # search up from the parents of the parents for other parents,
+                # which cannot be above the lowest level of the parents
+                candidates = set(task_parents)
+                lowest = min(levels[parent] for parent in task_parents)
+                stack = [
+                    grandparent
+                    for parent in task_parents
+                    for grandparent in parents[offsets[parent] : offsets[parent + 1]]
+                ]
+                visited = set()
+                while stack:
+                    ancestor = stack.pop()
+                    if ancestor in visited or levels[ancestor] < lowest:
+                        continue
+                    visited.add(ancestor)
+                    if ancestor in candidates:
+                        implied.add(ancestor)
+                    stack.extend(parents[offsets[ancestor] : offsets[ancestor + 1]])
+
+            # keep the first source made by each parent that is not implied
+            sources = []
+            seen = set()
+            for source in rule.sources:
+                parent = index.get(source)
+                if parent is not None:
+                    if parent in seen or parent in implied:
+                        continue
+                    seen.add(parent)
+                sources.append(source)
+            if len(sources) < len(rule.sources):
+                rules[task] = Rule(
+                    rule.target,
+                    sources,
+                    rule.command,
+                    batch_options=rule.batch_options,
+                    category=rule.category,
+                    extra_targets=rule.extra_targets,
+                    local=rule.local,
+                )
+        return MakeflowDAG(rules, self.resources, self.walltime, self.shared_wrappers)
+
+    def makespan_table(self, durations, slots):
+        """Tabulate the wall time of the workflow against the number of jobs.
+
+        Parameters
+        ----------
+        durations : sequence of float
+            The duration of each task; see `task_durations`.
+        slots : iterable of int
+            The numbers of jobs that can run at once to tabulate.
+
+        Returns
+        -------
+        list of tuple
+            For each number of jobs, the tuple (slots, lower_bound, predicted)
+            of the lower bound on the wall time, which is the larger of the
+            critical path and the total work divided among the jobs, and the
+            predicted wall time (see `makespan`).
+
+        """
+        critical = self.critical_path(durations)[0]
+        total = sum(durations)
+        return [
+            (nslots, max(critical, total / nslots), self.makespan(durations, nslots))
+            for nslots in slots
+        ]
+
+
+def _target_action(target):
+    """Get the action of a target, named "<obsid>.<ACTION>.out"."""
+    if target.endswith(".out"):
+        target = target[: -len(".out")]
+    return target.rsplit(".", 1)[-1].upper()
+
+
+def runtimes_from_config(config_file):
+    """Read the expected runtime of the actions of a workflow from its config.
+
+    The runtime of each task of an action is given by its "runtime" entry, as
+    a number of seconds or a number followed by "s", "m", "h" or "d", like the
+    "timeout" option.
+
+    Parameters
+    ----------
+    config_file : str
+        The full path to the configuration file.
+
+    Returns
+    -------
+    dict
+        Mapping of the name of each action with a "runtime" to its runtime, in
+        hours.
+
+    """
+    return _compiled_runtimes(load_config(config_file))
+
+
+def _compiled_runtimes(compiled):
+    """Get the runtimes of the actions of a compiled config with a runtime."""
+    return {
+        name: spec.runtime
+        for name, spec in compiled.actions.items()
+        if spec.runtime is not None
+    }
+
+
+# the output of `date`, e.g., "Thu Oct 17 12:34:56 UTC 2019"
+_DATE_REGEX = re.compile(
+    r"^[A-Z][a-z]{2} +([A-Z][a-z]{2}) +(\d{1,2}) (\d{1,2}:\d{2}:\d{2}) (?:\S+ )?(\d{4})$"
+)
+
+
+def _log_hours(log_file):
+    """Get the elapsed time of a task from the dates at the ends of its log file.
+
+    Parameters
+    ----------
+    log_file : str
+        The full path to the log file.
+
+    Returns
+    -------
+    float or None
+        The elapsed time in hours, or None if the task did not finish.
+
+    """
+    with open(log_file, "rb") as f:
+        lines = f.read().decode(errors="ignore").strip().splitlines()
+    if len(lines) < 2:
+        return None
+    dates = []
+    for line in (lines[0], lines[-1]):
+        match = _DATE_REGEX.match(line.strip())
+        if match is None:
+            return None
+        dates.append(datetime.strptime(" ".join(match.groups()), "%b %d %H:%M:%S %Y"))
+    return (dates[1] - dates[0]).total_seconds() / 3600
+
+
+def runtimes_from_logs(work_dir):
+    """Estimate the runtime of the actions of a workflow from its log files.
+
+    The wrapper script of each task writes the date at the start and end of
+    its log file. The runtime of an action is the median elapsed time of its
+    tasks that succeeded; the log files of tasks that failed are renamed, and
+    are not used.
+
+    Parameters
+    ----------
+    work_dir : str
+        The work directory of a previous run of the workflow.
+
+    Returns
+    -------
+    dict
+        Mapping of the name of each action with finished tasks to its runtime,
+        in hours.
+
+    """
+    elapsed = {}
+    for log_file in glob.glob(os.path.join(work_dir, "*.log")):
+        name = os.path.basename(log_file)[: -len(".log")]
+        if name.endswith((".bundle", ".fused")):
+            # the tasks of bundles and chains have their own log files
+            continue
+        hours = _log_hours(log_file)
+        if hours is not None:
+            elapsed.setdefault(_target_action(name), []).append(hours)
+    return {action: statistics.median(hours) for action, hours in elapsed.items()}
+
+
+def _content_hash(text):
+    """Get the hash of a string, as a hex digest."""
+    return hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+
+
+class Manifest:
+    """Hashes of the rules and wrapper scripts of a makeflow.
+
+    The manifest is kept next to the makeflow file in the work directory. When
+    a makeflow is regenerated, files whose contents have not changed since the
+    last build are not rewritten, and the tasks whose rules or wrapper scripts
+    changed are recorded. The files of the previous build that are no longer
+    part of the makeflow, such as the wrapper scripts of removed tasks, are
+    deleted when the manifest is saved.
+
+    Parameters
+    ----------
+    path : str
+        The full path to the manifest file. If it exists, the hashes of the
+        previous build are read from it.
+    work_dir : str, optional
+        The full path to the directory of the wrapper scripts. Defaults to the
+        directory of the manifest file.
+
+    Attributes
+    ----------
+    added : list of str
+        The targets of the rules that were not in the previous build.
+    changed : list of str
+        The targets of the rules whose rule or wrapper script changed.
+    written : set of str
+        The full paths of the files that were (re)written.
+    deleted : list of str
+        The full paths of the files of the previous build that were deleted
+        by `save`.
+
+    """
+
+    def __init__(self, path, work_dir=None):
+        self.path = path
+        self.work_dir = os.path.dirname(path) if work_dir is None else work_dir
+        try:
+            with open(path) as f:
+                previous = json.load(f)
+        except (OSError, ValueError):
+            previous = {}
+        self._old_files = previous.get("files", {})
+        self._old_rules = previous.get("rules", {})
+        self._old_makeflow = previous.get("makeflow")
+        self.files = {}
+        self.rules = {}
+        self.added = []
+        self.changed = []
+        self.written = set()
+        self.deleted = []
+        self._makeflow = hashlib.blake2b(digest_size=16)
+
+    def update(self, filename, contents):
+        """Record the contents of a file, and check whether to write it.
+
+        Parameters
+        ----------
+        filename : str
+            The full path to the file.
+        contents : str
+            The contents of the file.
+
+        Returns
+        -------
+        bool
+            Whether the file must be written, because it is new, its contents
+            changed, or it no longer exists.
+
+        """
+        name = os.path.basename(filename)
+        digest = _content_hash(contents)
+        self.files[name] = digest
+        if self._old_files.get(name) == digest and os.path.exists(filename):
+            return False
+        self.written.add(filename)
+        return True
+
+    def track_rules(self, rules):
+        """Record the rules of a makeflow as they are generated.
+
+        Parameters
+        ----------
+        rules : iterable of Rule
+            The rules of the makeflow. The wrapper script of each rule must
+            already have been passed to `update`.
+
+        Yields
+        ------
+        Rule
+            The rules, unchanged.
+
+        """
+        for rule in rules:
+            targets = rule.targets
+            digest = _content_hash(
+                "\n".join(
+                    [
+                        str(rule.batch_options),
+                        " ".join(targets),
+                        " ".join(rule.sources),
+                        rule.command,
+                    ]
+                )
+            )
+            self._makeflow.update(digest.encode())
+            wrapper_script = rule.command.split(" ", 1)[0]
+            for target in targets:
+                self.rules[target] = digest
+                if target not in self._old_rules:
+                    self.added.append(target)
+                elif (
+                    self._old_rules[target] != digest or wrapper_script in self.written
+                ):
+                    self.changed.append(target)
+            yield rule
+
+    @property
+    def removed(self):
+        """The targets of the previous build that are no longer in the makeflow."""
+        return sorted(set(self._old_rules) - set(self.rules))
+
+    @property
+    def makeflow_changed(self):
+        """Whether the rules differ from those of the previous build."""
+        return self._makeflow.hexdigest() != self._old_makeflow
+
+    def report(self):
+        """Summarize the tasks affected by the build.
+
+        Returns
+        -------
+        dict
+            The targets of the "added", "changed" and "removed" tasks.
+
+        """
+        return {
+            "added": list(self.added),
+            "changed": list(self.changed),
+            "removed": self.removed,
+        }
+
+    def save(self):
+        """Write the manifest file, and delete the files no longer in the build.
+
+        Returns
+        -------
+        None
+
+        """
+        for name in sorted(set(self._old_files) - set(self.files)):
+            filename = os.path.join(self.work_dir, name)
+            if os.path.exists(filename):
+                os.remove(filename)
+                self.deleted.append(filename)
+        manifest = {
+            "makeflow": self._makeflow.hexdigest(),
+            "files": self.files,
+            "rules": self.rules,
+        }
+        with open(self.path, "w") as f:
+            json.dump(manifest, f)
+
+
+class _DryRun:
+    """A stand-in for a `Manifest` that keeps the wrapper scripts from being written.
+
+    Attributes
+    ----------
+    written : set of str
+        Always empty, since no files are written.
+
+    """
+
+    __slots__ = ("written",)
+
+    def __init__(self):
+        self.written = set()
+
+    def update(self, filename, contents):
+        """Check whether to write a file, which is never.
+
+        Parameters
+        ----------
+        filename : str
+            The full path to the file.
+        contents : str
+            The contents of the file.
+
+        Returns
+        -------
+        bool
+            False.
+
+        """
+        return False
+
+
+def _write_wrapper(wrapper_script, contents, manifest=None):
+    """Write an executable wrapper script.
+
+    Parameters
+    ----------
+    wrapper_script : str or Path
+        The full path to the wrapper script.
+    contents : str
+        The contents of the script.
+    manifest : Manifest, optional
+        The manifest of the build. If given, the script is only written if its
+        contents changed since the previous build.
+
+    Returns
+    -------
+    None
+
+    """
+    with _phase("wrappers"):
+        if manifest is not None and not manifest.update(wrapper_script, contents):
+            return
+        with open(wrapper_script, "w") as f:
+            f.write(contents)
+        # make file executable
+        os.chmod(wrapper_script, 0o755)
+
+    return
+
+
+def _task_wrapper_lines(
+    compiled, work_dir, parent_dir, command, args, outfile, logfile, mandc=None
+):
+    """Get the lines of the wrapper script of a single task.
+
+    Parameters
+    ----------
+    compiled : CompiledConfig
+        The compiled config of the workflow.
+    work_dir : str
+        The full path to the work directory.
+    parent_dir : str
+        The directory to run the task in.
+    command : str
+        The task script to run.
+    args : str
+        The arguments of the task script.
+    outfile : str
+        The file touched if the task succeeds.
+    logfile : str
+        The full path to the log file, which is renamed if the task fails.
+    mandc : tuple, optional
+        The (filename, action, obsid_list) to report to M&C. If None, the task
+        is not reported.
+
+    Returns
+    -------
+    list of str
+        The lines of the wrapper script.
+
+    """
+    lines = ["#!/bin/bash"]
+    if compiled.source_script is not None:
+        lines.append("source {}".format(compiled.source_script))
+    if compiled.conda_env is not None:
+        lines.append("conda activate {}".format(compiled.conda_env))
+    lines += ["date", "cd {}".format(parent_dir)]
+
+    if mandc is not None:
+        filename, action, obsid_list = mandc
+        if len(obsid_list) > 1:
+            file_list = " --file_list {}".format(" ".join(obsid_list))
+        else:
+            file_list = ""
+        lines += [
+            f"add_rtp_process_event.py {filename} {action} started{file_list}",
+            f"add_rtp_task_jobid.py {filename} {action} $SLURM_JOB_ID{file_list}",
+        ]
+    if compiled.timeout is not None:
+        lines.append("timeout {0} {1} {2}".format(compiled.timeout, command, args))
+    else:
+        lines.append("{0} {1}".format(command, args))
+    lines.append("if [ $? -eq 0 ]; then")
+    if mandc is not None:
+        lines.append(
+            f"  add_rtp_process_event.py {filename} {action} finished{file_list}"
+        )
+    lines += [
+        "  cd {}".format(work_dir),
+        "  touch {}".format(outfile),
+        "else",
+    ]
+    if mandc is not None:
+        lines.append(f"  add_rtp_process_event.py {filename} {action} error{file_list}")
+    lines += [
+        "  mv {0} {1}".format(logfile, logfile + ".error"),
+        "fi",
+        "date",
+    ]
+    return lines
+
+
+def _single_rule(
+    compiled, action, outfile, parent_dir, work_dir, sources, manifest=None
+):
+    """Make the rule of a SETUP or TEARDOWN step, writing its wrapper script.
+
+    Parameters
+    ----------
+    compiled : CompiledConfig
+        The compiled config of the workflow.
+    action : str
+        The name of the step, "SETUP" or "TEARDOWN".
+    outfile : str
+        The file made by the step.
+    parent_dir : str
+        The directory to run the step in.
+    work_dir : str
+        The full path to the work directory.
+    sources : list of str
+        The files the step depends on, besides its task script.
+    manifest : Manifest, optional
+        The manifest of the build, if the build is incremental.
+
+    Returns
+    -------
+    Rule
+        The rule of the step.
+
+    """
+    spec = compiled.actions[action]
+    # define the logfile
+    logfile = os.path.join(work_dir, re.sub(r"\.out", ".log", outfile))
+
+    # make a small wrapper script that will run the actual command
+    # can't embed if; then statements in makeflow script
+    wrapper_script = "wrapper_{}".format(re.sub(r"\.out", ".sh", outfile))
+    wrapper_script = os.path.join(work_dir, wrapper_script)
+    lines = _task_wrapper_lines(
+        compiled, work_dir, parent_dir, spec.command, spec.args, outfile, logfile
+    )
+    _write_wrapper(wrapper_script, "\n".join(lines) + "\n", manifest=manifest)
+
+    return Rule(
+        outfile,
+        [spec.command] + list(sources),
+        "{0} > {1} 2>&1".format(wrapper_script, logfile),
+        batch_options=spec.batch_options,
+        category=action,
+    )
+
+
+def _grouped_rule(tasks, name, lines, work_dir, manifest=None):
+    """Make the rule of a group of tasks run in a single job.
+
+    Each task of the group keeps its own command, log file and output file, so
+    that downstream tasks depend on the tasks of the group as usual.
+
+    Parameters
+    ----------
+    tasks : list of Rule
+        The rules of the tasks in the group.
+    name : str
+        The name of the group, used for its wrapper script and log file.
+    lines : list of str
+        The lines of the wrapper script of the group.
+    work_dir : str
+        The full path to the work directory.
+    manifest : Manifest, optional
+        The manifest of the build, if the build is incremental.
+
+    Returns
+    -------
+    Rule
+        The rule of the group, which makes the output files of all of its
+        tasks.
+
+    """
+    wrapper_script = os.path.join(work_dir, "wrapper_{}.sh".format(name))
+    logfile = os.path.join(work_dir, "{}.log".format(name))
+    _write_wrapper(wrapper_script, "\n".join(lines) + "\n", manifest=manifest)
+    if manifest is not None and any(
+        task.command.split(" ", 1)[0] in manifest.written for task in tasks
+    ):
+        # the group changes if the wrapper script of one of its tasks does
+        manifest.written.add(wrapper_script)
+
+    # the group waits for the prereqs of all of its tasks
+    targets = [task.target for task in tasks]
+    sources = dict.fromkeys(source for task in tasks for source in task.sources)
+    return Rule(
+        targets[0],
+        [source for source in sources if source not in targets],
+        "{0} > {1} 2>&1".format(wrapper_script, logfile),
+        batch_options=tasks[0].batch_options,
+        category=tasks[0].category,
+        extra_targets=tuple(targets[1:]),
+    )
+
+
+def _bundle_rule(tasks, work_dir, manifest=None):
+    """Make the rule of a bundle of tasks of the same action.
+
+    The tasks of the bundle are independent, and are all run one after the
+    other, even if one of them fails.
+
+    Parameters
+    ----------
+    tasks : list of Rule
+        The rules of the tasks in the bundle.
+    work_dir : str
+        The full path to the work directory.
+    manifest : Manifest, optional
+        The manifest of the build, if the build is incremental.
+
+    Returns
+    -------
+    Rule
+        The rule of the bundle.
+
+    """
+    if len(tasks) == 1:
+        return tasks[0]
+    name = re.sub(r"\.out$", ".bundle", tasks[0].target)
+    lines = ["#!/bin/bash"] + [task.command for task in tasks]
+    return _grouped_rule(tasks, name, lines, work_dir, manifest)
+
+
+def _fused_rule(tasks, work_dir, manifest=None):
+    """Make the rule of a chain of fused tasks of the same obsid.
+
+    The tasks of the chain are run back to back, stopping at the first task
+    that fails, since each task needs the output of the one before.
+
+    Parameters
+    ----------
+    tasks : list of Rule
+        The rules of the tasks in the chain, in order.
+    work_dir : str
+        The full path to the work directory.
+    manifest : Manifest, optional
+        The manifest of the build, if the build is incremental.
+
+    Returns
+    -------
+    Rule
+        The rule of the chain.
+
+    """
+    if len(tasks) == 1:
+        return tasks[0]
+    name = re.sub(r"\.out$", ".fused", tasks[0].target)
+    lines = ["#!/bin/bash"]
+    for task in tasks[:-1]:
+        outfile = os.path.join(work_dir, task.target)
+        lines += [task.command, "if [ ! -e {} ]; then exit 1; fi".format(outfile)]
+    lines.append(tasks[-1].command)
+    return _grouped_rule(tasks, name, lines, work_dir, manifest)
+
+
+def _fusion_chains(compiled):
+    """Find the chains of actions that can be run back to back in one job.
+
+    An action is fused with its prereq if it is the only prereq, if it is the
+    only action that needs the prereq, and if both actions run one task per
+    obsid (no chunks, strides or bundles) with the same batch options.
+
+    Parameters
+    ----------
+    compiled : CompiledConfig
+        The compiled config of the workflow.
+
+    Returns
+    -------
+    dict
+        Mapping of each fused action to the tuple of actions of its chain, in
+        the order of the workflow.
+
+    """
+    workflow = [
+        action for action in compiled.workflow if action not in ("SETUP", "TEARDOWN")
+    ]
+    actions = compiled.actions
+    dependents = {action: [] for action in workflow}
+    for action in workflow:
+        for prereq in actions[action].prereqs:
+            dependents[prereq].append(action)
+
+    def one_to_one(spec):
+        return (
+            spec.chunk_size == 1 and spec.stride_length == 1 and spec.bundle_size == 1
+        )
+
+    chains = {}
+    for ia, action in enumerate(workflow):
+        spec = actions[action]
+        if len(spec.prereqs) != 1 or spec.prereq_chunk_size != 1:
+            continue
+        prereq = spec.prereqs[0]
+        pr_spec = actions[prereq]
+        if (
+            prereq not in workflow[:ia]
+            or len(dependents[prereq]) != 1
+            or not one_to_one(spec)
+            or not one_to_one(pr_spec)
+            or spec.batch_options != pr_spec.batch_options
+        ):
+            continue
+        chain = chains.get(prereq, (prereq,)) + (action,)
+        for member in chain:
+            chains[member] = chain
+    return chains
+
+
+def _analysis_rules(
+    compiled,
+    obsids,
+    obsid_index,
+    work_dir,
+    manifest=None,
+    select=None,
+    fuse=False,
+    barriers=False,
+):
+    """Generate the rules of an analysis makeflow.
+
+    The wrapper scripts of the rules are written as the rules are generated.
+
+    Parameters
+    ----------
+    compiled : CompiledConfig
+        The compiled config of the workflow.
+    obsids : list of str
+        The absolute paths of the obsids, in the order given by the user.
+    obsid_index : ObsidIndex
+        The index of the obsids.
+    work_dir : str
+        The full path to the work directory.
+    manifest : Manifest, optional
+        The manifest of the build, if the build is incremental.
+    select : callable, optional
+        If given, only the tasks for which ``select(action, obsind)`` is True
+        are generated, where `obsind` is the position of the primary obsid of
+        the task in `obsid_index` (None for SETUP and TEARDOWN).
+    fuse : bool, optional
+        If True, run the tasks of each chain of actions found by
+        `_fusion_chains` for an obsid in a single job.
+    barriers : bool, optional
+        If True, the tasks that wait for all of the tasks of a prereq on their
+        JD wait for a single barrier rule instead (see `_barrier_target`),
+        and so does the TEARDOWN.
+
+    Yields
+    ------
+    Rule
+        The rules of the makeflow, in order.
+
+    """
+    workflow = compiled.workflow
+    actions = compiled.actions
+    mandc_report = compiled.mandc_report
+
+    # if we have a setup step, add it here
+    if "SETUP" in workflow:
+        # set parent_dir to correspond to the directory of the first obsid
+        parent_dir = os.path.dirname(obsids[0])
+        if select is None or select("SETUP", None):
+            yield _single_rule(
+                compiled, "SETUP", "setup.out", parent_dir, work_dir, [], manifest
+            )
+        # save outfile as prereq for first step
+        setup_outfiles = ["setup.out"]
+
+    # resolve the partitioning and neighbor windows of each action once
+    nobsids = len(obsid_index)
+    plans = []
+    for ia, action in enumerate(workflow):
+        if action == "SETUP" or action == "TEARDOWN":
+            continue
+        spec = actions[action]
+        chunk_size, stride_length = spec.lengths(nobsids)
+        plans.append((ia, spec, spec.template, chunk_size, stride_length))
+    with _phase("partition"):
+        partitions = {
+            action: _action_partition(spec, obsid_index)
+            for action, spec in actions.items()
+        }
+
+    # write one wrapper script per action, if requested
+    if compiled.shared_wrappers:
+        shared_wrappers = {}
+        for ia, spec, *_ in plans:
+            wrapper_script = os.path.join(work_dir, "wrapper_{}.sh".format(spec.name))
+            _write_shared_wrapper(
+                wrapper_script, spec.name, compiled, work_dir, manifest=manifest
+            )
+            shared_wrappers[spec.name] = wrapper_script
+    else:
+        shared_wrappers = None
+
+    # the tasks of bundled actions that are waiting for a job
+    bundles = {}
+    # the barrier targets, with the tasks they wait for
+    barrier_tasks = {}
+    chains = _fusion_chains(compiled) if fuse else {}
+
+    # main loop over actual data files
+    for obsind, obsid in enumerate(obsid_index.obsids):
+        # get parent directory
+        parent_dir = os.path.dirname(obsid)
+        filename = obsid_index.basenames[obsind]
+        fused = {}
+
+        # loop over actions for this obsid
+        for ia, spec, template, chunk_size, stride_length in plans:
+            action = spec.name
+            partition = partitions[action]
+            if partition.rank(obsind) is None:
+                continue
+            if select is not None and not select(action, obsind):
+                continue
+
+            # start list of input files
+            # this implicitly checks that do_{STAGENAME}.sh script exists
+            infiles = [spec.command]
+
+            # add setup outfile to input requirements
+            if "SETUP" in workflow and ia > 0:
+                infiles.extend(setup_outfiles)
+
+            # make rules
+            if spec.prereqs:
+                with _phase("prereqs"):
+                    # find the range of neighbors whose prereqs must be done
+                    i0, i1 = _prereq_window(
+                        obsid_index,
+                        obsind,
+                        chunk_size=chunk_size,
+                        prereq_chunk_size=spec.prereq_chunk_size,
+                        time_centered=spec.time_centered,
+                        stride_length=stride_length,
+                        collect_stragglers=spec.collect_stragglers,
+                    )
+
+                    for prereq in spec.prereqs:
+                        # add the outfiles of the prereq's primary obsids
+                        # whose chunks overlap the neighbors of this obsid
+                        pr_partition = partitions[prereq]
+                        k0, k1 = pr_partition.covering(i0, i1)
+                        if (
+                            barriers
+                            and k1 - k0 > 1
+                            and (i0, i1) == obsid_index.day_range(filename)
+                        ):
+                            # wait for all of the tasks of the prereq on this JD
+                            jd = obsid_index.parsed[obsind].jd
+                            target = _barrier_target(prereq, jd)
+                            barrier_tasks[target] = (prereq, k0, k1)
+                            infiles.append(target)
+                            continue
+                        for k in range(k0, k1):
+                            pr_obsid = obsid_index.basenames[pr_partition.primary[k]]
+                            infiles.append(make_outfile_name(pr_obsid, prereq)[0])
+
+            # substitute the mini-language in the args
+            with _phase("args"):
+                context = ArgsContext(filename, obsid_index, obsind, partition)
+                prepped_args = template.render(context)
+                if "obsid_list" in template.tokens:
+                    obsid_list = context.obsid_list()
+                else:
+                    obsid_list = []
+
+            for outfile in make_outfile_name(filename, action):
+                # make logfile name
+                # logfile will capture stdout and stderr
+                logfile = re.sub(r"\.out", ".log", outfile)
+                logfile = os.path.join(work_dir, logfile)
+
+                if shared_wrappers is not None:
+                    # pass the values of this task to the wrapper of the action
+                    params = [parent_dir, outfile, filename]
+                    if mandc_report:
+                        if len(obsid_list) > 1:
+                            params.append('"{}"'.format(" ".join(obsid_list)))
+                        else:
+                            params.append('""')
+                    if prepped_args:
+                        params.append(prepped_args)
+                    command = "{0} {1} > {2} 2>&1".format(
+                        shared_wrappers[action], " ".join(params), logfile
+                    )
+                else:
+                    # make a small wrapper script that will run the actual command
+                    # can't embed if; then statements in makeflow script
+                    wrapper_script = re.sub(r"\.out", ".sh", outfile)
+                    wrapper_script = "wrapper_{}".format(wrapper_script)
+                    wrapper_script = os.path.join(work_dir, wrapper_script)
+                    if mandc_report:
+                        mandc = (filename, action, obsid_list)
+                    else:
+                        mandc = None
+                    lines = _task_wrapper_lines(
+                        compiled,
+                        work_dir,
+                        parent_dir,
+                        spec.command,
+                        prepped_args,
+                        outfile,
+                        logfile,
+                        mandc=mandc,
+                    )
+                    _write_wrapper(
+                        wrapper_script, "\n".join(lines) + "\n", manifest=manifest
+                    )
+                    command = "{0} > {1} 2>&1".format(wrapper_script, logfile)
+
+                rule = Rule(
+                    outfile,
+                    list(dict.fromkeys(infiles)),
+                    command,
+                    batch_options=spec.batch_options,
+                    category=action,
+                )
+                if action in chains:
+                    fused.setdefault(chains[action], []).append(rule)
+                elif spec.bundle_size > 1:
+                    # run consecutive tasks of the action in a single job
+                    bundle = bundles.setdefault(action, [])
+                    bundle.append(rule)
+                    if len(bundle) == spec.bundle_size:
+                        yield _bundle_rule(bundle, work_dir, manifest)
+                        del bundles[action]
+                else:
+                    yield rule
+
+        # run the tasks of each chain of fused actions in a single job
+        for tasks in fused.values():
+            yield _fused_rule(tasks, work_dir, manifest)
+
+    # the last bundle of an action may have fewer tasks
+    for bundle in bundles.values():
+        yield _bundle_rule(bundle, work_dir, manifest)
+
+    # if we have a teardown step, add it here
+    teardown = "TEARDOWN" in workflow and (select is None or select("TEARDOWN", None))
+    if teardown:
+        # set parent_dir to correspond to the directory of the last obsid
+        parent_dir = os.path.dirname(obsids[-1])
+
+        # assume that we wait for all other steps of the pipeline to finish
+        # add the final outfiles for the last per-file step for all obsids
+        action = workflow[-2]
+        infiles = _gather_sources(
+            action,
+            partitions[action],
+            obsid_index,
+            barrier_tasks if barriers else None,
+        )
+
+    for target, (action, k0, k1) in barrier_tasks.items():
+        primary = partitions[action].primary
+        sources = []
+        for k in range(k0, k1):
+            sources.extend(make_outfile_name(obsid_index.basenames[primary[k]], action))
+        yield Rule(
+            target,
+            sources,
+            "touch {}".format(target),
+            category="BARRIER",
+            local=True,
+        )
+
+    if teardown:
+        yield _single_rule(
+            compiled,
+            "TEARDOWN",
+            "teardown.out",
+            parent_dir,
+            work_dir,
+            infiles,
+            manifest,
+        )
+
+
+def _gather_sources(action, partition, obsid_index, barrier_tasks=None):
+    """Get the sources of a rule that waits for all of the tasks of an action.
+
+    The sources are found in a single pass over the primary obsids of the
+    action, so this is linear in the number of obsids.
+
+    Parameters
+    ----------
+    action : str
+        The name of the action to wait for.
+    partition : StridePartition
+        The partition of the obsids for `action`.
+    obsid_index : ObsidIndex
+        The index of the sorted obsids.
+    barrier_tasks : dict, optional
+        If given, wait for the barrier of `action` on each JD instead of for
+        each of its tasks, and add the barriers to this dict, which maps their
+        targets to the (action, start, stop) range of primary obsids they wait
+        for.
+
+    Returns
+    -------
+    list of str
+        The sources, without duplicates.
+
+    """
+    sources = []
+    if barrier_tasks is None:
+        for obsid in partition.primary_obsids:
+            sources.extend(make_outfile_name(os.path.basename(obsid), action))
+        return list(dict.fromkeys(sources))
+    for jd, (start, stop) in obsid_index.jd_ranges.items():
+        k0, k1 = partition.covering(start, stop)
+        target = _barrier_target(action, jd)
+        barrier_tasks[target] = (action, k0, k1)
+        sources.append(target)
+    return sources
+
+
+def _barrier_target(action, jd):
+    """Get the target of the barrier rule of the tasks of an action on a JD.
+
+    A barrier rule is run by makeflow itself once all of the tasks of an
+    action on a JD have finished, so that the tasks that wait for all of them
+    depend on one target rather than on every one of their outfiles. This
+    makes the number of dependencies grow linearly with the number of obsids,
+    rather than quadratically.
+
+    Parameters
+    ----------
+    action : str
+        The name of the action.
+    jd : str or None
+        The integer JD, or None if the JDs of the obsids are not known.
+
+    Returns
+    -------
+    str
+        The name of the barrier target, "<jd>.<action>.barrier.out".
+
+    """
+    return "{}.{}.barrier.out".format(jd or "all", action)
+
+
+def _analysis_dag(
+    compiled,
+    obsids,
+    obsid_index,
+    work_dir,
+    manifest=None,
+    fuse=False,
+    barriers=False,
+):
+    """Build the graph of the tasks of an analysis workflow.
+
+    Parameters
+    ----------
+    compiled : CompiledConfig
+        The compiled config of the workflow.
+    obsids : list of str
+        The full paths to the obsids.
+    obsid_index : ObsidIndex
+        The index of the obsids.
+    work_dir : str
+        The full path to the work directory.
+    manifest : Manifest or _DryRun, optional
+        The manifest of the build, if the build is incremental, or a `_DryRun`
+        if no wrapper scripts are to be written.
+    fuse : bool, optional
+        Whether to fuse chains of actions; see `_analysis_rules`.
+    barriers : bool, optional
+        Whether to add barrier rules; see `_analysis_rules`.
+
+    Returns
+    -------
+    MakeflowDAG
+        The graph of the tasks.
+
+    """
+    rules = _analysis_rules(
+        compiled,
+        obsids,
+        obsid_index,
+        work_dir,
+        manifest,
+        fuse=fuse,
+        barriers=barriers,
+    )
+    if compiled.shared_wrappers:
+        # one wrapper script per action, as written by `_analysis_rules`
+        shared_wrappers = [
+            action
+            for action in compiled.workflow
+            if action != "SETUP" and action != "TEARDOWN"
+        ]
+    else:
+        shared_wrappers = ()
+    if compiled.timeout is not None:
+        walltime = _duration_hours(compiled.timeout)
+    else:
+        # without a timeout, the tasks take about the runtimes of their actions
+        walltime = _compiled_runtimes(compiled) or None
+    return MakeflowDAG(
+        rules,
+        resources=_category_resources(compiled),
+        walltime=walltime,
+        shared_wrappers=shared_wrappers,
+    )
+
+
+def build_analysis_dag(
+    obsids, config_file, work_dir=None, fuse=False, barriers=False, dry_run=False
+):
+    """Build the graph of the tasks of an analysis workflow, without a makeflow.
+
+    The wrapper scripts of the tasks are written to the work directory, as for
+    `build_analysis_makeflow_from_config`, but the makeflow file is not. The
+    graph can be used to look at the shape and cost of the workflow before
+    submitting it, e.g., with `MakeflowDAG.summary`.
+
+    Parameters
+    ----------
+    obsids : list of str
+        A list of paths to obsids/filenames for processing.
+    config_file : str
+        The full path to configuration file.
+    work_dir : str, optional
+        The full path to the "work directory" where all of the wrapper scripts
+        will be made. Defaults to the current directory.
+    fuse, barriers : bool, optional
+        Whether to fuse chains of actions and to add barrier rules; see
+        `build_analysis_makeflow_from_config`.
+    dry_run : bool, optional
+        If True, the wrapper scripts are not written either, so that nothing
+        is written to the work directory.
+
+    Returns
+    -------
+    MakeflowDAG
+        The graph of the tasks. Its walltime is the timeout of the workflow,
+        if there is one, or otherwise the "runtime" of each action that has
+        one (see `runtimes_from_config`).
+
+    """
+    with _phase("config"):
+        compiled = load_config(config_file)
+    if work_dir is None:
+        work_dir = os.getcwd()  # pragma: no cover
+    else:
+        work_dir = os.path.abspath(work_dir)
+    obsids = [os.path.abspath(obsid) for obsid in obsids]
+    return _analysis_dag(
+        compiled,
+        obsids,
+        ObsidIndex(obsids),
+        work_dir,
+        _DryRun() if dry_run else None,
+        fuse=fuse,
+        barriers=barriers,
+    )
+
+
+def build_analysis_makeflow_from_config(
+    obsids,
+    config_file,
+    mf_name=None,
+    work_dir=None,
+    incremental=False,
+    output_format="make",
+    fuse=False,
+    order="obsid",
+    transitive_reduction=False,
+    barriers=False,
+):
+    """Construct a makeflow file from a config file.
+
+    Parameters
+    ----------
+    obsids : list of str
+        A list of paths to obsids/filenames for processing.
+    config_file : str
+        The full path to configuration file.
+    mf_name : str
+        The name of makeflow file. Defaults to "<config_file_basename>.mf" (or
+        ".jx" for JX output) if not specified.
+    work_dir : str
+        The full path to the "work directory" where all of the wrapper scripts and log
+        files will be made. Defaults to the current directory.
+    incremental : bool, optional
+        If True, keep a manifest of the hashes of the rules and wrapper scripts
+        in the work directory ("<mf_name>.manifest"), and only rewrite the files
+        whose contents changed since the previous build. Default is False.
+    output_format : str, optional
+        The format of the makeflow file: "make" for the classic Make-like
+        syntax (default), or "jx" for a JX workflow (see `JXWriter`), which is
+        run with ``makeflow --jx``.
+    fuse : bool, optional
+        If True, chains of actions where each action only needs the output of
+        the previous one for the same obsid, and which request the same
+        resources, are run back to back in a single job per obsid. The output
+        and log files of each action are kept. Default is False.
+    order : str, optional
+        The order of the rules in the makeflow file: "obsid" to write all of
+        the tasks of each obsid in turn (default), or "critical_path" to write
+        the tasks with the longest remaining path to the end of the workflow
+        first (see `MakeflowDAG.sorted_by_priority`), so that makeflow starts
+        long chains of tasks early. The paths are weighted by the `runtime`
+        of each action; actions without one get the median runtime of the
+        others, or all tasks count the same if no action has a runtime.
+    transitive_reduction : bool, optional
+        If True, the sources of each rule that are made by a task that another
+        source already depends on are dropped (see
+        `MakeflowDAG.transitive_reduction`). This shrinks the makeflow file of
+        workflows with large chunks a lot, without changing the order in which
+        the tasks can run. Default is False.
+    barriers : bool, optional
+        If True, the tasks that wait for all of the tasks of a prereq on their
+        JD (e.g., with a `prereq_chunk_size` or `chunk_size` of "all"), and the
+        TEARDOWN, instead wait for a single barrier rule per prereq and JD,
+        which makeflow runs locally. This makes the number of dependencies
+        grow linearly with the number of obsids, rather than quadratically.
+        Default is False.
+
+    Returns
+    -------
+    dict or None
+        If `incremental` is True, the targets of the tasks that were "added",
+        "changed" or "removed" since the previous build. Otherwise None.
+
+    Raises
+    ------
+    ValueError
+        This is raised if the SETUP entry in the workflow is specified, but is
+        not the first entry. Similarly, it is raised if the TEARDOWN is in the
+        workflow, but not the last entry. It is also raised if a prereq for a
+        step is specified that is not in the workflow, or if `output_format`
+        or `order` is not supported.
+
+    Notes
+    -----
+    Config file structure:
+
+    [STAGENAME]
+    prereqs = STAGENAME1, STAGENAME2
+    args = arg1, arg2
+    ncpu = 1
+    mem = 5000 (MB)
+
+
+    Mini-language for replacement (example):
+    "{basename}" = "zen.2458000.12345.uv"
+
+    "{prev_basename}" and "{next_basename}" are previous and subsequent files
+    adjacent to "{basename}", useful for specifying prereqs
+
+    "{basename[-2]}" is the file two before "{basename}" on the same JD (any
+    offset may be used), and "{jd}" is the integer JD of "{basename}". More
+    tokens can be added with `register_args_token`.
+
+    """
+    extension = _check_output_format(output_format)
+    _check_order(order)
+
+    # load and compile config file
+    with _phase("config"):
+        compiled = load_config(config_file)
+
+    # open file for writing
+    cf = os.path.basename(config_file)
+    if mf_name is not None:
+        fn = mf_name
+    else:
+        base, ext = os.path.splitext(cf)
+        fn = base + extension
+
+    # get the work directory
+    if work_dir is None:
+        work_dir = os.getcwd()  # pragma: no cover
+    else:
+        work_dir = os.path.abspath(work_dir)
+    makeflowfile = os.path.join(work_dir, fn)
+
+    return _write_analysis_makeflow(
+        obsids,
+        compiled,
+        cf,
+        makeflowfile,
+        work_dir,
+        incremental=incremental,
+        output_format=output_format,
+        fuse=fuse,
+        order=order,
+        transitive_reduction=transitive_reduction,
+        barriers=barriers,
+    )
+
+
+# the orders of the rules in a makeflow file
+_ORDERS = ("obsid", "critical_path")
+
+
+def _check_order(order):
+    """Check that an order of the rules is supported."""
+    if order not in _ORDERS:
+        raise ValueError(
+            "order must be one of {}; got '{}'".format(
+                ", ".join(map(repr, _ORDERS)), order
+            )
+        )
+
+
+def _write_analysis_makeflow(
+    obsids,
+    compiled,
+    config_name,
+    makeflowfile,
+    work_dir,
+    incremental=False,
+    output_format="make",
+    fuse=False,
+    order="obsid",
+    transitive_reduction=False,
+    barriers=False,
+):
+    """Write the makeflow file of an analysis workflow from a compiled config.
+
+    Parameters
+    ----------
+    obsids : list of str
+        A list of paths to obsids/filenames for processing.
+    compiled : CompiledConfig
+        The compiled config of the workflow.
+    config_name : str
+        The name of the config file, recorded in the makeflow file.
+    makeflowfile : str
+        The full path to the makeflow file.
+    work_dir : str
+        The full path to the work directory.
+    incremental, output_format, fuse, order, transitive_reduction, barriers
+        See `build_analysis_makeflow_from_config`.
+
+    Returns
+    -------
+    dict or None
+        If `incremental` is True, the targets of the tasks that were "added",
+        "changed" or "removed" since the previous build. Otherwise None.
+
+    """
+    # Make obsids abs paths
+    obsids = [os.path.abspath(obsid) for obsid in obsids]
+
+    # sort the obsids once, and share the index with all neighbor lookups
+    obsid_index = ObsidIndex(obsids)
+
+    if incremental:
+        # write to a temporary file, which replaces the makeflow if it changed
+        manifest = Manifest(makeflowfile + ".manifest", work_dir)
+        output_file = makeflowfile + ".tmp"
+    else:
+        manifest = None
+        output_file = makeflowfile
+
+    if transitive_reduction or order == "critical_path":
+        # the whole graph is needed to reduce or reorder it
+        dag = _analysis_dag(
+            compiled, obsids, obsid_index, work_dir, manifest, fuse, barriers
+        )
+        if transitive_reduction:
+            dag = dag.transitive_reduction()
+        if order == "critical_path":
+            # weight the paths by the runtimes of the actions, if there are any
+            runtimes = _compiled_runtimes(compiled)
+            default = statistics.median(runtimes.values()) if runtimes else 1.0
+            dag = dag.sorted_by_priority(dag.task_durations(runtimes, default))
+        rules = dag.rules
+    else:
+        # otherwise, the rules are written as they are generated
+        rules = _analysis_rules(
+            compiled,
+            obsids,
+            obsid_index,
+            work_dir,
+            manifest,
+            fuse=fuse,
+            barriers=barriers,
+        )
+
+    # write makeflow file
+    with _phase("makeflow"), open(output_file, "w") as f:
+        define = {"WORK_DIR": work_dir, "SCRIPTS": compiled.path_to_do_scripts}
+        resources = _category_resources(compiled)
+        writer = _makeflow_writer(f, output_format, define, resources)
+        writer.write_header(config_name)
+        if manifest is not None:
+            rules = manifest.track_rules(rules)
+        writer.write_rules(rules)
+        writer.write_footer()
+
+    if manifest is None:
+        return
+
+    if manifest.makeflow_changed or not os.path.exists(makeflowfile):
+        os.replace(output_file, makeflowfile)
+    else:
+        os.remove(output_file)
+    manifest.save()
+
+    return manifest.report()
+
+
+# the compiled config shared by the worker processes of a season build
+_season_compiled = None
+
+
+def _init_season_worker(compiled):
+    """Store the compiled config of a season build in a worker process.
+
+    Parameters
+    ----------
+    compiled : CompiledConfig
+        The compiled config of the workflow.
+
+    Returns
+    -------
+    None
+
+    """
+    global _season_compiled
+    _season_compiled = compiled
 
 
-def _get_timeout(config):
-    timeout = get_config_entry(config, "Options", "timeout", required=False)
-    if timeout is not None:
-        # check that the `timeout' command exists on the system
-        try:
-            subprocess.check_output(["timeout", "--help"])
-        except OSError:  # pragma: no cover
-            warnings.warn(
-                'A value for the "timeout" option was specified,'
-                " but the `timeout' command does not appear to be"
-                " installed. Please install or remove the option"
-                " from the config file"
-            )
-    return timeout
+def _build_night(obsids, config_name, makeflowfile, work_dir, kwargs):
+    """Write the makeflow file of a single night of a season build.
 
+    Parameters
+    ----------
+    obsids : list of str
+        The obsids of the night.
+    config_name : str
+        The name of the config file, recorded in the makeflow file.
+    makeflowfile : str
+        The full path to the makeflow file.
+    work_dir : str
+        The full path to the work directory of the night.
+    kwargs : dict
+        Passed to `_write_analysis_makeflow`.
 
-def build_analysis_makeflow_from_config(
-    obsids, config_file, mf_name=None, work_dir=None
+    Returns
+    -------
+    str
+        The full path to the makeflow file.
+
+    """
+    _write_analysis_makeflow(
+        obsids, _season_compiled, config_name, makeflowfile, work_dir, **kwargs
+    )
+    return makeflowfile
+
+
+def build_season_makeflows(
+    season_dir,
+    config_file,
+    suffix=".uvh5",
+    work_dir=None,
+    max_workers=None,
+    **kwargs,
 ):
-    """Construct a makeflow file from a config file.
+    """Construct the makeflow files of every night of a season in parallel.
+
+    The nights of the season are the folders of `season_dir` named by JD
+    (e.g., 2458098), which contain the data files of each night. The config
+    file is read and compiled once, and shared by a pool of worker processes,
+    which each write the makeflow of a night to its own folder in `work_dir`.
 
     Parameters
     ----------
-    obsids : list of str
-        A list of paths to obsids/filenames for processing.
+    season_dir : str
+        The full path to the folder containing the folders of each night.
     config_file : str
-        The full path to configuration file.
-    mf_name : str
-        The name of makeflow file. Defaults to "<config_file_basename>.mf" if not
-        specified.
-    work_dir : str
-        The full path to the "work directory" where all of the wrapper scripts and log
-        files will be made. Defaults to the current directory.
+        The full path to the configuration file of an analysis workflow.
+    suffix : str, optional
+        The ending of the data files of each night. Default is ".uvh5".
+    work_dir : str, optional
+        The folder in which a folder is made for each night, holding its
+        makeflow file, wrapper scripts and log files. Defaults to the current
+        directory.
+    max_workers : int, optional
+        The number of worker processes. Defaults to the number of processors.
+    **kwargs
+        Passed to `build_analysis_makeflow_from_config` for each night, e.g.,
+        `output_format`.
 
     Returns
     -------
-    None
+    dict
+        Mapping of the JD of each night with data files to the full path to
+        its makeflow file.
 
     Raises
     ------
     ValueError
-        This is raised if the SETUP entry in the workflow is specified, but is
-        not the first entry. Similarly, it is raised if the TEARDOWN is in the
-        workflow, but not the last entry. It is also raised if a prereq for a
-        step is specified that is not in the workflow.
+        This is raised if the config file is not for an analysis workflow.
 
-    Notes
-    -----
-    Config file structure:
+    """
+    extension = _check_output_format(kwargs.get("output_format", "make"))
+    _check_order(kwargs.get("order", "obsid"))
 
-    [STAGENAME]
-    prereqs = STAGENAME1, STAGENAME2
-    args = arg1, arg2
-    ncpu = 1
-    mem = 5000 (MB)
+    # load and compile config file, once for all nights
+    config = _read_config(config_file)
+    makeflow_type = get_config_entry(config, "Options", "makeflow_type", required=True)
+    if makeflow_type != "analysis":
+        raise ValueError(
+            "only analysis makeflows can be built for a season, not "
+            f"'{makeflow_type}'"
+        )
+    compiled = load_config(config_file)
+    cf = os.path.basename(config_file)
+    fn = os.path.splitext(cf)[0] + extension
 
+    # get the work directory
+    if work_dir is None:
+        work_dir = os.getcwd()  # pragma: no cover
+    else:
+        work_dir = os.path.abspath(work_dir)
 
-    Mini-language for replacement (example):
-    "{basename}" = "zen.2458000.12345.uv"
+    # find the data files of each night
+    nights = []
+    for jd in sorted(os.listdir(season_dir)):
+        if not re.fullmatch(r"\d{7}", jd):
+            continue
+        obsids = sorted(glob.glob(os.path.join(season_dir, jd, "*" + suffix)))
+        if obsids:
+            nights.append((jd, obsids))
+
+    with ProcessPoolExecutor(
+        max_workers=max_workers,
+        initializer=_init_season_worker,
+        initargs=(compiled,),
+    ) as executor:
+        futures = {}
+        for jd, obsids in nights:
+            night_dir = os.path.join(work_dir, jd)
+            os.makedirs(night_dir, exist_ok=True)
+            futures[jd] = executor.submit(
+                _build_night,
+                obsids,
+                cf,
+                os.path.join(night_dir, fn),
+                night_dir,
+                kwargs,
+            )
+        makeflows = {jd: future.result() for jd, future in futures.items()}
+
+    return makeflows
 
-    "{prev_basename}" and "{next_basename}" are previous and subsequent files
-    adjacent to "{basename}", useful for specifying prereqs
+
+class _ReachContext(ArgsContext):
+    """An ArgsContext recording the furthest obsid an args template refers to.
+
+    Attributes
+    ----------
+    reach : int
+        One past the largest position of an obsid accessed while rendering.
 
     """
-    # Make obsids abs paths
-    obsids = [os.path.abspath(obsid) for obsid in obsids]
 
-    # make a cache dictionary
-    _cache_dict = {}
+    __slots__ = ("reach",)
 
-    # load config file
-    config = toml.load(config_file)
-    workflow = get_config_entry(config, "WorkFlow", "actions")
-    # make workflow options uppercase
-    workflow = [w.upper() for w in workflow]
+    def __init__(self, basename, index=None, position=None, partition=None):
+        super().__init__(basename, index, position, partition)
+        self.reach = position + 1
 
-    # get general options
-    mandc_report = get_config_entry(config, "Options", "mandc_report", required=False)
+    def neighbor(self, offset):
+        """Get the filename of a neighbor, recording its position.
 
-    # make sure that SETUP and TEARDOWN are in the right spots, if they are in the workflow
-    try:
-        idx = workflow.index("SETUP")
-    except ValueError:
-        pass
-    else:
-        if idx != 0:
-            raise ValueError("SETUP must be first entry of workflow")
+        Parameters
+        ----------
+        offset : int
+            The offset from the obsid in the sorted list of obsids.
+
+        Returns
+        -------
+        str
+            See `ArgsContext.neighbor`.
+
+        """
+        self.reach = max(self.reach, self.position + offset + 1)
+        return super().neighbor(offset)
+
+
+def _task_ready(compiled, obsid_index, action, obsind, ready):
+    """Check whether the rule of a task is final for the obsids seen so far.
+
+    When obsids are appended to a workflow, the rule of a task can still change
+    if it depends on obsids that have not arrived yet: its chunk may be
+    incomplete or collect more stragglers, the neighbors whose prereqs it waits
+    for may be missing, or its args may refer to a later obsid. Such a task is
+    not ready, and neither is a task whose prereqs are not ready.
+
+    Parameters
+    ----------
+    compiled : CompiledConfig
+        The compiled config of the workflow.
+    obsid_index : ObsidIndex
+        The index of the obsids seen so far. Obsids can only be appended to
+        the last JD.
+    action : str
+        The action of the task.
+    obsind : int
+        The position of the primary obsid of the task in `obsid_index`.
+    ready : dict
+        The tasks checked so far, as a mapping of (action, obsind) to bool.
+        Updated in place.
+
+    Returns
+    -------
+    bool
+        Whether the rule of the task is final.
+
+    """
+    key = (action, obsind)
     try:
-        idx = workflow.index("TEARDOWN")
-    except ValueError:
+        return ready[key]
+    except KeyError:
         pass
+    # a cycle of prereqs is never ready
+    ready[key] = False
+
+    nobsids = len(obsid_index)
+    spec = compiled.actions[action]
+    if "all" in (spec.chunk_size, spec.stride_length):
+        # the chunks depend on the total number of obsids
+        return False
+    basename = obsid_index.basenames[obsind]
+    day_start, day_stop = obsid_index.day_range(basename)
+    day_open = day_stop == nobsids
+    if day_open:
+        day_stop = math.inf
+
+    # the chunk of the task, and the next stride if it collects stragglers
+    if spec.time_centered:
+        horizon = obsind + (spec.chunk_size + 1) // 2
     else:
-        if idx != len(workflow) - 1:
-            raise ValueError("TEARDOWN must be last entry of workflow")
+        horizon = obsind + spec.chunk_size
+    if spec.collect_stragglers:
+        horizon += spec.stride_length
+
+    # the neighbors whose prereqs must finish, and the prereq chunks covering them
+    if spec.prereqs:
+        i0, i1 = obsind, obsind + 1
+        for size in (spec.prereq_chunk_size, spec.chunk_size):
+            j0, j1 = _chunk_bounds(
+                obsind,
+                day_start,
+                day_stop,
+                size,
+                spec.time_centered,
+                spec.stride_length,
+                spec.collect_stragglers,
+            )
+            i0 = min(i0, j0)
+            i1 = max(i1, j1)
+        if spec.collect_stragglers:
+            horizon = max(horizon, i1 + spec.stride_length)
+        else:
+            horizon = max(horizon, i1)
+        for prereq in spec.prereqs:
+            pr_spec = compiled.actions[prereq]
+            if "all" in (pr_spec.chunk_size, pr_spec.stride_length):
+                return False
+            pr_horizon = i1 - 1 + pr_spec.chunk_size
+            if pr_spec.collect_stragglers:
+                pr_horizon += pr_spec.stride_length
+            horizon = max(horizon, pr_horizon)
+
+    # the neighbors in the args
+    if day_open:
+        partition = _action_partition(spec, obsid_index)
+        context = _ReachContext(basename, obsid_index, obsind, partition)
+        spec.template.render(context)
+        horizon = max(horizon, context.reach)
+
+    if horizon > nobsids:
+        return False
+
+    # the tasks of the prereqs must be ready too
+    for prereq in spec.prereqs:
+        pr_partition = _action_partition(compiled.actions[prereq], obsid_index)
+        k0, k1 = pr_partition.covering(i0, i1)
+        for k in range(k0, k1):
+            if not _task_ready(
+                compiled, obsid_index, prereq, pr_partition.primary[k], ready
+            ):
+                return False
+
+    ready[key] = True
+    return True
+
+
+def _late_obsid_fits(compiled, obsids, obsid, targets, work_dir):
+    """Check whether an obsid that arrived late can still be added to a makeflow.
+
+    An obsid that sorts before the last obsid of a makeflow shifts the chunks
+    and neighbors of the tasks after it on its JD, and can be in the args of
+    the tasks before it. It can only be added if the rules of the tasks of its
+    JD that are already in the makeflow stay the same. Only the rules of that
+    JD are generated, without writing their wrapper scripts.
 
-    # Check for actions that use chunk_size, make sure obsid_list is last arg
-    for action in workflow:
-        chunk_size = get_config_entry(config, action, "chunk_size", required=False)
-        if chunk_size is not None:
-            this_args = get_config_entry(config, action, "args", required=True)
-            if "{obsid_list}" in this_args:
-                bn_idx = this_args.index("{obsid_list}")
-                if bn_idx != len(this_args) - 1:
-                    raise ValueError(
-                        "{obsid_list} must be the last argument for action"
-                        f" {action} because chunk_size is specified."
-                    )
+    Parameters
+    ----------
+    compiled : CompiledConfig
+        The compiled config of the workflow.
+    obsids : list of str
+        The full paths to the obsids of the makeflow.
+    obsid : str
+        The full path to the obsid that arrived late.
+    targets : set of str
+        The targets of the rules already in the makeflow.
+    work_dir : str
+        The full path to the work directory.
 
-    path_to_do_scripts = get_config_entry(config, "Options", "path_to_do_scripts")
-    conda_env = get_config_entry(config, "Options", "conda_env", required=False)
-    source_script = get_config_entry(config, "Options", "source_script", required=False)
-    mail_user = get_config_entry(config, "Options", "mail_user", required=False)
-    batch_system = get_config_entry(config, "Options", "batch_system", required=False)
-    timeout = _get_timeout(config)
+    Returns
+    -------
+    bool
+        Whether the obsid can be added.
 
-    # open file for writing
-    cf = os.path.basename(config_file)
-    if mf_name is not None:
-        fn = mf_name
-    else:
-        base, ext = os.path.splitext(cf)
-        fn = "{0}.mf".format(base)
+    """
+    basename = os.path.basename(obsid)
 
-    # get the work directory
-    if work_dir is None:
-        work_dir = os.getcwd()  # pragma: no cover
-    else:
-        work_dir = os.path.abspath(work_dir)
-    makeflowfile = os.path.join(work_dir, fn)
+    def written_rules(obsids):
+        obsid_index = ObsidIndex(obsids)
+        start, stop = obsid_index.day_range(basename)
 
-    # write makeflow file
-    with open(makeflowfile, "w") as f:
-        # add comment at top of file listing date of creation and config file name
-        dt = time.strftime("%H:%M:%S on %d %B %Y")
-        print("# makeflow file generated from config file {}".format(cf), file=f)
-        print("# created at {}".format(dt), file=f)
-
-        # add resource information
-        base_mem = get_config_entry(config, "Options", "base_mem", required=True)
-        base_cpu = get_config_entry(config, "Options", "base_cpu", required=False)
-        default_queue = get_config_entry(
-            config, "Options", "default_queue", required=False
+        def select(action, obsind):
+            if obsind is None or not start <= obsind < stop:
+                return False
+            target = make_outfile_name(obsid_index.basenames[obsind], action)[0]
+            return target in targets
+
+        rules = _analysis_rules(
+            compiled, obsids, obsid_index, work_dir, _DryRun(), select=select
         )
-        if default_queue is None:
-            default_queue = "hera"
-
-        # if we have a setup step, add it here
-        if "SETUP" in workflow:
-            # set parent_dir to correspond to the directory of the first obsid
-            abspath = os.path.abspath(obsids[0])
-            parent_dir = os.path.dirname(abspath)
-            filename = os.path.basename(abspath)
-
-            infiles = []
-            command = "do_SETUP.sh"
-            command = os.path.join(path_to_do_scripts, command)
-            infiles.append(command)
-            args = get_config_entry(config, "SETUP", "args", required=False)
-            if args is not None:
-                if not isinstance(args, list):
-                    args = [args]
-                args = " ".join(list(map(str, args)))
-            else:
-                args = ""
-            outfile = "setup.out"
-            mem = get_config_entry(config, "SETUP", "mem", required=False)
-            ncpu = get_config_entry(config, "SETUP", "ncpu", required=False)
-            queue = get_config_entry(config, "SETUP", "queue", required=False)
-            extra_options = get_config_entry(
-                config, "SETUP", "extra_batch_options", required=False
-            )
-            if queue is None:
-                queue = default_queue
-            if mem is None:
-                mem = base_mem
-            if ncpu is None:
-                if base_cpu is not None:
-                    ncpu = base_cpu
-            batch_options = process_batch_options(
-                mem, ncpu, mail_user, queue, batch_system, extra_options
-            )
-            print("export BATCH_OPTIONS = {}".format(batch_options), file=f)
+        return {tuple(rule.targets): (rule.sources, rule.command) for rule in rules}
 
-            # define the logfile
-            logfile = re.sub(r"\.out", ".log", outfile)
-            logfile = os.path.join(work_dir, logfile)
+    return written_rules(obsids) == written_rules(obsids + [obsid])
 
-            # make a small wrapper script that will run the actual command
-            # can't embed if; then statements in makeflow script
-            wrapper_script = re.sub(r"\.out", ".sh", outfile)
-            wrapper_script = "wrapper_{}".format(wrapper_script)
-            wrapper_script = os.path.join(work_dir, wrapper_script)
-            with open(wrapper_script, "w") as f2:
-                print("#!/bin/bash", file=f2)
-                if source_script is not None:
-                    print("source {}".format(source_script), file=f2)
-                if conda_env is not None:
-                    print("conda activate {}".format(conda_env), file=f2)
-                print("date", file=f2)
-                print("cd {}".format(parent_dir), file=f2)
-                if timeout is not None:
-                    print("timeout {0} {1} {2}".format(timeout, command, args), file=f2)
-                else:
-                    print("{0} {1}".format(command, args), file=f2)
-                print("if [ $? -eq 0 ]; then", file=f2)
-                print("  cd {}".format(work_dir), file=f2)
-                print("  touch {}".format(outfile), file=f2)
-                print("else", file=f2)
-                print("  mv {0} {1}".format(logfile, logfile + ".error"), file=f2)
-                print("fi", file=f2)
-                print("date", file=f2)
-            # make file executable
-            os.chmod(wrapper_script, 0o755)
-
-            # first line lists target file to make (dummy output file), and requirements
-            # second line is "build rule", which runs the shell script and makes the output file
-            infiles = " ".join(infiles)
-            line1 = "{0}: {1}".format(outfile, infiles)
-            line2 = "\t{0} > {1} 2>&1\n".format(wrapper_script, logfile)
-            print(line1, file=f)
-            print(line2, file=f)
-
-            # save outfile as prereq for first step
-            setup_outfiles = [outfile]
-
-        # main loop over actual data files
-        sorted_obsids = sort_obsids(obsids, return_basenames=False)
-        for obsind, obsid in enumerate(sorted_obsids):
-            # get parent directory
-            abspath = os.path.abspath(obsid)
-            parent_dir = os.path.dirname(abspath)
-            filename = os.path.basename(abspath)
-
-            # loop over actions for this obsid
-            for ia, action in enumerate(workflow):
-                if action == "SETUP" or action == "TEARDOWN":
-                    continue
-                prereqs = get_config_entry(config, action, "prereqs", required=False)
-                stride_length = get_config_entry(
-                    config,
-                    action,
-                    "stride_length",
-                    required=False,
-                    total_length=len(obsids),
-                )
-                prereq_chunk_size = get_config_entry(
-                    config,
-                    action,
-                    "prereq_chunk_size",
-                    required=False,
-                )
-                chunk_size = get_config_entry(
-                    config,
-                    action,
-                    "chunk_size",
-                    required=False,
-                    total_length=len(obsids),
-                )
-                time_centered = get_config_entry(
-                    config, action, "time_centered", required=False
-                )
-                collect_stragglers = get_config_entry(
-                    config, action, "collect_stragglers", required=False
-                )
 
-                key1 = action + "_primary_obsids"
-                key2 = action + "_per_obsid_primary_obsids"
-                if key1 not in _cache_dict.keys():
-                    (
-                        primary_obsids,
-                        per_obsid_primary_obsids,
-                    ) = _determine_stride_partitioning(
-                        sorted_obsids,
-                        stride_length=stride_length,
-                        chunk_size=chunk_size,
-                        time_centered=time_centered,
-                        collect_stragglers=collect_stragglers,
-                    )
-                    _cache_dict[key1] = primary_obsids
-                    _cache_dict[key2] = per_obsid_primary_obsids
-                else:
-                    # fetch items from cache dict
-                    primary_obsids = _cache_dict[key1]
-                    per_obsid_primary_obsids = _cache_dict[key2]
+def extend_makeflow(work_dir, new_obsids, config_file=None, mf_name=None, final=False):
+    """Add newly arrived obsids to an analysis makeflow.
 
-                if obsid not in primary_obsids:
-                    continue
+    In real-time processing, the obsids of a night arrive in batches. Rather
+    than building a new makeflow for each batch, this appends the rules of the
+    new tasks to the makeflow of the night, with prereqs on the rules already
+    in it. The state of the makeflow (its config file, its obsids, and the
+    targets of its rules) is kept next to it in the work directory, in
+    "<mf_name>.state".
 
-                # start list of input files
-                infiles = []
-
-                # add command to infile list
-                # this implicitly checks that do_{STAGENAME}.sh script exists
-                command = "do_{}.sh".format(action)
-                command = os.path.join(path_to_do_scripts, command)
-                infiles.append(command)
-
-                # add setup outfile to input requirements
-                if "SETUP" in workflow and ia > 0:
-                    # add setup to list of prereqs
-                    for of in setup_outfiles:
-                        infiles.append(of)
-
-                # make argument list
-                args = get_config_entry(config, action, "args", required=False)
-                if not isinstance(args, list):
-                    args = [args]
-                args = " ".join(list(map(str, args)))
-
-                # make outfile name
-                outfiles = make_outfile_name(filename, action)
-
-                # get processing options
-                mem = get_config_entry(config, action, "mem", required=False)
-                ncpu = get_config_entry(config, action, "ncpu", required=False)
-                queue = get_config_entry(config, action, "queue", required=False)
-                extra_options = get_config_entry(
-                    config, action, "extra_batch_options", required=False
-                )
-                if mem is None:
-                    mem = base_mem
-                if ncpu is None:
-                    if base_cpu is not None:
-                        ncpu = base_cpu
-                if queue is None:
-                    queue = default_queue
-                batch_options = process_batch_options(
-                    mem, ncpu, mail_user, queue, batch_system, extra_options
-                )
-                print("export BATCH_OPTIONS = {}".format(batch_options), file=f)
-
-                # make rules
-                if prereqs is not None:
-                    if not isinstance(prereqs, list):
-                        prereqs = [prereqs]
-
-                    for prereq in prereqs:
-                        try:
-                            workflow.index(prereq)
-                        except ValueError:
-                            raise ValueError(
-                                "Prereq {0} for action {1} not found in main "
-                                "workflow".format(prereq, action)
-                            )
-                        # add neighbors
-                        prev_neighbors = make_chunk_list(
-                            filename,
-                            prereq,
-                            obsids,
-                            chunk_size=prereq_chunk_size,
-                            time_centered=time_centered,
-                            stride_length=stride_length,
-                            collect_stragglers=collect_stragglers,
-                        )
-                        curr_neighbors = make_chunk_list(
-                            filename,
-                            prereq,
-                            obsids,
-                            chunk_size=chunk_size,
-                            time_centered=time_centered,
-                            stride_length=stride_length,
-                            collect_stragglers=collect_stragglers,
-                        )
-                        all_neighbors = prev_neighbors + curr_neighbors
-                        pr_outfiles = []
-                        key = prereq + "_per_obsid_primary_obsids"
-                        per_obsid_primary_obsids = _cache_dict[key]
-                        for oi, obs in enumerate(obsids):
-                            if os.path.basename(obs) in all_neighbors:
-                                for primary_obsid in per_obsid_primary_obsids[oi]:
-                                    if primary_obsid not in pr_outfiles:
-                                        pr_outfiles.append(primary_obsid)
-                        pr_outfiles = [
-                            make_outfile_name(pr_o, prereq)[0] for pr_o in pr_outfiles
-                        ]
-
-                        for of in pr_outfiles:
-                            infiles.append(os.path.basename(of))
-
-                # replace '{basename}' with actual filename
-                prepped_args, obsid_list = prep_args(
-                    args,
-                    filename,
-                    obsids=obsids,
-                    chunk_size=chunk_size,
-                    stride_length=stride_length,
-                    time_centered=time_centered,
-                    collect_stragglers=collect_stragglers,
-                    return_obsid_list=True,
-                )
-                # cast obsid list to string for later
-                if len(obsid_list) > 1:
-                    obsid_list_str = " ".join(obsid_list)
+    The rule of a task is only added once it can no longer change, i.e., once
+    all of the obsids in its chunk, the neighbors whose prereqs it waits for,
+    and the neighbors in its args have arrived. A task near the end of a batch
+    is therefore added with the next batch, and chunks of "all" obsids and the
+    TEARDOWN step are only added when `final` is True.
 
-                for outfile in outfiles:
-                    # make logfile name
-                    # logfile will capture stdout and stderr
-                    logfile = re.sub(r"\.out", ".log", outfile)
-                    logfile = os.path.join(work_dir, logfile)
+    Parameters
+    ----------
+    work_dir : str
+        The full path to the "work directory" where the makeflow file, its
+        state, and the wrapper scripts are kept.
+    new_obsids : list of str
+        The paths to the newly arrived obsids. Obsids already in the makeflow
+        are ignored. An obsid that sorts before the last obsid of the makeflow
+        is only added if the rules already written for its JD do not change
+        (see `_late_obsid_fits`); otherwise it is skipped with a warning.
+    config_file : str, optional
+        The full path to the config file. It is required to start a new
+        makeflow; an existing makeflow keeps the config file it was started
+        with.
+    mf_name : str, optional
+        The name of the makeflow file. Defaults to "<config_file_basename>.mf".
+        If neither `config_file` nor `mf_name` is given, the work directory
+        must contain the state of exactly one makeflow.
+    final : bool, optional
+        Whether these are the last obsids. If True, all remaining tasks and
+        the TEARDOWN step are added, and the makeflow can no longer be
+        extended. Default is False.
 
-                    # make a small wrapper script that will run the actual command
-                    # can't embed if; then statements in makeflow script
-                    wrapper_script = re.sub(r"\.out", ".sh", outfile)
-                    wrapper_script = "wrapper_{}".format(wrapper_script)
-                    wrapper_script = os.path.join(work_dir, wrapper_script)
-                    with open(wrapper_script, "w") as f2:
-                        print("#!/bin/bash", file=f2)
-                        if source_script is not None:
-                            print("source {}".format(source_script), file=f2)
-                        if conda_env is not None:
-                            print("conda activate {}".format(conda_env), file=f2)
-                        print("date", file=f2)
-                        print("cd {}".format(parent_dir), file=f2)
-                        if mandc_report:
-                            if len(obsid_list) > 1:
-                                print(
-                                    f"add_rtp_process_event.py {filename} {action} "
-                                    f"started --file_list {obsid_list_str}",
-                                    file=f2,
-                                )
-                                print(
-                                    f"add_rtp_task_jobid.py {filename} {action} "
-                                    f"$SLURM_JOB_ID --file_list {obsid_list_str}",
-                                    file=f2,
-                                )
-                            else:
-                                print(
-                                    f"add_rtp_process_event.py {filename} {action} "
-                                    "started",
-                                    file=f2,
-                                )
-                                print(
-                                    f"add_rtp_task_jobid.py {filename} {action} "
-                                    "$SLURM_JOB_ID",
-                                    file=f2,
-                                )
-                        if timeout is not None:
-                            print(
-                                "timeout {0} {1} {2}".format(
-                                    timeout, command, prepped_args
-                                ),
-                                file=f2,
-                            )
-                        else:
-                            print("{0} {1}".format(command, prepped_args), file=f2)
-                        print("if [ $? -eq 0 ]; then", file=f2)
-                        if mandc_report:
-                            if len(obsid_list) > 1:
-                                print(
-                                    f"  add_rtp_process_event.py {filename} {action} "
-                                    f"finished --file_list {obsid_list_str}",
-                                    file=f2,
-                                )
-                            else:
-                                print(
-                                    f"  add_rtp_process_event.py {filename} {action} "
-                                    "finished",
-                                    file=f2,
-                                )
-                        print("  cd {}".format(work_dir), file=f2)
-                        print("  touch {}".format(outfile), file=f2)
-                        print("else", file=f2)
-                        if mandc_report:
-                            if len(obsid_list) > 1:
-                                print(
-                                    f"  add_rtp_process_event.py {filename} {action} "
-                                    f"error --file_list {obsid_list_str}",
-                                    file=f2,
-                                )
-                            else:
-                                print(
-                                    f"  add_rtp_process_event.py {filename} {action} "
-                                    "error",
-                                    file=f2,
-                                )
-                        print(
-                            "  mv {0} {1}".format(logfile, logfile + ".error"), file=f2
-                        )
-                        print("fi", file=f2)
-                        print("date", file=f2)
-                    # make file executable
-                    os.chmod(wrapper_script, 0o755)
-
-                    # first line lists target file to make (dummy output file), and requirements
-                    # second line is "build rule", which runs the shell script and makes the output file
-                    infiles = " ".join(infiles)
-                    line1 = "{0}: {1}".format(outfile, infiles)
-                    line2 = "\t{0} > {1} 2>&1\n".format(wrapper_script, logfile)
-                    print(line1, file=f)
-                    print(line2, file=f)
-
-        # if we have a teardown step, add it here
-        if "TEARDOWN" in workflow:
-            # set parent_dir to correspond to the directory of the last obsid
-            abspath = os.path.abspath(obsids[-1])
-            parent_dir = os.path.dirname(abspath)
-            filename = os.path.basename(abspath)
-
-            # assume that we wait for all other steps of the pipeline to finish
-            infiles = []
-            command = "do_TEARDOWN.sh"
-            command = os.path.join(path_to_do_scripts, command)
-            infiles.append(command)
-
-            # add the final outfiles for the last per-file step for all obsids
-            action = workflow[-2]
-            for obsid in obsids:
-                abspath = os.path.abspath(obsid)
-                parent_dir = os.path.dirname(abspath)
-                filename = os.path.basename(abspath)
-
-                # get primary obsids for 2nd-to-last step
-                stride_length = get_config_entry(
-                    config,
-                    action,
-                    "stride_length",
-                    required=False,
-                    total_length=len(obsids),
-                )
-                prereq_chunk_size = get_config_entry(
-                    config,
-                    action,
-                    "prereq_chunk_size",
-                    required=False,
-                )
-                chunk_size = get_config_entry(
-                    config,
-                    action,
-                    "chunk_size",
-                    required=False,
-                    total_length=len(obsids),
-                )
-                time_centered = get_config_entry(
-                    config, action, "time_centered", required=False
-                )
-                collect_stragglers = get_config_entry(
-                    config, action, "collect_stragglers", required=False
-                )
+    Returns
+    -------
+    list of str
+        The targets of the rules added to the makeflow.
 
-                key1 = action + "_primary_obsids"
-                key2 = action + "_per_obsid_primary_obsids"
-                if key1 not in _cache_dict.keys():
-                    (
-                        primary_obsids,
-                        per_obsid_primary_obsids,
-                    ) = _determine_stride_partitioning(
-                        sorted_obsids,
-                        stride_length=stride_length,
-                        chunk_size=chunk_size,
-                        time_centered=time_centered,
-                        collect_stragglers=collect_stragglers,
-                    )
-                else:
-                    # fetch items from cache dict
-                    primary_obsids = _cache_dict[key1]
-                    per_obsid_primary_obsids = _cache_dict[key2]
-
-                for oi_list in per_obsid_primary_obsids:
-                    for oi in oi_list:
-                        oi = os.path.basename(oi)
-                        infiles.extend(make_outfile_name(oi, action))
-                infiles = list(set(infiles))
-
-            args = get_config_entry(config, "TEARDOWN", "args", required=False)
-            if args is not None:
-                if not isinstance(args, list):
-                    args = [args]
-                args = " ".join(list(map(str, args)))
-            else:
-                args = ""
-            outfile = "teardown.out"
-            mem = get_config_entry(config, "TEARDOWN", "mem", required=False)
-            ncpu = get_config_entry(config, "TEARDOWN", "ncpu", required=False)
-            queue = get_config_entry(config, "TEARDOWN", "queue", required=False)
-            extra_options = get_config_entry(
-                config, "TEARDOWN", "extra_batch_options", required=False
+    Raises
+    ------
+    ValueError
+        This is raised if the state of the makeflow cannot be found, if a new
+        makeflow is started without a config file or obsids, or if the
+        makeflow was finalized.
+
+    Notes
+    -----
+    Rules are only ever appended, so the rules already in the makeflow keep
+    their place in it. The resources of each category are only declared the
+    first time it is used in the makeflow file.
+
+    """
+    work_dir = os.path.abspath(work_dir)
+    if mf_name is None and config_file is not None:
+        base, ext = os.path.splitext(os.path.basename(config_file))
+        mf_name = "{0}.mf".format(base)
+    if mf_name is None:
+        states = [fn for fn in os.listdir(work_dir) if fn.endswith(".state")]
+        if len(states) != 1:
+            raise ValueError(
+                "could not find the state of a single makeflow in {}; mf_name "
+                "must be specified".format(work_dir)
             )
-            if mem is None:
-                mem = base_mem
-            if ncpu is None:
-                if base_cpu is not None:
-                    ncpu = base_cpu
-            if queue is None:
-                queue = default_queue
-            batch_options = process_batch_options(
-                mem, ncpu, mail_user, queue, batch_system, extra_options
+        mf_name = states[0][: -len(".state")]
+    makeflowfile = os.path.join(work_dir, mf_name)
+    state_file = makeflowfile + ".state"
+
+    # read the state of the makeflow, or start a new one
+    new_makeflow = not os.path.exists(state_file)
+    if new_makeflow:
+        if config_file is None:
+            raise ValueError("config_file must be specified to start a new makeflow")
+        state = {
+            "config_file": os.path.abspath(config_file),
+            "obsids": [],
+            "targets": [],
+            "final": False,
+        }
+    else:
+        with open(state_file) as f:
+            state = json.load(f)
+        if state["final"]:
+            raise ValueError("makeflow {} was finalized".format(makeflowfile))
+
+    # append the new obsids, setting aside those that arrived late
+    obsids = state["obsids"]
+    basenames = {os.path.basename(obsid) for obsid in obsids}
+    last = max(basenames, default=None)
+    late = []
+    for obsid in new_obsids:
+        obsid = os.path.abspath(obsid)
+        basename = os.path.basename(obsid)
+        if basename in basenames:
+            continue
+        if last is not None and basename < last:
+            late.append(obsid)
+        else:
+            obsids.append(obsid)
+        basenames.add(basename)
+    if len(obsids) == 0:
+        raise ValueError("no obsids were given for the makeflow")
+
+    with _phase("config"):
+        compiled = load_config(state["config_file"])
+    targets = set(state["targets"])
+    for obsid in late:
+        if _late_obsid_fits(compiled, obsids, obsid, targets, work_dir):
+            obsids.append(obsid)
+        else:
+            warnings.warn(
+                "obsid {} arrived too late for makeflow {}, whose rules would "
+                "change; skipping it".format(os.path.basename(obsid), makeflowfile)
             )
-            print("export BATCH_OPTIONS = {}".format(batch_options), file=f)
 
-            # define the logfile
-            logfile = re.sub(r"\.out", ".log", outfile)
-            logfile = os.path.join(work_dir, logfile)
+    obsid_index = ObsidIndex(obsids)
+    ready = {}
 
-            # make a small wrapper script that will run the actual command
-            # can't embed if; then statements in makeflow script
-            wrapper_script = re.sub(r"\.out", ".sh", outfile)
-            wrapper_script = "wrapper_{}".format(wrapper_script)
-            wrapper_script = os.path.join(work_dir, wrapper_script)
-            with open(wrapper_script, "w") as f2:
-                print("#!/bin/bash", file=f2)
-                if source_script is not None:
-                    print("source {}".format(source_script), file=f2)
-                if conda_env is not None:
-                    print("conda activate {}".format(conda_env), file=f2)
-                print("date", file=f2)
-                print("cd {}".format(parent_dir), file=f2)
-                if timeout is not None:
-                    print(
-                        "timeout {0} {1} {2}".format(timeout, command, prepped_args),
-                        file=f2,
-                    )
-                else:
-                    print("{0} {1}".format(command, prepped_args), file=f2)
-                print("if [ $? -eq 0 ]; then", file=f2)
-                print("  cd {}".format(work_dir), file=f2)
-                print("  touch {}".format(outfile), file=f2)
-                print("else", file=f2)
-                print("  mv {0} {1}".format(logfile, logfile + ".error"), file=f2)
-                print("fi", file=f2)
-                print("date", file=f2)
-            # make file executable
-            os.chmod(wrapper_script, 0o755)
-
-            # first line lists target file to make (dummy output file), and requirements
-            # second line is "build rule", which runs the shell script and makes the output file
-            infiles = " ".join(infiles)
-            line1 = "{0}: {1}".format(outfile, infiles)
-            line2 = "\t{0} > {1} 2>&1\n".format(wrapper_script, logfile)
-            print(line1, file=f)
-            print(line2, file=f)
+    def select(action, obsind):
+        if obsind is None:
+            target = "{}.out".format(action.lower())
+            if action == "TEARDOWN" and not final:
+                return False
+        else:
+            target = make_outfile_name(obsid_index.basenames[obsind], action)[0]
+        if target in targets:
+            return False
+        return (
+            final
+            or obsind is None
+            or _task_ready(compiled, obsid_index, action, obsind, ready)
+        )
 
-    return
+    added = []
+    with open(makeflowfile, "w" if new_makeflow else "a") as f:
+        writer = MakeflowWriter(
+            f, resources=_category_resources(compiled), state=state.get("writer")
+        )
+        if new_makeflow:
+            writer.write_header(os.path.basename(state["config_file"]))
+        for rule in _analysis_rules(
+            compiled, obsids, obsid_index, work_dir, select=select
+        ):
+            writer.write_rule(rule)
+            added.extend(rule.targets)
+        writer.flush()
+
+    state["targets"].extend(added)
+    state["writer"] = writer.state
+    state["final"] = final
+    with open(state_file, "w") as f:
+        json.dump(state, f)
+
+    return added
 
 
 def build_lstbin_single_baseline_makeflow_from_config(
-    config_file, mf_name=None, work_dir=None
+    config_file, mf_name=None, work_dir=None, output_format="make"
 ):
     """Construct a makeflow file for LST-binning single-baseline files from a config file.
     Thin wrapper around build_analysis_makeflow_from_config() that handles getting baseline
@@ -1367,6 +5265,8 @@ def build_lstbin_single_baseline_makeflow_from_config(
     work_dir : str
         The full path to the "work directory" where all of the wrapper scripts and log
         files will be made. Defaults to the current directory.
+    output_format : str, optional
+        The format of the makeflow file, "make" (default) or "jx".
     """
 
     from hera_cal.lst_stack.config import LSTBinConfiguratorSingleBaseline
@@ -1378,7 +5278,11 @@ def build_lstbin_single_baseline_makeflow_from_config(
     with warnings.catch_warnings():
         warnings.filterwarnings("ignore", message=".*Unable to figure out the JD.*")
         build_analysis_makeflow_from_config(
-            baseline_strings, config_file, mf_name=mf_name, work_dir=work_dir
+            baseline_strings,
+            config_file,
+            mf_name=mf_name,
+            work_dir=work_dir,
+            output_format=output_format,
         )
 
 
@@ -1423,6 +5327,7 @@ def build_lstbin_makeflow_from_config(
     mf_name: str | None = None,
     work_dir: str | Path | None = None,
     outdir: str | Path | None = None,
+    output_format: str = "make",
 ) -> None:
     """Construct a notebook-based  LST-binning  makeflow file from input data and a config_file.
 
@@ -1438,13 +5343,16 @@ def build_lstbin_makeflow_from_config(
     work_dir : str or Path, optional
         The directory in which to write the makeflow file and wrapper files.
         If not specified, the parent directory of the config file will be used.
+    output_format : str, optional
+        The format of the makeflow file, "make" (default) or "jx".
     """
+    extension = _check_output_format(output_format)
     config_file = Path(config_file)
     # read in config file
-    config = toml.load(config_file)
+    config = _read_config(config_file)
 
     if mf_name is None:
-        mf_name = config_file.with_suffix(".mf").name
+        mf_name = config_file.with_suffix(extension).name
 
     work_dir = Path(work_dir or config_file.parent).absolute()
 
@@ -1452,6 +5360,56 @@ def build_lstbin_makeflow_from_config(
 
     outdir = Path(outdir or get_config_entry(config, "LSTBIN_OPTS", "outdir"))
 
+    rules, resources, _ = _lstbin_rules(config, config_file, work_dir, outdir)
+    path_to_do_scripts = get_config_entry(config, "Options", "path_to_do_scripts")
+    conda_env = get_config_entry(config, "Options", "conda_env", required=False)
+
+    # write makeflow file
+    with open(makeflowfile, "w") as fl:
+        define = {"WORK_DIR": str(work_dir), "SCRIPTS": str(path_to_do_scripts)}
+        writer = _makeflow_writer(fl, output_format, define, resources)
+        writer.write_header(config_file.name)
+        writer.write_rules(rules)
+        writer.write_footer()
+
+        # Also write the conda_env export to the LSTbin dir
+        if conda_env is not None:
+            os.system(
+                f"conda env export -n {conda_env} --file {outdir}/environment.yaml"
+            )
+
+
+def _lstbin_rules(config, config_file, work_dir, outdir, manifest=None):
+    """Set up an LST-binning workflow, and get the rules of its makeflow.
+
+    The config files of the workflow are written to `outdir`, since the number
+    of tasks is worked out from them. The wrapper script of each task is
+    written to `work_dir` as its rule is generated.
+
+    Parameters
+    ----------
+    config : dict
+        The contents of the config file, which are updated with the options
+        passed to the tasks.
+    config_file : Path
+        The full path to the config file.
+    work_dir : Path
+        The full path to the work directory.
+    outdir : Path
+        The output directory of the workflow.
+    manifest : _DryRun, optional
+        If given, the wrapper scripts are not written.
+
+    Returns
+    -------
+    rules : generator of Rule
+        The rules of the tasks.
+    resources : dict
+        The resources of the category of the tasks; see `MakeflowWriter`.
+    timeout : str or None
+        The timeout of each task, if there is one.
+
+    """
     # Write the toml config to the output directory.
     if not outdir.exists():
         outdir.mkdir()
@@ -1538,17 +5496,7 @@ fi
 date
     """
 
-    # write makeflow file
-    with open(makeflowfile, "w") as fl:
-        # add comment at top of file listing date of creation and config file name
-        dt = time.strftime("%H:%M:%S on %d %B %Y")
-        fl.write(
-            f"""# makeflow file generated from config file {config_file.name}
-# created at {dt}
-export BATCH_OPTIONS = {batch_options}
-"""
-        )
-
+    def lstbin_rules():
         # loop over output files
         for output_file_index, bl_chunk in product(range(nfiles), range(nbl_chunks)):
             # if parallize, update output_file_select
@@ -1574,25 +5522,67 @@ export BATCH_OPTIONS = {batch_options}
             # make a small wrapper script that will run the actual command
             # can't embed if; then statements in makeflow script
             wrapper_script = work_dir / f"wrapper_{outfile.with_suffix('.sh').name}"
+            _write_wrapper(
+                wrapper_script,
+                wrapper_template.format(args=args, outfile=outfile, logfile=logfile),
+                manifest=manifest,
+            )
 
-            with open(wrapper_script, "w") as f2:
-                f2.write(
-                    wrapper_template.format(args=args, outfile=outfile, logfile=logfile)
-                )
+            # the writer only exports the batch options once per category
+            yield Rule(
+                str(outfile),
+                [str(command)],
+                f"{wrapper_script} > {logfile} 2>&1",
+                batch_options=batch_options,
+                category=action,
+            )
 
-            # make file executable
-            os.chmod(wrapper_script, 0o755)
+    resources = {action: {"CORES": base_cpu, "MEMORY": base_mem}}
+    if base_cpu is None:
+        del resources[action]["CORES"]
 
-            # first line lists target file to make (dummy output file), and requirements
-            # second line is "build rule", which runs the shell script and makes the output file
-            lines = f"{outfile}: {command}\n\t{wrapper_script} > {logfile} 2>&1\n"
-            fl.write(lines)
+    return lstbin_rules(), resources, timeout
 
-        # Also write the conda_env export to the LSTbin dir
-        if conda_env is not None:
-            os.system(
-                f"conda env export -n {conda_env} --file {outdir}/environment.yaml"
-            )
+
+def build_lstbin_dag(
+    config_file: str | Path,
+    work_dir: str | Path | None = None,
+    outdir: str | Path | None = None,
+    dry_run: bool = False,
+) -> MakeflowDAG:
+    """Build the graph of the tasks of an LST-binning workflow, without a makeflow.
+
+    The config files and wrapper scripts are written as for
+    `build_lstbin_makeflow_from_config`, but the makeflow file is not.
+
+    Parameters
+    ----------
+    config_file : str or Path
+        Full path to config file containing options.
+    work_dir : str or Path, optional
+        The directory in which to write the wrapper files. If not specified,
+        the parent directory of the config file will be used.
+    outdir : str or Path, optional
+        The output directory. Defaults to the "outdir" of the config file.
+    dry_run : bool, optional
+        If True, the wrapper scripts are not written. The config files are
+        still written to the output directory, since the number of tasks is
+        worked out from them.
+
+    Returns
+    -------
+    MakeflowDAG
+        The graph of the tasks. Its walltime is the timeout of the workflow,
+        if there is one.
+    """
+    config_file = Path(config_file)
+    config = _read_config(config_file)
+    work_dir = Path(work_dir or config_file.parent).absolute()
+    outdir = Path(outdir or get_config_entry(config, "LSTBIN_OPTS", "outdir"))
+    rules, resources, timeout = _lstbin_rules(
+        config, config_file, work_dir, outdir, _DryRun() if dry_run else None
+    )
+    return MakeflowDAG(rules, resources, walltime=_duration_hours(timeout))
 
 
 def clean_wrapper_scripts(work_dir):
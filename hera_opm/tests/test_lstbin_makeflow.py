@@ -205,3 +205,18 @@ def test_build_makeflow_from_config_lstbin_options(
 
     # make sure the output files we expected appeared
     assert outfile.exists()
+
+
+def test_build_dag_from_config_lstbin(lsttoml_direct_datafiles, tmp_path):
+    """Test building the graph of a lstbin workflow, without a makeflow."""
+    dag = mt.build_dag_from_config(
+        None, lsttoml_direct_datafiles, work_dir=tmp_path, outdir=tmp_path, dry_run=True
+    )
+    assert len(dag) > 0
+    assert set(dag.task_counts()) == {"LSTBIN"}
+    assert dag.nedges == 0
+
+    # a dry run writes the config files, but no wrapper scripts or makeflow
+    assert (tmp_path / "lstbin-config.toml").exists()
+    assert not list(tmp_path.glob("wrapper_*"))
+    assert not list(tmp_path.glob("*.mf"))
@@ -4,6 +4,10 @@
 """Tests for mf_tools.py."""
 import pytest
 import os
+import copy
+import io
+import json
+import pickle
 import shutil
 import gzip
 import toml
@@ -163,6 +167,76 @@ def test_make_outfile_name(config_options):
     assert set(mt.make_outfile_name(obsid, action)) == outfiles
 
 
+def test_obsid_index(config_options):
+    """Test building an index of obsids."""
+    obsids = config_options["obsids_time_discontinuous"]
+    # scramble the order, and use full paths
+    obsids_swap = [os.path.join("/foo/bar", obsids[i]) for i in [2, 0, 1]]
+    index = mt.ObsidIndex(obsids_swap)
+    assert len(index) == 3
+    assert index.basenames == list(obsids)
+    assert index.obsids == [os.path.join("/foo/bar", obs) for obs in obsids]
+    assert index.positions == {obs: i for i, obs in enumerate(obsids)}
+    assert index.position(obsids[1]) == 1
+    assert index.jd_ranges == {"2458043": (0, 1), "2458044": (1, 2), "2458045": (2, 3)}
+    assert index.jd_range("2458044") == (1, 2)
+    assert index.jd_range("2458046") == (0, 0)
+    assert index.jd_range(None) == (0, 3)
+    assert index.day_range(obsids[2]) == (2, 3)
+
+    with pytest.raises(ValueError, match="obsid foo not found in list of obsids"):
+        index.position("foo")
+
+    return
+
+
+def test_obsid_index_multiple_jds(config_options):
+    """Test using an ObsidIndex with several files on each JD."""
+    obsids = list(config_options["obsids"]) + list(
+        config_options["obsids_time_discontinuous"][1:]
+    )
+    index = mt.ObsidIndex(obsids[::-1])
+    assert index.jd_range("2458043") == (0, 3)
+
+    # sorting on a particular JD
+    assert mt.sort_obsids(index, jd="2458043") == list(config_options["obsids"])
+    assert mt.sort_obsids(obsids[::-1], jd="2458044") == [obsids[3]]
+    assert mt.sort_obsids(index, return_basenames=True) == obsids
+    # the JD must match exactly, rather than be part of the filename
+    assert mt.sort_obsids(index, jd="245804") == []
+
+    # obsids without a JD belong to every day
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        mixed_index = mt.ObsidIndex([obsids[0], "foo.uvh5", obsids[3]])
+        assert mixed_index.jd_ranges == {
+            "2458043": (1, 2),
+            "2458044": (2, 3),
+            None: (0, 3),
+        }
+        # an obsid without a JD among the obsids of a JD is in its range
+        unknown = "zen.2458043.405xx.uvh5"
+        mixed_index = mt.ObsidIndex([obsids[0], unknown, obsids[1], obsids[3]])
+        assert mixed_index.basenames[1] == unknown
+        assert mixed_index.jd_range("2458043") == (0, 3)
+        assert mixed_index.jd_range("2458044") == (3, 4)
+
+    # chunks do not extend across JDs
+    chunk_list = mt.make_chunk_list(obsids[2], "OMNICAL", index, chunk_size=3)
+    assert chunk_list == obsids[1:3]
+    chunk_list = mt.make_chunk_list(obsids[3], "OMNICAL", index, chunk_size="all")
+    assert chunk_list == [obsids[3]]
+
+    # neighbors are only taken from the same JD
+    args = "{prev_basename} {basename} {next_basename}"
+    assert (
+        mt.prep_args(args, obsids[2], obsids=index) == f"{obsids[1]} {obsids[2]} None"
+    )
+    assert mt.prep_args(args, obsids[3], obsids=index) == f"None {obsids[3]} None"
+
+    return
+
+
 def test_make_chunk_list(config_options):
     # define args
     obsid = config_options["obsids"][1]
@@ -254,6 +328,26 @@ def test_make_chunk_list_errors(config_options):
     return
 
 
+def test_prereq_window(config_options):
+    obsids = list(config_options["obsids_long_dummy_list"][:9])
+    index = mt.ObsidIndex(obsids)
+    # by default, only the obsid itself
+    assert mt._prereq_window(index, 4) == (4, 5)
+    # the union of the chunk and the prereq chunk
+    assert mt._prereq_window(index, 4, chunk_size="3", prereq_chunk_size="5") == (
+        2,
+        7,
+    )
+    assert mt._prereq_window(
+        index, 4, chunk_size="3", prereq_chunk_size="1", time_centered=False
+    ) == (4, 7)
+    # windows are truncated at the ends of the list
+    assert mt._prereq_window(index, 1, chunk_size="all") == (0, 9)
+    assert mt._prereq_window(index, 8, prereq_chunk_size="5") == (6, 9)
+
+    return
+
+
 def test_prep_args(config_options):
     # test having time-adjacent keywords
     obsid = config_options["obsids"][1]
@@ -525,6 +619,64 @@ def test_determine_stride_partitioning_noncontiguous_stragglers(config_options):
     return
 
 
+def test_stride_partition(config_options):
+    input_obsids = list(config_options["obsids_long_dummy_list"][:9])
+    partition = mt._stride_partition(
+        input_obsids,
+        stride_length=2,
+        chunk_size=3,
+        time_centered=True,
+        collect_stragglers=False,
+    )
+    assert len(partition) == 4
+    assert list(partition.primary) == [1, 3, 5, 7]
+    assert list(partition.starts) == [0, 2, 4, 6]
+    assert list(partition.stops) == [3, 5, 7, 9]
+    assert partition.primary_obsids == ["aab", "aad", "aaf", "aah"]
+    assert partition.rank(3) == 1
+    assert partition.rank(2) is None
+    assert partition.chunk(1) == (2, 5)
+
+    # obsid 2 is covered by the first two primary obsids
+    assert partition.covering(2) == (0, 2)
+    # a range of obsids
+    assert partition.covering(3, 6) == (1, 3)
+
+    # the covering primary obsids agree with the per-obsid lists
+    per_obsid_primary_obsids = partition.per_obsid_primary_obsids
+    for i in range(len(input_obsids)):
+        k0, k1 = partition.covering(i)
+        assert per_obsid_primary_obsids[i] == [
+            partition.primary_obsids[k] for k in range(k0, k1)
+        ]
+
+    return
+
+
+@pytest.mark.filterwarnings("ignore:Collecting stragglers")
+def test_stride_partition_gaps(config_options):
+    input_obsids = list(config_options["obsids_long_dummy_list"])
+    partition = mt._stride_partition(
+        input_obsids,
+        stride_length=10,
+        chunk_size=2,
+        time_centered=False,
+        collect_stragglers=True,
+    )
+    # obsids that are not in any group are not covered by a primary obsid
+    for i in [2, 9, 12, 25]:
+        k0, k1 = partition.covering(i)
+        assert k0 >= k1
+    assert partition.covering(21) == (2, 3)
+
+    # the partitioning is computed once per index
+    index = mt.ObsidIndex(input_obsids)
+    partition = index.partition(stride_length=10, chunk_size=2)
+    assert index.partition(stride_length=10, chunk_size=2) is partition
+
+    return
+
+
 def test_build_analysis_makeflow_from_config(config_options):
     # define args
     obsids = config_options["obsids"][:1]
@@ -587,6 +739,41 @@ def test_build_analysis_makeflow_from_config(config_options):
     return
 
 
+def test_build_analysis_makeflow_from_config_multiple_jds(config_options):
+    # define args
+    obsids = list(config_options["obsids"]) + list(
+        config_options["obsids_time_discontinuous"][1:]
+    )
+    config_file = config_options["config_file_chunk_size"]
+    work_dir = os.path.join(DATA_PATH, "test_output")
+
+    mf_output = os.path.splitext(os.path.basename(config_file))[0] + ".mf"
+    outfile = os.path.join(work_dir, mf_output)
+    if os.path.exists(outfile):
+        os.remove(outfile)
+    mt.build_analysis_makeflow_from_config(obsids[::-1], config_file, work_dir=work_dir)
+
+    # make sure the output files we expected appeared
+    assert os.path.exists(outfile)
+    for obsid in obsids:
+        wrapper_fn = os.path.join(work_dir, f"wrapper_{obsid}.OMNICAL.sh")
+        assert os.path.exists(wrapper_fn)
+
+    # prereqs should only refer to files on the same JD
+    with open(outfile) as f:
+        lines = f.readlines()
+    target = f"{obsids[3]}.OMNICAL_METRICS.out:"
+    line = [line for line in lines if line.startswith(target)][0]
+    assert f"{obsids[2]}.OMNICAL.out" not in line
+    assert f"{obsids[3]}.OMNICAL.out" in line
+
+    # clean up after ourselves
+    os.remove(outfile)
+    mt.clean_wrapper_scripts(work_dir)
+
+    return
+
+
 def test_build_analysis_makeflow_from_config_missing_prereq(config_options):
     # define args
     obsids = config_options["obsids"][:1]
@@ -600,9 +787,8 @@ def test_build_analysis_makeflow_from_config_missing_prereq(config_options):
     with pytest.raises(ValueError, match="Prereq FIRSTCAL_METRICS for action"):
         mt.build_analysis_makeflow_from_config(obsids, config_file, work_dir=work_dir)
 
-    # clean up after ourselves
-    os.remove(outfile)
-    mt.clean_wrapper_scripts(work_dir)
+    # the config is validated before the makeflow is written
+    assert not os.path.exists(outfile)
 
     return
 
@@ -736,6 +922,10 @@ def test_build_analysis_makeflow_from_config_setup_teardown(config_options):
     wrapper_fn_teardown = os.path.join(work_dir, "wrapper_teardown.sh")
     assert os.path.exists(wrapper_fn_setup)
     assert os.path.exists(wrapper_fn_teardown)
+    # the teardown script gets its own args
+    with open(wrapper_fn_teardown) as infile:
+        lines = infile.readlines()
+    assert lines[5].strip().endswith("do_TEARDOWN.sh bar")
     for obsid in obsids:
         for action in actions:
             wrapper_fn = "wrapper_" + obsid + "." + action + ".sh"
@@ -773,6 +963,1033 @@ def test_build_analysis_makeflow_from_config_setup_teardown(config_options):
     return
 
 
+def test_build_analysis_makeflow_from_config_shared_wrappers(config_options, tmp_path):
+    # turn on shared wrappers
+    config = toml.load(config_options["config_file_options"])
+    config["Options"]["shared_wrappers"] = True
+    config_file = str(tmp_path / "shared_wrappers.toml")
+    with open(config_file, "w") as f:
+        toml.dump(config, f)
+    obsids = config_options["obsids"]
+    work_dir = str(tmp_path)
+
+    mt.build_analysis_makeflow_from_config(obsids, config_file, work_dir=work_dir)
+
+    # there is one wrapper per action, and none per task
+    wrappers = sorted(fn for fn in os.listdir(work_dir) if fn.startswith("wrapper_"))
+    workflow = config["WorkFlow"]["actions"]
+    expected = [f"wrapper_{action}.sh" for action in workflow[1:-1]]
+    expected += ["wrapper_setup.sh", "wrapper_teardown.sh"]
+    assert wrappers == sorted(expected)
+
+    # each task has its log and output files, and the wrappers are counted once
+    dag = mt.build_analysis_dag(obsids, config_file, work_dir=work_dir, dry_run=True)
+    assert dag.nfiles == len(expected) + 2 * len(dag)
+
+    wrapper_fn = os.path.join(work_dir, "wrapper_OMNICAL.sh")
+    with open(wrapper_fn) as infile:
+        lines = infile.read().splitlines()
+    assert lines[0] == "#!/bin/bash"
+    assert lines[1] == "parent_dir=$1"
+    assert (
+        'timeout 1m {0} "$@"'.format(
+            config["Options"]["path_to_do_scripts"] + "/do_OMNICAL.sh"
+        )
+        in lines
+    )
+    assert os.access(wrapper_fn, os.X_OK)
+
+    # the rules pass the values of the task to the wrapper
+    with open(os.path.join(work_dir, "shared_wrappers.mf")) as infile:
+        mf_lines = infile.read().splitlines()
+    obsid = obsids[0]
+    parent_dir = os.path.dirname(os.path.abspath(obsid))
+    rule = '\t{0} {1} {2}.OMNICAL.out {2} "" {2} {3} > {4} 2>&1'.format(
+        wrapper_fn,
+        parent_dir,
+        obsid,
+        config["Options"]["ex_ants"],
+        os.path.join(work_dir, obsid + ".OMNICAL.log"),
+    )
+    assert rule in mf_lines
+
+    return
+
+
+def test_build_analysis_makeflow_from_config_incremental(config_options, tmp_path):
+    config = toml.load(config_options["config_file"])
+    config_file = str(tmp_path / "incremental.toml")
+    with open(config_file, "w") as f:
+        toml.dump(config, f)
+    obsids = config_options["obsids"]
+    work_dir = str(tmp_path)
+    mf_name = os.path.join(work_dir, "incremental.mf")
+
+    # the first build adds every task
+    report = mt.build_analysis_makeflow_from_config(
+        obsids, config_file, work_dir=work_dir, incremental=True
+    )
+    assert os.path.exists(mf_name + ".manifest")
+    assert len(report["added"]) > 0
+    assert report["changed"] == []
+    assert report["removed"] == []
+    mtimes = {
+        fn: os.stat(os.path.join(work_dir, fn)).st_mtime_ns
+        for fn in os.listdir(work_dir)
+        if fn.endswith((".mf", ".sh"))
+    }
+
+    # an identical build changes nothing, and leaves the files alone
+    report = mt.build_analysis_makeflow_from_config(
+        obsids, config_file, work_dir=work_dir, incremental=True
+    )
+    assert report == {"added": [], "changed": [], "removed": []}
+    for fn, mtime in mtimes.items():
+        assert os.stat(os.path.join(work_dir, fn)).st_mtime_ns == mtime
+
+    # changing the args of an action only changes its tasks
+    config["XRFI"]["args"] = ["{basename}", "--extra"]
+    with open(config_file, "w") as f:
+        toml.dump(config, f)
+    report = mt.build_analysis_makeflow_from_config(
+        obsids, config_file, work_dir=work_dir, incremental=True
+    )
+    assert report["added"] == []
+    assert sorted(report["changed"]) == sorted(obsid + ".XRFI.out" for obsid in obsids)
+
+    # a deleted wrapper is rewritten
+    wrapper = os.path.join(work_dir, "wrapper_{}.OMNICAL.sh".format(obsids[0]))
+    os.remove(wrapper)
+    report = mt.build_analysis_makeflow_from_config(
+        obsids, config_file, work_dir=work_dir, incremental=True
+    )
+    assert os.path.exists(wrapper)
+    assert report["changed"] == [obsids[0] + ".OMNICAL.out"]
+
+    # dropping an obsid removes its tasks
+    report = mt.build_analysis_makeflow_from_config(
+        obsids[:-1], config_file, work_dir=work_dir, incremental=True
+    )
+    assert obsids[-1] + ".XRFI.out" in report["removed"]
+    assert report["added"] == []
+    with open(mf_name) as infile:
+        assert obsids[-1] + ".XRFI.out" not in infile.read()
+    # along with their wrapper scripts
+    wrapper = os.path.join(work_dir, "wrapper_{}.XRFI.sh".format(obsids[-1]))
+    assert not os.path.exists(wrapper)
+    assert os.path.exists(wrapper.replace(obsids[-1], obsids[0]))
+
+    return
+
+
+def test_build_analysis_makeflow_from_config_bundle_size(config_options, tmp_path):
+    config = toml.load(config_options["config_file"])
+    config["XRFI"]["bundle_size"] = 2
+    config_file = str(tmp_path / "bundle.toml")
+    with open(config_file, "w") as f:
+        toml.dump(config, f)
+    obsids = config_options["obsids"]
+    work_dir = str(tmp_path)
+    mf_name = os.path.join(work_dir, "bundle.mf")
+    mt.build_analysis_makeflow_from_config(obsids, config_file, work_dir=work_dir)
+
+    # the first two tasks run in one job, the last one in its own
+    rules = _read_makeflow_rules(mf_name, work_dir)
+    outfiles = [obsid + ".XRFI.out" for obsid in obsids]
+    assert " ".join(outfiles[:2]) in rules
+    assert outfiles[2] in rules
+    bundle = os.path.join(work_dir, "wrapper_{}.XRFI.bundle.sh".format(obsids[0]))
+    with open(bundle) as f:
+        lines = f.read().splitlines()
+    assert lines[0] == "#!/bin/bash"
+    assert len(lines) == 3
+
+    # each task keeps its own wrapper, log and output file
+    for obsid, line in zip(obsids, lines[1:]):
+        wrapper = os.path.join(work_dir, "wrapper_{}.XRFI.sh".format(obsid))
+        logfile = os.path.join(work_dir, "{}.XRFI.log".format(obsid))
+        assert line == "{0} > {1} 2>&1".format(wrapper, logfile)
+        assert os.path.exists(wrapper)
+    with open(mf_name) as f:
+        mf = f.read()
+    assert mf.count(bundle) == 1
+    assert not os.path.exists(bundle.replace(obsids[0], obsids[2]))
+
+    # bundle_size must be a positive integer
+    for bundle_size in [0, "all"]:
+        config["XRFI"]["bundle_size"] = bundle_size
+        with open(config_file, "w") as f:
+            toml.dump(config, f)
+        with pytest.raises(ValueError, match="bundle_size must be an integer"):
+            mt.build_analysis_makeflow_from_config(
+                obsids, config_file, work_dir=work_dir
+            )
+
+    return
+
+
+def test_build_season_makeflows(config_options, tmp_path):
+    config_file = config_options["config_file_chunk_size"]
+    season_dir = tmp_path / "season"
+    nights = {
+        "2458043": [
+            "zen.2458043.{:05d}.HH.uvh5".format(40141 + 745 * i) for i in range(5)
+        ],
+        "2458044": [
+            "zen.2458044.{:05d}.HH.uvh5".format(40141 + 745 * i) for i in range(3)
+        ],
+    }
+    for jd, obsids in nights.items():
+        (season_dir / jd).mkdir(parents=True)
+        for obsid in obsids:
+            (season_dir / jd / obsid).touch()
+    # folders not named by JD are ignored, as are nights without data
+    (season_dir / "logs").mkdir()
+    (season_dir / "2458045").mkdir()
+
+    work_dir = tmp_path / "work"
+    makeflows = mt.build_season_makeflows(
+        str(season_dir), config_file, work_dir=str(work_dir), max_workers=2
+    )
+    assert list(makeflows) == ["2458043", "2458044"]
+
+    # each night matches a makeflow built on its own
+    for jd, obsids in nights.items():
+        night_dir = str(work_dir / jd)
+        assert makeflows[jd] == os.path.join(night_dir, "nrao_rtp_chunk_size.mf")
+        serial_dir = tmp_path / "serial" / jd
+        serial_dir.mkdir(parents=True)
+        mt.build_analysis_makeflow_from_config(
+            [str(season_dir / jd / obsid) for obsid in obsids],
+            config_file,
+            work_dir=str(serial_dir),
+        )
+        assert _read_makeflow_rules(makeflows[jd], night_dir) == _read_makeflow_rules(
+            str(serial_dir / "nrao_rtp_chunk_size.mf"), str(serial_dir)
+        )
+
+    # only analysis workflows are supported
+    lstbin_config = tmp_path / "lstbin.toml"
+    lstbin_config.write_text('[Options]\nmakeflow_type = "lstbin"\n')
+    with pytest.raises(ValueError, match="only analysis makeflows"):
+        mt.build_season_makeflows(str(season_dir), str(lstbin_config))
+
+    return
+
+
+def test_makeflow_dag():
+    # a diamond, with a task listed before its parent
+    rules = [
+        mt.Rule("d.out", ["b.out", "c.out", "do_D.sh"], "d", category="D"),
+        mt.Rule("a.out", ["do_A.sh"], "a", category="A"),
+        mt.Rule("b.out", ["a.out"], "b", category="B"),
+        mt.Rule("c.out", ["a.out"], "c", category="B"),
+    ]
+    resources = {"B": {"CORES": 4, "MEMORY": 8000}}
+    dag = mt.MakeflowDAG(rules, resources=resources, walltime=0.5)
+    assert len(dag) == 4
+    assert dag.nedges == 4
+    assert list(dag.parents[dag.offsets[0] : dag.offsets[1]]) == [2, 3]
+    assert list(dag.levels) == [2, 0, 1, 1]
+    assert dag.depth == 3
+    assert dag.widths() == [1, 2, 1]
+    assert dag.task_counts() == {"D": 1, "A": 1, "B": 2}
+    assert dag.core_hours() == 0.5 * (1 + 1 + 2 * 4)
+    assert dag.core_hours({"A": 1, "B": 1, "D": 2}) == 1 + 8 + 2
+    with pytest.raises(ValueError, match="walltime of category A"):
+        dag.core_hours({"B": 1, "D": 2})
+    assert dag.memory_hours() == 0.5 * 2 * 8000
+    assert dag.edge_counts() == {"D": 2, "A": 0, "B": 2}
+    assert dag.max_fan_in() == ("d.out", 2)
+    assert dag.nfiles == 4 * 3
+
+    # the extra targets of a rule are made by the same task
+    rules.append(mt.Rule("e.out", ["d.out", "c.out"], "e", extra_targets=("f.out",)))
+    rules.append(mt.Rule("g.out", ["f.out"], "g"))
+    dag = mt.MakeflowDAG(rules)
+    assert dag.widths() == [1, 2, 1, 1, 1]
+    assert dag.summary()["core_hours"] is None
+    assert dag.summary()["memory_hours"] is None
+    # a bundle has its own wrapper script and log file
+    assert dag.nfiles == 5 * 3 + 2 * 3 + 2
+    # the tasks of B share a single wrapper script
+    dag = mt.MakeflowDAG(rules, shared_wrappers=["B"])
+    assert dag.nfiles == 5 * 3 + 2 * 3 + 2 - 2 + 1
+
+    # dependencies must not have a cycle
+    rules[1] = mt.Rule("a.out", ["d.out"], "a")
+    with pytest.raises(ValueError, match="cycle"):
+        mt.MakeflowDAG(rules).depth
+
+    return
+
+
+def test_makeflow_dag_makespan():
+    # a chain of two tasks, next to a fused task running two commands
+    rules = [
+        mt.Rule("a.A.out", ["do_A.sh"], "a"),
+        mt.Rule("a.B.out", ["a.A.out"], "b"),
+        mt.Rule("b.A.out", ["do_A.sh"], "c", extra_targets=("b.C.out",)),
+        mt.Rule("setup.out", [], "s"),
+    ]
+    dag = mt.MakeflowDAG(rules)
+    durations = dag.task_durations({"A": 1.0, "B": 2.0, "C": 0.5}, default=0.25)
+    assert list(durations) == [1.0, 2.0, 1.5, 0.25]
+    with pytest.raises(ValueError, match="runtime of action SETUP"):
+        dag.task_durations({"A": 1.0, "B": 2.0, "C": 0.5})
+
+    assert dag.critical_path(durations) == (3.0, [0, 1])
+    assert dag.makespan(durations) == 3.0
+    assert dag.makespan(durations, 1) == sum(durations)
+    # the ready tasks start in the order of the rules
+    assert dag.makespan(durations, 2) == 3.0
+    assert dag.makespan_table(durations, [1, 2, 8]) == [
+        (1, 4.75, 4.75),
+        (2, 3.0, 3.0),
+        (8, 3.0, 3.0),
+    ]
+    with pytest.raises(ValueError, match="slots must be at least 1"):
+        dag.makespan(durations, 0)
+    assert mt.MakeflowDAG([]).critical_path([]) == (0.0, [])
+
+    return
+
+
+def test_makeflow_dag_sorted_by_priority():
+    # short tasks listed before the start of a long chain
+    rules = [
+        mt.Rule("a.A.out", ["do_A.sh"], "a"),
+        mt.Rule("b.A.out", ["do_A.sh"], "a"),
+        mt.Rule("c.B.out", ["do_B.sh"], "b"),
+        mt.Rule("c.C.out", ["c.B.out"], "c"),
+        mt.Rule("c.D.out", ["c.C.out"], "d"),
+    ]
+    dag = mt.MakeflowDAG(rules, resources={"B": {"CORES": 2}}, walltime=1.0)
+    durations = dag.task_durations({"A": 1.0, "B": 1.0, "C": 1.0, "D": 1.0})
+    assert list(dag.bottom_levels(durations)) == [1.0, 1.0, 3.0, 2.0, 1.0]
+
+    # ties keep the order of the rules
+    sorted_dag = dag.sorted_by_priority(durations)
+    assert [rule.target for rule in sorted_dag.rules] == [
+        "c.B.out",
+        "c.C.out",
+        "a.A.out",
+        "b.A.out",
+        "c.D.out",
+    ]
+    assert sorted_dag.resources == dag.resources
+    assert sorted_dag.walltime == dag.walltime
+
+    # the chain no longer waits for the short tasks
+    assert dag.makespan(durations, 2) == 4.0
+    assert sorted_dag.makespan(durations, 2) == 3.0
+
+    return
+
+
+def test_build_analysis_makeflow_from_config_order(config_options, tmp_path):
+    config_file = config_options["config_file"]
+    obsids = config_options["obsids"]
+    work_dir = str(tmp_path)
+    mf_name = os.path.join(work_dir, "nrao_rtp.mf")
+    mt.build_analysis_makeflow_from_config(obsids, config_file, work_dir=work_dir)
+    rules = _read_makeflow_rules(mf_name, work_dir)
+    mt.build_analysis_makeflow_from_config(
+        obsids, config_file, work_dir=work_dir, order="critical_path"
+    )
+
+    # the same rules, with the start of the longest chains first
+    sorted_rules = _read_makeflow_rules(mf_name, work_dir)
+    assert sorted_rules == rules
+    assert list(sorted_rules)[:3] == [
+        obsid + ".FIRSTCAL_METRICS.out" for obsid in obsids
+    ]
+
+    with pytest.raises(ValueError, match="order must be one of"):
+        mt.build_analysis_makeflow_from_config(
+            obsids, config_file, work_dir=work_dir, order="random"
+        )
+
+    return
+
+
+def test_build_analysis_makeflow_from_config_streams(
+    config_options, tmp_path, monkeypatch
+):
+    config_file = config_options["config_file"]
+    obsids = config_options["obsids"]
+    work_dir = str(tmp_path)
+    mf_name = os.path.join(work_dir, "nrao_rtp.mf")
+
+    def no_dag(*args, **kwargs):
+        raise AssertionError("the graph of the tasks was built")
+
+    # by default, the rules are written as they are generated
+    monkeypatch.setattr(mt, "MakeflowDAG", no_dag)
+    mt.build_analysis_makeflow_from_config(obsids, config_file, work_dir=work_dir)
+    assert len(_read_makeflow_rules(mf_name, work_dir)) == 24
+
+    # reordering the rules needs the graph
+    with pytest.raises(AssertionError, match="graph of the tasks"):
+        mt.build_analysis_makeflow_from_config(
+            obsids, config_file, work_dir=work_dir, order="critical_path"
+        )
+
+    return
+
+
+def test_makeflow_dag_transitive_reduction():
+    # d depends on b, which depends on a; c is made by the same task as b
+    rules = [
+        mt.Rule("a.out", ["do_A.sh"], "a", category="A"),
+        mt.Rule("b.out", ["a.out"], "b", category="B", extra_targets=("c.out",)),
+        mt.Rule("d.out", ["a.out", "do_D.sh", "b.out", "c.out", "b.out"], "d"),
+    ]
+    dag = mt.MakeflowDAG(rules, resources={"A": {"CORES": 2}}, walltime=1.0)
+    assert dag.nedges == 3
+
+    reduced = dag.transitive_reduction()
+    assert reduced.nedges == 2
+    assert reduced.rules[2].sources == ["do_D.sh", "b.out"]
+    assert reduced.rules[2].command == "d"
+    assert reduced.rules[1] is rules[1]
+    assert reduced.resources == dag.resources
+    assert reduced.walltime == dag.walltime
+    assert list(reduced.levels) == list(dag.levels)
+
+    return
+
+
+def test_build_analysis_makeflow_from_config_transitive_reduction(
+    config_options, tmp_path
+):
+    config_file = config_options["config_file_setup_teardown"]
+    obsids = config_options["obsids"]
+    work_dir = str(tmp_path)
+    mf_name = os.path.join(work_dir, "nrao_rtp_setup_teardown.mf")
+    mt.build_analysis_makeflow_from_config(obsids, config_file, work_dir=work_dir)
+    rules = _read_makeflow_rules(mf_name, work_dir)
+    mt.build_analysis_makeflow_from_config(
+        obsids, config_file, work_dir=work_dir, transitive_reduction=True
+    )
+    reduced = _read_makeflow_rules(mf_name, work_dir)
+
+    # tasks after another task no longer wait for SETUP themselves
+    assert list(reduced) == list(rules)
+    for target, (sources, command) in reduced.items():
+        assert sources <= rules[target][0]
+        assert command == rules[target][1]
+    omnical = obsids[1] + ".OMNICAL.out"
+    assert rules[omnical][0] - reduced[omnical][0] == {"setup.out"}
+    xrfi = obsids[1] + ".XRFI.out"
+    assert reduced[xrfi][0] == rules[xrfi][0]
+    assert "setup.out" in reduced[xrfi][0]
+
+    return
+
+
+def test_runtimes_from_config_and_logs(config_options, tmp_path):
+    config = toml.load(config_options["config_file"])
+    config["OMNICAL"]["runtime"] = "90m"
+    config["XRFI"]["runtime"] = 1800
+    config_file = str(tmp_path / "runtime.toml")
+    with open(config_file, "w") as f:
+        toml.dump(config, f)
+    assert mt.runtimes_from_config(config_file) == {"OMNICAL": 1.5, "XRFI": 0.5}
+    config["XRFI"]["runtime"] = "soon"
+    with open(config_file, "w") as f:
+        toml.dump(config, f)
+    with pytest.raises(ValueError, match="could not interpret the duration"):
+        mt.runtimes_from_config(config_file)
+
+    # the wrapper scripts write the date at the start and end of the log
+    logs = {
+        "zen.2458043.40141.HH.uvh5.OMNICAL.log": "12:00:00",
+        "zen.2458043.40887.HH.uvh5.OMNICAL.log": "12:30:00",
+        "zen.2458043.41632.HH.uvh5.OMNICAL.log": "13:00:00",
+        "zen.2458043.40141.HH.uvh5.XRFI.bundle.log": "18:00:00",
+    }
+    for log_file, end in logs.items():
+        with open(tmp_path / log_file, "w") as f:
+            f.write("Thu Oct 17 11:00:00 UTC 2019\nrunning\n")
+            f.write("Thu Oct 17 {} UTC 2019\n".format(end))
+    # unfinished tasks are ignored, as are tasks that failed
+    with open(tmp_path / "zen.2458043.40141.HH.uvh5.XRFI.log", "w") as f:
+        f.write("Thu Oct 17 11:00:00 UTC 2019\nrunning\n")
+    with open(tmp_path / "zen.2458043.40141.HH.uvh5.XRFI_APPLY.log.error", "w") as f:
+        f.write("Thu Oct 17 11:00:00 UTC 2019\nThu Oct 17 12:00:00 UTC 2019\n")
+    with open(tmp_path / "setup.log", "w") as f:
+        f.write("Thu Oct 17 23:59:00 UTC 2019\nFri Oct 18 00:05:00 UTC 2019\n")
+
+    assert mt.runtimes_from_logs(str(tmp_path)) == {"OMNICAL": 1.5, "SETUP": 0.1}
+
+    return
+
+
+def test_build_analysis_dag(config_options, tmp_path):
+    config = toml.load(config_options["config_file"])
+    config["Options"]["timeout"] = "30m"
+    config_file = str(tmp_path / "dag.toml")
+    with open(config_file, "w") as f:
+        toml.dump(config, f)
+    obsids = config_options["obsids"]
+    dag = mt.build_analysis_dag(obsids, config_file, work_dir=str(tmp_path))
+
+    # 8 actions for each obsid, with 4 of them waiting for the one before
+    summary = dag.summary()
+    assert summary["tasks"] == 24
+    assert set(summary["tasks_per_category"].values()) == {3}
+    assert summary["edges"] == 12
+    assert summary["depth"] == 4
+    assert summary["widths"] == [12, 6, 3, 3]
+    assert summary["core_hours"] == 24 * 0.5
+    assert summary["files"] == 24 * 3
+    assert not os.path.exists(str(tmp_path / "dag.mf"))
+
+    # a dry run writes no wrapper scripts either
+    work_dir = tmp_path / "dry_run"
+    work_dir.mkdir()
+    dry_dag = mt.build_analysis_dag(
+        obsids, config_file, work_dir=str(work_dir), dry_run=True
+    )
+    assert dry_dag.summary() == summary
+    assert not os.listdir(str(work_dir))
+
+    # fusing the chains of actions keeps one task per chain
+    dag = mt.build_analysis_dag(obsids, config_file, work_dir=str(tmp_path), fuse=True)
+    assert len(dag) == 12
+    assert dag.nedges == 0
+
+    return
+
+
+def test_build_dag_from_config(config_options, tmp_path):
+    config = toml.load(config_options["config_file"])
+    config_file = str(tmp_path / "dag.toml")
+    with open(config_file, "w") as f:
+        toml.dump(config, f)
+    obsids = config_options["obsids"]
+    dag = mt.build_dag_from_config(
+        obsids, config_file, work_dir=str(tmp_path), dry_run=True
+    )
+    assert len(dag) == 24
+    assert os.listdir(str(tmp_path)) == ["dag.toml"]
+
+    # without a timeout, the hours need a runtime for every action
+    assert dag.summary()["core_hours"] is None
+    for action in config["WorkFlow"]["actions"]:
+        config[action]["runtime"] = "30m"
+    with open(config_file, "w") as f:
+        toml.dump(config, f)
+    dag = mt.build_dag_from_config(obsids, config_file, work_dir=str(tmp_path))
+    assert dag.summary()["core_hours"] == 24 * 0.5
+
+    config["Options"]["makeflow_type"] = "lstbin_single_baseline"
+    with open(config_file, "w") as f:
+        toml.dump(config, f)
+    with pytest.raises(ValueError, match="cannot build the graph"):
+        mt.build_dag_from_config(obsids, config_file, work_dir=str(tmp_path))
+
+    return
+
+
+def test_fusion_chains(config_options):
+    config = toml.load(config_options["config_file"])
+    chains = mt._fusion_chains(mt.compile_config(config))
+    chain = ("FIRSTCAL_METRICS", "OMNICAL", "OMNICAL_METRICS", "OMNI_APPLY")
+    assert set(chains.values()) == {chain, ("XRFI", "XRFI_APPLY")}
+    assert chains["OMNICAL"] == chain
+
+    # actions with chunks, or other resources, are not fused
+    config["OMNICAL_METRICS"]["chunk_size"] = 3
+    config["XRFI_APPLY"]["mem"] = 1
+    chains = mt._fusion_chains(mt.compile_config(config))
+    assert set(chains.values()) == {("FIRSTCAL_METRICS", "OMNICAL")}
+
+    return
+
+
+def test_build_analysis_makeflow_from_config_fuse(config_options, tmp_path):
+    config_file = config_options["config_file"]
+    obsids = config_options["obsids"]
+    work_dir = str(tmp_path)
+    mf_name = os.path.join(work_dir, "fused.mf")
+    mt.build_analysis_makeflow_from_config(
+        obsids, config_file, mf_name=mf_name, work_dir=work_dir, fuse=True
+    )
+
+    # one job per obsid for each chain, making the outfiles of all of its tasks
+    rules = _read_makeflow_rules(mf_name, work_dir)
+    assert len(rules) == 4 * len(obsids)
+    obsid = obsids[0]
+    target = " ".join(obsid + ".{}.out".format(a) for a in ("XRFI", "XRFI_APPLY"))
+    sources, command = rules[target]
+    compiled = mt.compile_config(toml.load(config_file))
+    assert sources == {compiled.actions[a].command for a in ("XRFI", "XRFI_APPLY")}
+    assert command.strip().startswith("WORK_DIR/wrapper_{}.XRFI.fused.sh".format(obsid))
+
+    # the tasks run back to back, stopping at the first one that fails
+    fused = os.path.join(work_dir, "wrapper_{}.XRFI.fused.sh".format(obsid))
+    with open(fused) as f:
+        lines = f.read().splitlines()
+    xrfi_out = os.path.join(work_dir, obsid + ".XRFI.out")
+    assert lines[1].startswith(
+        os.path.join(work_dir, "wrapper_{}.XRFI.sh".format(obsid))
+    )
+    assert lines[2] == "if [ ! -e {} ]; then exit 1; fi".format(xrfi_out)
+    assert lines[3].startswith(
+        os.path.join(work_dir, "wrapper_{}.XRFI_APPLY.sh".format(obsid))
+    )
+
+    return
+
+
+def test_build_analysis_makeflow_from_config_barriers(config_options, tmp_path):
+    config = toml.load(config_options["config_file_setup_teardown"])
+    config["XRFI_APPLY"]["prereq_chunk_size"] = "all"
+    config["Options"]["timeout"] = "1h"
+    config_file = str(tmp_path / "barriers.toml")
+    with open(config_file, "w") as f:
+        toml.dump(config, f)
+    obsids = [
+        "zen.{}.{:05d}.HH.uvh5".format(jd, 40141 + 745 * i)
+        for jd in (2458043, 2458044)
+        for i in range(5)
+    ]
+    work_dir = str(tmp_path)
+    dag = mt.build_analysis_dag(obsids, config_file, work_dir=work_dir)
+    barrier_dag = mt.build_analysis_dag(
+        obsids, config_file, work_dir=work_dir, barriers=True
+    )
+    # one barrier per JD for XRFI, and for XRFI_APPLY before the TEARDOWN
+    assert len(barrier_dag) == len(dag) + 4
+    assert barrier_dag.nedges < dag.nedges
+    assert barrier_dag.core_hours() == dag.core_hours()
+
+    mf_name = os.path.join(work_dir, "barriers.mf")
+    mt.build_analysis_makeflow_from_config(
+        obsids, config_file, mf_name=mf_name, work_dir=work_dir, barriers=True
+    )
+    rules = _read_makeflow_rules(mf_name, work_dir)
+    barrier = "2458044.XRFI.barrier.out"
+    sources, command = rules[barrier]
+    assert sources == {obsid + ".XRFI.out" for obsid in obsids[5:]}
+    assert command == "\tLOCAL touch {}".format(barrier)
+    sources, command = rules[obsids[7] + ".XRFI_APPLY.out"]
+    assert barrier in sources
+    assert obsids[6] + ".XRFI.out" not in sources
+    sources, command = rules["teardown.out"]
+    assert {jd + ".XRFI_APPLY.barrier.out" for jd in ("2458043", "2458044")} <= sources
+    assert not any(source.startswith("zen.") for source in sources)
+
+    return
+
+
+def test_gather_sources():
+    obsids = [
+        "zen.{}.{:05d}.HH.uvh5".format(jd, 40141 + 745 * i)
+        for jd in (2458043, 2458044)
+        for i in range(4)
+    ]
+    index = mt.ObsidIndex(obsids)
+    partition = index.partition(stride_length=2, chunk_size=2, time_centered=False)
+    sources = mt._gather_sources("XRFI", partition, index)
+    assert sources == [obsids[i] + ".XRFI.out" for i in range(0, 8, 2)]
+
+    # with barriers, there is one source per JD
+    barrier_tasks = {}
+    sources = mt._gather_sources("XRFI", partition, index, barrier_tasks)
+    assert sources == ["2458043.XRFI.barrier.out", "2458044.XRFI.barrier.out"]
+    assert barrier_tasks["2458044.XRFI.barrier.out"] == ("XRFI", 2, 4)
+
+    return
+
+
+def test_phase_profiler(config_options, tmp_path):
+    config_file = config_options["config_file"]
+    obsids = config_options["obsids"]
+    pstats_file = str(tmp_path / "build.prof")
+    profile = mt.PhaseProfiler(pstats_file=pstats_file)
+    mt.build_makeflow_from_config(
+        obsids, config_file, work_dir=str(tmp_path), profile=profile
+    )
+    assert mt._profiler is None
+    assert set(profile.times) == set(mt._PHASES)
+    # one wrapper script and one set of args per task
+    assert profile.calls["wrappers"] == profile.calls["args"] == 24
+    assert profile.calls["makeflow"] == 1
+    assert profile.total >= sum(profile.times.values())
+    assert os.path.exists(pstats_file)
+
+    # the phases add up over the builds in a block
+    with profile:
+        mt.build_analysis_dag(obsids, config_file, work_dir=str(tmp_path))
+    assert profile.calls["wrappers"] == 48
+    lines = profile.report().splitlines()
+    assert [line.split()[0] for line in lines] == ["phase"] + list(mt._PHASES) + [
+        "total"
+    ]
+
+    return
+
+
+def _read_makeflow_rules(mf_name, work_dir):
+    """Read the rules of a makeflow file into a dict keyed by target."""
+    with open(mf_name) as infile:
+        lines = infile.read().replace(work_dir, "WORK_DIR").splitlines()
+    rules = {}
+    for i, line in enumerate(lines):
+        if line and not line.startswith(("#", "\t", "export", ".MAKEFLOW")):
+            target, sources = line.split(":", 1)
+            assert target not in rules
+            rules[target] = (set(sources.split()), lines[i + 1])
+    return rules
+
+
+@pytest.mark.parametrize(
+    "config_key,deferred",
+    [
+        ("config_file_chunk_size", "OMNICAL_METRICS"),
+        ("config_file_setup_teardown", "TEARDOWN"),
+    ],
+)
+def test_extend_makeflow(config_options, config_key, deferred, tmp_path):
+    config_file = config_options[config_key]
+    obsids = ["zen.2458043.{:05d}.HH.uvh5".format(40141 + 745 * i) for i in range(11)]
+    full_dir = str(tmp_path / "full")
+    work_dir = str(tmp_path / "rtp")
+    os.mkdir(full_dir)
+    os.mkdir(work_dir)
+    mt.build_analysis_makeflow_from_config(
+        obsids, config_file, mf_name="night.mf", work_dir=full_dir
+    )
+    expected = _read_makeflow_rules(os.path.join(full_dir, "night.mf"), full_dir)
+
+    # add the obsids in batches
+    mf_name = os.path.join(work_dir, "night.mf")
+    added = mt.extend_makeflow(
+        work_dir, obsids[:4], config_file=config_file, mf_name="night.mf"
+    )
+    assert os.path.exists(mf_name + ".state")
+    rules = _read_makeflow_rules(mf_name, work_dir)
+    assert sorted(rules) == sorted(added)
+    # the first obsid is processed, but tasks waiting for the next batch are not
+    assert obsids[0] + ".XRFI_APPLY.out" in rules
+    if deferred == "TEARDOWN":
+        assert "setup.out" in rules
+        assert "teardown.out" not in rules
+    else:
+        assert obsids[3] + ".{}.out".format(deferred) not in rules
+    # every rule is final, and its prereqs are in the makeflow
+    for target, (sources, command) in rules.items():
+        assert expected[target] == (sources, command)
+        for source in sources:
+            if source.endswith(".out"):
+                assert source in rules
+
+    # re-reported obsids are ignored
+    added = mt.extend_makeflow(work_dir, obsids[2:8])
+    assert not any(target.startswith(obsids[0]) for target in added)
+    added = mt.extend_makeflow(work_dir, obsids[8:], final=True)
+    if deferred == "TEARDOWN":
+        assert added[-1] == "teardown.out"
+    else:
+        assert obsids[3] + ".{}.out".format(deferred) not in added
+
+    # all batches together give the same makeflow as a single build
+    assert _read_makeflow_rules(mf_name, work_dir) == expected
+    # and declare the resources of each category once, like a single build
+    declarations = []
+    for fn in (mf_name, os.path.join(full_dir, "night.mf")):
+        with open(fn) as infile:
+            declarations.append(sum(line.startswith(".MAKEFLOW") for line in infile))
+    assert declarations[0] == declarations[1]
+    for fn in os.listdir(full_dir):
+        if fn.startswith("wrapper_"):
+            with open(os.path.join(full_dir, fn)) as infile:
+                contents = infile.read().replace(full_dir, "WORK_DIR")
+            with open(os.path.join(work_dir, fn)) as infile:
+                assert infile.read().replace(work_dir, "WORK_DIR") == contents
+
+    return
+
+
+@pytest.mark.parametrize(
+    "config_key,fits",
+    [("config_file", True), ("config_file_chunk_size", False)],
+)
+def test_extend_makeflow_late_obsids(config_options, config_key, fits, tmp_path):
+    config_file = config_options[config_key]
+    obsids = ["zen.2458043.{:05d}.HH.uvh5".format(40141 + 745 * i) for i in range(11)]
+    work_dir = str(tmp_path)
+    mt.extend_makeflow(work_dir, obsids[:4] + obsids[5:8], config_file=config_file)
+
+    # a late obsid is added if the rules already written stay the same
+    if fits:
+        added = mt.extend_makeflow(work_dir, obsids[4:5])
+        assert obsids[4] + ".ANT_METRICS.out" in added
+    else:
+        with pytest.warns(UserWarning, match="arrived too late"):
+            added = mt.extend_makeflow(work_dir, obsids[4:5])
+        assert not any(target.startswith(obsids[4]) for target in added)
+    mt.extend_makeflow(work_dir, obsids[8:], final=True)
+
+    full_dir = str(tmp_path / "full")
+    os.mkdir(full_dir)
+    mt.build_analysis_makeflow_from_config(
+        obsids if fits else obsids[:4] + obsids[5:],
+        config_file,
+        work_dir=full_dir,
+    )
+    mf_name = os.path.basename(config_file).replace(".toml", ".mf")
+    assert _read_makeflow_rules(
+        os.path.join(work_dir, mf_name), work_dir
+    ) == _read_makeflow_rules(os.path.join(full_dir, mf_name), full_dir)
+
+    return
+
+
+def test_extend_makeflow_errors(config_options, tmp_path):
+    work_dir = str(tmp_path)
+    obsids = config_options["obsids"]
+    with pytest.raises(ValueError, match="config_file must be specified"):
+        mt.extend_makeflow(work_dir, obsids, mf_name="night.mf")
+    with pytest.raises(ValueError, match="could not find the state"):
+        mt.extend_makeflow(work_dir, obsids)
+
+    mt.extend_makeflow(work_dir, obsids[1:], config_file=config_options["config_file"])
+    mt.extend_makeflow(work_dir, [], final=True)
+    with pytest.raises(ValueError, match="was finalized"):
+        mt.extend_makeflow(work_dir, obsids)
+
+    return
+
+
+def test_makeflow_writer():
+    f = io.StringIO()
+    writer = mt.MakeflowWriter(f, buffer_size=64)
+    writer.write_header("test.toml")
+    rules = [
+        mt.Rule("a.out", ["do_A.sh"], "wrapper_a.sh > a.log 2>&1", "-p hera"),
+        mt.Rule("b.out", ["do_B.sh", "a.out"], "wrapper_b.sh > b.log 2>&1"),
+        mt.Rule("c.out", ["b.out"], "touch c.out", local=True),
+    ]
+    writer.write_rule(rules[0])
+    # the first rule fills the buffer
+    assert f.getvalue().startswith("# makeflow file generated from config file")
+    writer.write_rules(iter(rules[1:]))
+    assert writer.nrules == 3
+
+    lines = f.getvalue().splitlines()
+    assert lines[1].startswith("# created at")
+    assert lines[2:] == [
+        "export BATCH_OPTIONS = -p hera",
+        "a.out: do_A.sh",
+        "\twrapper_a.sh > a.log 2>&1",
+        "",
+        "b.out: do_B.sh a.out",
+        "\twrapper_b.sh > b.log 2>&1",
+        "",
+        "c.out: b.out",
+        "\tLOCAL touch c.out",
+        "",
+    ]
+
+    return
+
+
+def test_makeflow_writer_categories(config_options, tmp_path):
+    f = io.StringIO()
+    resources = {"A": {"CORES": 2, "MEMORY": 16000}, "B": {"MEMORY": 8000}}
+    writer = mt.MakeflowWriter(f, resources=resources)
+    writer.write_rules(
+        [
+            mt.Rule("a1.out", ["do_A.sh"], "wrapper_a1.sh", "-p hera", category="A"),
+            mt.Rule("b1.out", ["do_B.sh"], "wrapper_b1.sh", "-p hera", category="B"),
+            mt.Rule("a2.out", ["do_A.sh"], "wrapper_a2.sh", "-p hera", category="A"),
+            mt.Rule("b2.out", ["do_B.sh"], "wrapper_b2.sh", "-p bigmem", category="B"),
+        ]
+    )
+    # resources and batch options are written once per category, and the batch
+    # options again when they change
+    assert f.getvalue().splitlines() == [
+        ".MAKEFLOW CATEGORY A",
+        ".MAKEFLOW CORES 2",
+        ".MAKEFLOW MEMORY 16000",
+        "export BATCH_OPTIONS = -p hera",
+        "a1.out: do_A.sh",
+        "\twrapper_a1.sh",
+        "",
+        ".MAKEFLOW CATEGORY B",
+        ".MAKEFLOW MEMORY 8000",
+        "export BATCH_OPTIONS = -p hera",
+        "b1.out: do_B.sh",
+        "\twrapper_b1.sh",
+        "",
+        ".MAKEFLOW CATEGORY A",
+        "a2.out: do_A.sh",
+        "\twrapper_a2.sh",
+        "",
+        ".MAKEFLOW CATEGORY B",
+        "export BATCH_OPTIONS = -p bigmem",
+        "b2.out: do_B.sh",
+        "\twrapper_b2.sh",
+        "",
+    ]
+
+    # an appending writer picks up the options of each category
+    f = io.StringIO()
+    writer = mt.MakeflowWriter(f, resources=resources, state=writer.state)
+    writer.write_rules(
+        [
+            mt.Rule("b3.out", ["do_B.sh"], "wrapper_b3.sh", "-p bigmem", category="B"),
+            mt.Rule("a3.out", ["do_A.sh"], "wrapper_a3.sh", "-p hera", category="A"),
+        ]
+    )
+    assert f.getvalue().splitlines() == [
+        "b3.out: do_B.sh",
+        "\twrapper_b3.sh",
+        "",
+        ".MAKEFLOW CATEGORY A",
+        "a3.out: do_A.sh",
+        "\twrapper_a3.sh",
+        "",
+    ]
+
+    # in a workflow, each action is a category with the resources of the config
+    config_file = config_options["config_file_setup_teardown"]
+    work_dir = str(tmp_path)
+    mt.build_analysis_makeflow_from_config(
+        config_options["obsids"], config_file, work_dir=work_dir
+    )
+    with open(os.path.join(work_dir, "nrao_rtp_setup_teardown.mf")) as infile:
+        lines = infile.read().splitlines()
+    workflow = toml.load(config_file)["WorkFlow"]["actions"]
+    assert lines.count(".MAKEFLOW MEMORY 10000") == len(workflow)
+    assert lines.count(".MAKEFLOW CORES 1") == len(workflow)
+    # every category has its batch options
+    assert len([line for line in lines if line.startswith("export")]) == len(workflow)
+
+    return
+
+
+def _eval_jx(text):
+    """Evaluate a JX workflow, whose expressions are also valid python."""
+    define = json.loads(text.splitlines()[1][len('"define": ') : -1])
+    return eval(text, dict(define, true=True, false=False, null=None))
+
+
+def test_jx_writer():
+    f = io.StringIO()
+    writer = mt.JXWriter(
+        f,
+        buffer_size=64,
+        define={"WORK_DIR": "/work", "X": ""},
+        resources={"A": {"CORES": 2, "MEMORY": 16000}},
+    )
+    writer.write_header("test.toml")
+    writer.write_rules(
+        [
+            mt.Rule(
+                "a.out",
+                ["/scripts/do_A.sh"],
+                "/work/wrapper_a.sh > /work/a.log 2>&1",
+                "-p hera",
+                category="A",
+            ),
+            mt.Rule("b.out", ["do_B.sh", "a.out"], "wrapper_b.sh", "-p hera", "B"),
+            mt.Rule("c.out", ["do_C.sh"], "wrapper_c.sh", "-p bigmem", category="B"),
+            mt.Rule("e.out", ["do_E.sh"], "wrapper_e.sh", category="E"),
+            mt.Rule("d.out", ["c.out"], "touch d.out", category="B", local=True),
+        ]
+    )
+    writer.write_footer()
+    assert writer.nrules == 5
+
+    # the work directory is a variable, and empty strings are not defined
+    text = f.getvalue()
+    assert 'WORK_DIR+"/wrapper_a.sh > "+WORK_DIR+"/a.log 2>&1"' in text
+    workflow = _eval_jx(text)
+    assert workflow["define"]["CONFIG_FILE"] == "test.toml"
+    assert "X" not in workflow["define"]
+    assert workflow["rules"][0] == {
+        "command": "/work/wrapper_a.sh > /work/a.log 2>&1",
+        "inputs": ["/scripts/do_A.sh"],
+        "outputs": ["a.out"],
+        "category": "A",
+    }
+    # rules inherit the batch options of the previous rule of their category,
+    # and categories with different batch options are numbered
+    categories = [rule.get("category") for rule in workflow["rules"]]
+    assert categories == ["A", "B", "B_2", None, "B_2"]
+    assert workflow["rules"][4]["local_job"]
+    assert workflow["categories"] == {
+        "A": {
+            "environment": {"BATCH_OPTIONS": "-p hera"},
+            "resources": {"cores": 2, "memory": 16000},
+        },
+        "B": {"environment": {"BATCH_OPTIONS": "-p hera"}},
+        "B_2": {"environment": {"BATCH_OPTIONS": "-p bigmem"}},
+    }
+
+    return
+
+
+def test_build_analysis_makeflow_from_config_jx(config_options, tmp_path):
+    config_file = config_options["config_file_setup_teardown"]
+    obsids = config_options["obsids"]
+    work_dir = str(tmp_path)
+    mt.build_analysis_makeflow_from_config(
+        obsids, config_file, work_dir=work_dir, output_format="jx"
+    )
+    mt.build_analysis_makeflow_from_config(obsids, config_file, work_dir=work_dir)
+
+    # the JX workflow has the same rules as the makeflow file
+    with open(os.path.join(work_dir, "nrao_rtp_setup_teardown.jx")) as infile:
+        workflow = _eval_jx(infile.read())
+    assert workflow["define"]["WORK_DIR"] == work_dir
+    rules = _read_makeflow_rules(
+        os.path.join(work_dir, "nrao_rtp_setup_teardown.mf"), work_dir
+    )
+    assert len(workflow["rules"]) == len(rules)
+    for rule in workflow["rules"]:
+        (target,) = rule["outputs"]
+        command = "\t" + rule["command"].replace(work_dir, "WORK_DIR")
+        assert rules[target] == (set(rule["inputs"]), command)
+        assert rule["category"] == target.split(".")[-2].upper()
+    assert set(workflow["categories"]) == set(
+        mt.compile_config(toml.load(config_file)).workflow
+    )
+
+    with pytest.raises(ValueError, match="output_format must be one of"):
+        mt.build_analysis_makeflow_from_config(
+            obsids, config_file, work_dir=work_dir, output_format="cwl"
+        )
+
+    return
+
+
+def test_analysis_rules(config_options, tmp_path):
+    config = toml.load(config_options["config_file_setup_teardown"])
+    compiled = mt.compile_config(config)
+    obsids = [os.path.abspath(obsid) for obsid in config_options["obsids"]]
+    index = mt.ObsidIndex(obsids)
+
+    # rules are generated lazily, along with their wrapper scripts
+    rules = mt._analysis_rules(compiled, obsids, index, str(tmp_path))
+    rule = next(rules)
+    assert rule.target == "setup.out"
+    assert os.listdir(tmp_path) == ["wrapper_setup.sh"]
+
+    rules = list(rules)
+    assert rules[-1].target == "teardown.out"
+    nactions = len(compiled.workflow) - 2
+    assert len(rules) == nactions * len(obsids) + 1
+    assert len(os.listdir(tmp_path)) == len(rules) + 1
+
+    return
+
+
 def test_setup_teardown_errors(config_options):
     # define config to load
     config_file = config_options["bad_setup_config_file"]
@@ -790,6 +2007,117 @@ def test_setup_teardown_errors(config_options):
     return
 
 
+def test_compile_config(config_options):
+    config = toml.load(config_options["config_file_options"])
+    compiled = mt.compile_config(config)
+
+    assert compiled.workflow[0] == "SETUP"
+    assert compiled.workflow[-1] == "TEARDOWN"
+    assert set(compiled.actions) == set(compiled.workflow)
+    assert compiled.timeout == "1m"
+    assert compiled.mandc_report is True
+    assert compiled.default_queue == "hera"
+
+    spec = compiled.actions["OMNICAL"]
+    assert spec.name == "OMNICAL"
+    assert spec.prereqs == ("FIRSTCAL_METRICS",)
+    ex_ants = "~/hera/hera_cal/hera_cal/calibrations/herahex_ex_ants.txt"
+    assert spec.args == "{basename} " + ex_ants
+    assert spec.command == (
+        "~/hera/hera_op/hera_op/data/sample_task_scripts/do_OMNICAL.sh"
+    )
+    assert spec.batch_options == "--mem 10000M --cpus-per-task 1 -p hera"
+    assert spec.chunk_size == 1
+    assert spec.stride_length == 1
+    assert spec.time_centered is True
+    assert spec.collect_stragglers is False
+
+    # SETUP and TEARDOWN do not require args
+    assert compiled.actions["SETUP"].args == ""
+    assert compiled.actions["TEARDOWN"].prereqs == ()
+
+    # "all" is resolved against the number of obsids of each build
+    config = toml.load(config_options["config_file_chunk_size_all"])
+    spec = mt.compile_config(config).actions["XRFI"]
+    assert spec.chunk_size == "all"
+    assert spec.stride_length == "all"
+    assert spec.lengths(14) == (14, 14)
+
+    return
+
+
+def test_load_config(config_options, tmp_path):
+    config_file = str(tmp_path / "cached.toml")
+    shutil.copy(config_options["config_file"], config_file)
+    compiled = mt.load_config(config_file)
+    assert mt.load_config(config_file) is compiled
+    # the entries are copied, so that callers can modify them
+    config = mt._read_config(config_file)
+    config["Options"]["timeout"] = "2h"
+    assert mt._read_config(config_file) == toml.load(config_file)
+    assert mt.load_config(config_file) is compiled
+
+    # the config is read again when the file changes
+    config = toml.load(config_file)
+    config["Options"]["timeout"] = "1h"
+    with open(config_file, "w") as f:
+        toml.dump(config, f)
+    new_compiled = mt.load_config(config_file)
+    assert new_compiled is not compiled
+    assert new_compiled.timeout == "1h"
+
+    # or when the cache is cleared
+    mt.clear_config_cache(config_file)
+    assert mt.load_config(config_file) is not new_compiled
+    compiled = mt.load_config(config_file)
+    mt.clear_config_cache()
+    assert mt.load_config(config_file) is not compiled
+
+    return
+
+
+def test_action_spec_immutable():
+    spec = mt.ActionSpec("XRFI", args="{basename}", chunk_size=3)
+    with pytest.raises(AttributeError, match="immutable"):
+        spec.chunk_size = 5
+    with pytest.raises(AttributeError, match="immutable"):
+        del spec.args
+
+    new_spec = pickle.loads(pickle.dumps(spec))
+    for slot in mt.ActionSpec.__slots__:
+        assert getattr(new_spec, slot) == getattr(spec, slot)
+
+    return
+
+
+def test_compile_config_errors(config_options):
+    config = toml.load(config_options["config_file"])
+
+    bad_config = copy.deepcopy(config)
+    bad_config["XRFI"]["chunk_size"] = "foo"
+    with pytest.raises(ValueError, match="chunk_size must be able to be interpreted"):
+        mt.compile_config(bad_config)
+
+    bad_config = copy.deepcopy(config)
+    bad_config["XRFI"]["stride_length"] = "foo"
+    with pytest.raises(
+        ValueError, match="stride_length must be able to be interpreted"
+    ):
+        mt.compile_config(bad_config)
+
+    bad_config = copy.deepcopy(config)
+    bad_config["XRFI"]["time_centered"] = "true"
+    with pytest.raises(ValueError, match="time_centered must be a boolean variable"):
+        mt.compile_config(bad_config)
+
+    bad_config = copy.deepcopy(config)
+    bad_config["XRFI"]["prereqs"] = "FOO"
+    with pytest.raises(ValueError, match="Prereq FOO for action XRFI not found"):
+        mt.compile_config(bad_config)
+
+    return
+
+
 def test_build_makeflow_from_config(config_options):
     # define args
     obsids = config_options["obsids"][:1]
@@ -1049,6 +2377,95 @@ def test_sort_obsids(config_options):
     return
 
 
+def test_obsid():
+    obsid = mt.Obsid("/data/zen.2458000.12345.xx.uvh5")
+    assert obsid.basename == "zen.2458000.12345.xx.uvh5"
+    assert (obsid.jd, obsid.frac_jd, obsid.pol, obsid.suffix) == (
+        "2458000",
+        "12345",
+        "xx",
+        "uvh5",
+    )
+    assert mt.Obsid("/data/zen.2458000.12345.xx.uvh5") == obsid
+    assert len({obsid, mt.Obsid(obsid.path)}) == 1
+
+    # each path of an index is parsed once
+    index = mt.ObsidIndex([obsid.path, "zen.2458000.12345.uv", obsid.path])
+    assert index.parsed[1] is index.parsed[2]
+    assert index.parsed[1] == obsid
+
+    # the polarization is optional
+    obsid = mt.Obsid("zen.2458000.12345.uv")
+    assert (obsid.jd, obsid.pol, obsid.suffix) == ("2458000", None, "uv")
+    obsid = mt.Obsid("foo.uvh5")
+    assert obsid.jd is obsid.frac_jd is obsid.pol is obsid.suffix is None
+
+    return
+
+
+def test_args_template(config_options):
+    obsids = list(config_options["obsids_time_discontinuous"]) + [
+        "zen.2458043.40887.HH.uvh5",
+        "zen.2458043.41632.HH.uvh5",
+    ]
+    index = mt.ObsidIndex(obsids)
+    template = mt.ArgsTemplate(
+        "{basename} {prev_basename} {next_basename} {basename[-2]} {jd} {foo}"
+    )
+    assert template.tokens == {"basename", "prev_basename", "next_basename", "jd"}
+
+    obsid = "zen.2458043.41632.HH.uvh5"
+    context = mt.ArgsContext(obsid, index, index.positions[obsid])
+    assert template.render(context) == (
+        "zen.2458043.41632.HH.uvh5 zen.2458043.40887.HH.uvh5 None "
+        "zen.2458043.40141.HH.uvh5 2458043 {foo}"
+    )
+    obsid = "zen.2458044.40141.HH.uvh5"
+    context = mt.ArgsContext(obsid, index, index.positions[obsid])
+    assert template.render(context) == (
+        "zen.2458044.40141.HH.uvh5 None None None 2458044 {foo}"
+    )
+
+    # only the basename is needed without an index
+    template = mt.ArgsTemplate("{basename}")
+    assert template.render(mt.ArgsContext(obsid)) == obsid
+    template = mt.ArgsTemplate("{jd} {pol}")
+    assert template.render(mt.ArgsContext(obsid)) == "2458044 HH"
+    assert template.render(mt.ArgsContext("zen.2458044.40141.uv")) == "2458044 None"
+    # shell variables are passed to the task script as they are
+    template = mt.ArgsTemplate("${jd} ${pol} {jd}")
+    assert template.tokens == {"jd"}
+    assert template.render(mt.ArgsContext(obsid)) == "${jd} ${pol} 2458044"
+    template = mt.ArgsTemplate("{basename[1]}")
+    with pytest.raises(ValueError, match="obsids must be provided"):
+        template.render(mt.ArgsContext(obsid))
+    with pytest.raises(ValueError, match="not found in list of obsids"):
+        template.render(mt.ArgsContext(obsid, index))
+
+    # templates can be pickled
+    template = pickle.loads(pickle.dumps(template))
+    assert template.tokens == {"basename"}
+
+    return
+
+
+def test_register_args_token(config_options):
+    obsid = config_options["obsids"][0]
+    assert mt.prep_args("{upper}", obsid) == "{upper}"
+
+    @mt.register_args_token("upper")
+    def _upper_token(context):
+        return context.basename.upper()
+
+    try:
+        assert mt.prep_args("{upper}", obsid) == obsid.upper()
+    finally:
+        mt._ARGS_TOKENS.pop("upper")
+        mt._compile_args_template.cache_clear()
+
+    return
+
+
 def test_prep_args_obsid_list(config_options):
     # define args to parse
     obsids_list = config_options["obsids"]
@@ -1158,6 +2575,9 @@ def test_prep_args_obsid_list_error(config_options):
     args = "{obsid_list}"
     obsid = obsids_list[1]
 
+    with pytest.raises(ValueError, match="when requesting obsid_list"):
+        mt.prep_args(args, obsid, chunk_size="3")
+
     with pytest.raises(ValueError) as cm:
         args = mt.prep_args(
             args,
@@ -21,6 +21,39 @@ def test_get_makeflow_ArgumentParser():
     assert parsed_args.scan_files is False
     assert parsed_args.rename_bad_files is False
     assert parsed_args.bad_suffix == ".METADATA_ERROR"
+    assert parsed_args.order == "obsid"
+    assert parsed_args.transitive_reduction is False
+    assert parsed_args.barriers is False
+    assert parsed_args.plan is False
+    assert parsed_args.profile is False
+    assert parsed_args.pstats is None
+
+    return
+
+
+def test_get_season_ArgumentParser():
+    a = utils.get_season_ArgumentParser()
+    args = ["-c", "config_file.toml", "-j", "4", "/foo/bar"]
+    parsed_args = a.parse_args(args)
+    assert parsed_args.config == "config_file.toml"
+    assert parsed_args.season_dir == "/foo/bar"
+    assert parsed_args.max_workers == 4
+    assert parsed_args.suffix == ".uvh5"
+    assert parsed_args.output_format == "make"
+    assert parsed_args.fuse is False
+    assert parsed_args.barriers is False
+
+    return
+
+
+def test_get_makespan_ArgumentParser():
+    a = utils.get_makespan_ArgumentParser()
+    args = ["-c", "config_file.toml", "-J", "10", "20", "--", "zen.2458000.12345.uv"]
+    parsed_args = a.parse_args(args)
+    assert parsed_args.config == "config_file.toml"
+    assert parsed_args.files == ["zen.2458000.12345.uv"]
+    assert parsed_args.jobs == [10, 20]
+    assert parsed_args.logs is None
 
     return
 
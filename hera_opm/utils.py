@@ -71,6 +71,207 @@ def get_makeflow_ArgumentParser():
         help="Directory into which all wrappers and makeflow file will be written.",
         type=str,
     )
+    ap.add_argument(
+        "--incremental",
+        action="store_true",
+        default=False,
+        help="Only rewrite the wrappers and makeflow file that changed since the last build, using a manifest kept next to the makeflow file.",
+    )
+    ap.add_argument(
+        "--output-format",
+        default="make",
+        choices=["make", "jx"],
+        help="Format of the makeflow file: classic Make-like syntax ('make', default) or a JX workflow ('jx'), run with makeflow --jx.",
+    )
+    ap.add_argument(
+        "--fuse",
+        action="store_true",
+        default=False,
+        help="Run chains of actions that each only need the previous action for the same obsid back to back in a single job.",
+    )
+    ap.add_argument(
+        "--order",
+        default="obsid",
+        choices=["obsid", "critical_path"],
+        help="Order of the rules in the makeflow file: all the tasks of each obsid in turn ('obsid', default), or the tasks with the longest remaining path first ('critical_path'), so that makeflow starts long chains early.",
+    )
+    ap.add_argument(
+        "--transitive-reduction",
+        action="store_true",
+        default=False,
+        help="Drop the prerequisites of each rule that are implied by its other prerequisites.",
+    )
+    ap.add_argument(
+        "--barriers",
+        action="store_true",
+        default=False,
+        help="Make the tasks that wait for a whole JD wait for a single local barrier rule.",
+    )
+    ap.add_argument(
+        "--plan",
+        action="store_true",
+        default=False,
+        help="Print a summary of the tasks, dependencies, files and resources of the workflow, without writing the makeflow file or wrapper scripts.",
+    )
+    ap.add_argument(
+        "--profile",
+        action="store_true",
+        default=False,
+        help="Print the wall time and number of calls of each phase of the build.",
+    )
+    ap.add_argument(
+        "--pstats",
+        default=None,
+        type=str,
+        help="Profile the build with cProfile, and dump the statistics to this file for reading with pstats.",
+    )
+    return ap
+
+
+def get_season_ArgumentParser():
+    """Get an ArgumentParser instance for building the makeflows of a season.
+
+    Parameters
+    ----------
+    None
+
+    Returns
+    -------
+    ap : ArgumentParser instance
+        A parser suitable for interpreting the desired arguments.
+    """
+    ap = argparse.ArgumentParser()
+
+    # set relevant properties
+    ap.prog = "build_season_makeflows.py"
+    ap.add_argument(
+        "-c",
+        "--config",
+        required=True,
+        type=str,
+        help="Full path to config file defining the analysis workflow.",
+    )
+    ap.add_argument(
+        "season_dir",
+        type=str,
+        help="Folder containing a folder of data files for each night, named by JD.",
+    )
+    ap.add_argument(
+        "-s",
+        "--suffix",
+        default=".uvh5",
+        type=str,
+        help="Ending of the data files of each night. Default is '.uvh5'.",
+    )
+    ap.add_argument(
+        "-d",
+        "--work-dir",
+        default=None,
+        help="Directory in which a folder is made for each night, holding its wrappers and makeflow file.",
+        type=str,
+    )
+    ap.add_argument(
+        "-j",
+        "--max-workers",
+        default=None,
+        type=int,
+        help="Number of processes building makeflows at once. Default is the number of processors.",
+    )
+    ap.add_argument(
+        "--output-format",
+        default="make",
+        choices=["make", "jx"],
+        help="Format of the makeflow files: classic Make-like syntax ('make', default) or a JX workflow ('jx'), run with makeflow --jx.",
+    )
+    ap.add_argument(
+        "--fuse",
+        action="store_true",
+        default=False,
+        help="Run chains of actions that each only need the previous action for the same obsid back to back in a single job.",
+    )
+    ap.add_argument(
+        "--order",
+        default="obsid",
+        choices=["obsid", "critical_path"],
+        help="Order of the rules in the makeflow file: all the tasks of each obsid in turn ('obsid', default), or the tasks with the longest remaining path first ('critical_path'), so that makeflow starts long chains early.",
+    )
+    ap.add_argument(
+        "--transitive-reduction",
+        action="store_true",
+        default=False,
+        help="Drop the prerequisites of each rule that are implied by its other prerequisites.",
+    )
+    ap.add_argument(
+        "--barriers",
+        action="store_true",
+        default=False,
+        help="Make the tasks that wait for a whole JD wait for a single local barrier rule.",
+    )
+    return ap
+
+
+def get_makespan_ArgumentParser():
+    """Get an ArgumentParser instance for estimating the wall time of a makeflow.
+
+    Parameters
+    ----------
+    None
+
+    Returns
+    -------
+    ap : ArgumentParser instance
+        A parser suitable for interpreting the desired arguments.
+    """
+    ap = argparse.ArgumentParser()
+
+    # set relevant properties
+    ap.prog = "estimate_makespan.py"
+    ap.add_argument(
+        "-c",
+        "--config",
+        required=True,
+        type=str,
+        help="Full path to config file defining the analysis workflow. The runtime of the tasks of each action is read from its 'runtime' entry.",
+    )
+    ap.add_argument(
+        "files",
+        metavar="files",
+        type=str,
+        nargs="+",
+        help="Files to apply the pipeline to.",
+    )
+    ap.add_argument(
+        "--logs",
+        default=None,
+        type=str,
+        help="Work directory of a previous run, whose log files give the runtime of each action. These take precedence over the config file.",
+    )
+    ap.add_argument(
+        "--default-runtime",
+        default=None,
+        type=float,
+        help="Runtime in hours of the actions without a known runtime.",
+    )
+    ap.add_argument(
+        "-J",
+        "--jobs",
+        nargs="+",
+        default=[1, 2, 4, 8, 16, 32, 64, 128, 256],
+        type=int,
+        help="Numbers of concurrent jobs to predict the wall time for.",
+    )
+    ap.add_argument(
+        "--fuse",
+        action="store_true",
+        default=False,
+        help="Fuse chains of actions, as for build_makeflow_from_config.py.",
+    )
+    ap.add_argument(
+        "--order",
+        default="obsid",
+        choices=["obsid", "critical_path"],
+        help="Order of the rules, as for build_makeflow_from_config.py.",
+    )
     return ap
 
 
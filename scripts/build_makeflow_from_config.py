@@ -18,6 +18,19 @@ scan_files = args.scan_files
 rename_bad_files = args.rename_bad_files
 bad_suffix = args.bad_suffix
 work_dir = args.work_dir
+incremental = args.incremental
+output_format = args.output_format
+kwargs = {"output_format": output_format}
+if args.fuse:
+    kwargs["fuse"] = True
+if args.order != "obsid":
+    kwargs["order"] = args.order
+if args.transitive_reduction:
+    kwargs["transitive_reduction"] = True
+if args.barriers:
+    kwargs["barriers"] = True
+if args.profile or args.pstats is not None:
+    kwargs["profile"] = mt.PhaseProfiler(pstats_file=args.pstats)
 
 bad_metadata_obsids = []
 if scan_files:
@@ -35,9 +48,57 @@ if scan_files:
             if rename_bad_files:
                 os.rename(obsid, obsid + bad_suffix)
 
-obsid_list = " ".join(obsids)
-print(f"Generating makeflow file from config file {config} for obsids {obsid_list}")
-mt.build_makeflow_from_config(obsids, config, output, work_dir=work_dir)
+if args.plan:
+    print(f"Planning makeflow from config file {config} for {len(obsids)} obsids")
+    plan_kwargs = {"dry_run": True}
+    if args.fuse:
+        plan_kwargs["fuse"] = True
+    if args.barriers:
+        plan_kwargs["barriers"] = True
+    dag = mt.build_dag_from_config(obsids, config, work_dir=work_dir, **plan_kwargs)
+    if args.transitive_reduction:
+        dag = dag.transitive_reduction()
+    summary = dag.summary()
+    print(f"{summary['tasks']} tasks, {summary['edges']} dependencies")
+    print(f"{'category':<24} {'tasks':>8} {'dependencies':>13}")
+    for category, ntasks in summary["tasks_per_category"].items():
+        nedges = summary["edges_per_category"][category]
+        print(f"{str(category):<24} {ntasks:>8} {nedges:>13}")
+    print(
+        f"depth: {summary['depth']}, largest level: {max(summary['widths'], default=0)} tasks"
+    )
+    target, nparents = summary["max_fan_in"]
+    print(f"largest fan-in: {nparents} tasks, for {target}")
+    # the wrapper scripts, logs and outputs of the tasks, and the makeflow file
+    print(f"files to be created: {summary['files'] + 1}")
+    if summary["core_hours"] is None:
+        print(
+            "core-hours and memory-hours: unknown without a timeout or a runtime "
+            "for every action"
+        )
+    else:
+        print(f"core-hours: {summary['core_hours']:.1f}")
+        print(f"memory: {summary['memory_hours'] / 1000:.1f} GB-hours")
+else:
+    obsid_list = " ".join(obsids)
+    print(f"Generating makeflow file from config file {config} for obsids {obsid_list}")
+    if incremental:
+        report = mt.build_makeflow_from_config(
+            obsids,
+            config,
+            output,
+            work_dir=work_dir,
+            incremental=True,
+            **kwargs,
+        )
+        for key in ("added", "changed", "removed"):
+            print(f"{len(report[key])} tasks {key}")
+    else:
+        mt.build_makeflow_from_config(
+            obsids, config, output, work_dir=work_dir, **kwargs
+        )
+    if args.profile:
+        print(kwargs["profile"].report())
 
 for obsid in bad_metadata_obsids:
     print(f"Bad metadata in {obsid}")
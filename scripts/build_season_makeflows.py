@@ -0,0 +1,32 @@
+#!/usr/bin/env python
+# -*- mode: python; coding: utf-8 -*-
+# Copyright (c) 2018 The HERA Collaboration
+# Licensed under the 2-clause BSD License
+"""Script for generating the makeflows of every night of a season in parallel."""
+
+from hera_opm import mf_tools as mt
+from hera_opm import utils
+
+a = utils.get_season_ArgumentParser()
+args = a.parse_args()
+kwargs = {"output_format": args.output_format}
+if args.fuse:
+    kwargs["fuse"] = True
+if args.order != "obsid":
+    kwargs["order"] = args.order
+if args.transitive_reduction:
+    kwargs["transitive_reduction"] = True
+if args.barriers:
+    kwargs["barriers"] = True
+
+print(f"Generating makeflow files from config file {args.config} for {args.season_dir}")
+makeflows = mt.build_season_makeflows(
+    args.season_dir,
+    args.config,
+    suffix=args.suffix,
+    work_dir=args.work_dir,
+    max_workers=args.max_workers,
+    **kwargs,
+)
+for jd, mf_name in makeflows.items():
+    print(f"{jd}: {mf_name}")
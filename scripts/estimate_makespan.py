@@ -0,0 +1,30 @@
+#!/usr/bin/env python
+# -*- mode: python; coding: utf-8 -*-
+# Copyright (c) 2018 The HERA Collaboration
+# Licensed under the 2-clause BSD License
+"""Script for predicting the wall time of a makeflow against the number of jobs."""
+
+from hera_opm import mf_tools as mt
+from hera_opm import utils
+
+a = utils.get_makespan_ArgumentParser()
+args = a.parse_args()
+
+runtimes = mt.runtimes_from_config(args.config)
+if args.logs is not None:
+    runtimes.update(mt.runtimes_from_logs(args.logs))
+
+dag = mt.build_analysis_dag(args.files, args.config, fuse=args.fuse, dry_run=True)
+durations = dag.task_durations(runtimes, args.default_runtime)
+if args.order == "critical_path":
+    dag = dag.sorted_by_priority(durations)
+    durations = dag.task_durations(runtimes, args.default_runtime)
+critical, path = dag.critical_path(durations)
+
+print(f"{len(dag)} tasks, {sum(durations):.2f} hours of work")
+print(f"critical path: {critical:.2f} hours through {len(path)} tasks")
+for task in path:
+    print(f"    {dag.rules[task].target}")
+print(f"{'jobs':>6} {'lower bound (h)':>16} {'predicted (h)':>14}")
+for nslots, lower_bound, predicted in dag.makespan_table(durations, args.jobs):
+    print(f"{nslots:>6} {lower_bound:>16.2f} {predicted:>14.2f}")
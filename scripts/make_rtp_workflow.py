@@ -3,8 +3,8 @@
 """Daemon script for automatically generating a makeflow for new raw data."""
 
 import os
+import json
 import time
-import datetime
 import subprocess
 
 from astropy.time import Time
@@ -27,12 +27,97 @@ STORAGE_LOCATION = "/mnt/sn1"
 WORKFLOW_CONFIG = (
     "/home/obs/src/hera_pipelines/pipelines/h5c/rtp/v1/h5c_rtp_stage_1.toml"
 )
+MF_ROOT = "/home/obs/rtp_makeflow"
 CONDA_ENV = "RTP"
 ALLOWED_TAGS = ["engineering", "science"]
 
 # get around potential problem of HDF5 not being able to lock files
 os.environ["HDF5_USE_FILE_LOCKING"] = "FALSE"
 
+
+def night_location(jd):
+    """Get the directory of the makeflow of a night."""
+    return os.path.join(MF_ROOT, str(jd))
+
+
+def night_mf_name(jd):
+    """Get the name of the makeflow file of a night."""
+    return "rtp_{:d}.mf".format(jd)
+
+
+def night_state(jd):
+    """Get the state of the makeflow of a night, or None if it was not started.
+
+    The state is kept by `extend_makeflow` next to the makeflow file.
+    """
+    state_file = os.path.join(night_location(jd), night_mf_name(jd) + ".state")
+    if not os.path.exists(state_file):
+        return None
+    with open(state_file) as f:
+        return json.load(f)
+
+
+def finalize_nights_before(jd):
+    """Finish the workflows of all of the nights before a JD.
+
+    The nights are found from their makeflow states in MF_ROOT rather than
+    kept in memory, so a night that was left open when this script stopped
+    is still finished once a later night starts.
+    """
+    for name in sorted(os.listdir(MF_ROOT)):
+        if not name.isdigit() or int(name) >= jd:
+            continue
+        night = int(name)
+        state = night_state(night)
+        if state is None or state["final"]:
+            continue
+        added = mt.extend_makeflow(
+            night_location(night), [], mf_name=night_mf_name(night), final=True
+        )
+        if len(added) > 0:
+            run_makeflow(night)
+
+
+def run_makeflow(jd):
+    """(Re)run the makeflow of a night inside of screen.
+
+    Makeflow only reads its file when it starts, so the rules appended while
+    it runs are picked up by the next run. If the previous run is still going,
+    the next one is queued in the screen session and starts when it finishes,
+    so new tasks can wait for the whole previous run rather than for a single
+    monitoring interval. At most one run is queued at a time: a marker file
+    is removed when the queued run starts, and until then the run that is
+    already queued will pick up any newly appended rules.
+    """
+    mf_path = os.path.join(night_location(jd), night_mf_name(jd))
+    queued = mf_path + ".queued"
+    if os.path.exists(queued):
+        return
+    cmd = (
+        "rm -f {}; conda deactivate; conda activate {}; makeflow -T slurm {}\n".format(
+            queued, CONDA_ENV, mf_path
+        )
+    )
+    screen_name = "rtp_{:d}".format(jd)
+    screen_ls = subprocess.run(["screen", "-ls"], capture_output=True, text=True)
+    screen_cmd1 = ["screen", "-d", "-m", "-S", screen_name]
+    screen_cmd2 = ["screen", "-S", screen_name, "-p", "0", "-X", "stuff", cmd]
+    try:
+        if "." + screen_name + "\t" not in screen_ls.stdout:
+            subprocess.check_call(screen_cmd1)
+        open(queued, "w").close()
+        subprocess.check_call(screen_cmd2)
+    except subprocess.CalledProcessError as e:
+        if os.path.exists(queued):
+            os.remove(queued)
+        raise ValueError(
+            "Error spawning screen session; command was {}; returncode was {:d}; "
+            "output was {}; stderr was {}".format(
+                e.cmd, e.returncode, e.output, e.stderr
+            )
+        )
+
+
 # make a redis pool and initialize connection
 redis_pool = redis.ConnectionPool(host=REDIS_HOST, port=REDIS_PORT, db=0)
 rsession = redis.Redis(connection_pool=redis_pool)
@@ -104,41 +189,40 @@ while True:
             except (IntegrityError, UniqueViolation):
                 continue
 
+        # all of the files of a night go into one makeflow, named after its JD
+        jd = int(float(new_files[0][4:17]))
+
         # make target directory if it doesn't exist
-        date = datetime.date.today().strftime("%y%m%d")
-        MF_LOCATION = os.path.join("/home/obs/rtp_makeflow", date)
+        MF_LOCATION = night_location(jd)
         if not os.path.isdir(MF_LOCATION):
             os.makedirs(MF_LOCATION)
 
-        # make a date stamp from the first file in the makeflow filename
-        jd0 = float(new_files[0][4:17])
-        t0 = Time(jd0, format="jd", out_subfmt="date_hms")
-        mf_name = "rtp_{}.mf".format(t0.isot)
-        mf_path = os.path.join(MF_LOCATION, mf_name)
+        # finish the workflows of the previous nights that are still open
+        finalize_nights_before(jd)
+
+        # files that arrive after their night was finished cannot be added
+        state = night_state(jd)
+        if state is not None and state["final"]:
+            print(
+                "The makeflow of night {:d} was finalized; not adding {}".format(
+                    jd, " ".join(file_paths)
+                )
+            )
+            rsession.hset("rtp:has_new_data", "state", "False")
+            continue
 
         # change working location
         os.chdir(MF_LOCATION)
 
-        # make a workflow
-        mt.build_makeflow_from_config(file_paths, WORKFLOW_CONFIG, mf_path, MF_LOCATION)
-
-        # launch workflow inside of screen
-        cmd = "conda deactivate; conda activate {}; makeflow -T slurm {}\n".format(
-            CONDA_ENV, mf_path
+        # add the new files to the workflow
+        added = mt.extend_makeflow(
+            MF_LOCATION,
+            file_paths,
+            config_file=WORKFLOW_CONFIG,
+            mf_name=night_mf_name(jd),
         )
-        screen_name = "rtp_{}".format(str(int(jd0)))
-        screen_cmd1 = ["screen", "-d", "-m", "-S", screen_name]
-        screen_cmd2 = ["screen", "-S", screen_name, "-p", "0", "-X", "stuff", cmd]
-        try:
-            subprocess.check_call(screen_cmd1)
-            subprocess.check_call(screen_cmd2)
-        except subprocess.CalledProcessError as e:
-            raise ValueError(
-                "Error spawning screen session; command was {}; returncode was {:d}; "
-                "output was {}; stderr was {}".format(
-                    e.cmd, e.returncode, e.output, e.stderr
-                )
-            )
+        if len(added) > 0:
+            run_makeflow(jd)
 
         # update redis
         rsession.hset("rtp:has_new_data", "state", "False")